@@ -0,0 +1,94 @@
+"""
+Benchmark of DBSqlLiteCache with long-lived connection against connection per call.
+
+    python -m benchmarks.cache_connection --count 2000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from crawler.cache import DBSqlLiteCache, DB_MOD
+
+
+class PerCallConnectCache:
+    """
+    Old behaviour of cache: each call opens connection, executes one statement and closes connection
+    """
+
+    def __init__(self, path):
+        self.db_path = path
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('create table videos (channel_id text, video_id text PRIMARY KEY, valid boolean, '
+                     'priority float, full_description text, short_description text);')
+        conn.commit()
+        conn.close()
+
+    def insert_video_descr(self, video):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('insert into videos values(?, ?, ?, ?, ?, ?)', (
+            video['channel_id'], video['video_id'], video['valid'], video['priority'],
+            video['full_description'], video['short_description'],
+        ))
+        conn.commit()
+        conn.close()
+
+    def check_exist_video(self, video_id):
+        conn = sqlite3.connect(self.db_path)
+        res = conn.execute('select video_id from videos where video_id=?', (video_id,)).fetchone()
+        conn.close()
+        return res is not None
+
+
+def create_video(i):
+    return {
+        'video_id': 'video%08d' % i,
+        'channel_id': 'channel%04d' % (i % 100),
+        'valid': True,
+        'priority': 0,
+        'full_description': '{"title": "video %d"}' % i,
+        'short_description': None,
+    }
+
+
+def measure(cache, count):
+    videos = [create_video(i) for i in range(count)]
+    start = time.perf_counter()
+    for video in videos:
+        cache.insert_video_descr(video)
+    insert_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for video in videos:
+        cache.check_exist_video(video['video_id'])
+    select_time = time.perf_counter() - start
+    return count / insert_time, count / select_time
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--count', default=2000, type=int, help='count of inserted and selected videos')
+    args.add_argument('--journal-mode', default='wal', type=str, help='journal mode of long-lived connection')
+    args.add_argument('--synchronous', default='normal', type=str, help='synchronous mode of long-lived connection')
+    args = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        per_call = PerCallConnectCache(os.path.join(tmp_dir, 'per_call.sqlite'))
+        long_lived = DBSqlLiteCache(
+            path=os.path.join(tmp_dir, 'long_lived.sqlite'), db_mod=DB_MOD.NEW,
+            journal_mode=args.journal_mode, synchronous=args.synchronous,
+        )
+        results = [
+            ('per call connect', measure(per_call, args.count)),
+            ('long-lived %s/%s' % (args.journal_mode, args.synchronous), measure(long_lived, args.count)),
+        ]
+        long_lived.close()
+
+    print('%-28s %14s %14s' % ('cache', 'insert ops/s', 'select ops/s'))
+    for name, (insert_ops, select_ops) in results:
+        print('%-28s %14.0f %14.0f' % (name, insert_ops, select_ops))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark of DBSqlLiteCache.set_channels and DBSqlLiteCache.set_base_channels (batch upsert) against old
+per channel select and insert or update.
+
+    python -m benchmarks.cache_upsert --sizes 10000 100000 1000000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from crawler.cache import DBSqlLiteCache, DB_MOD
+
+
+def per_channel_set_channels(conn, channels, scrapped, valid):
+    """
+    Old behaviour of set_channels: one select and one insert or update for each channel
+    """
+    for channel in channels:
+        args = [channel['channel_id'], valid, scrapped, False, channel['priority'],
+                channel['full_description'], channel['short_description']]
+        res = conn.execute('select channel_id from channels where channel_id=?', (channel['channel_id'],)).fetchone()
+        if res is None:
+            conn.execute('insert into channels(channel_id, valid, scrapped, downloaded, priority, full_description, '
+                         'short_description) values(?, ?, ?, ?, ?, ?, ?)', args)
+            continue
+        conn.execute('update channels set channel_id=?, valid=?, scrapped=?, downloaded=?, priority=?, '
+                     'full_description=?, short_description=? where channel_id=?', args + [channel['channel_id']])
+    conn.commit()
+
+
+def per_channel_set_base_channels(conn, channel_ids):
+    """
+    Old behaviour of set_base_channels without replace
+    """
+    for channel_id in channel_ids:
+        res = conn.execute('select channel_id from channels where channel_id=?', (channel_id,)).fetchone()
+        if res is None:
+            conn.execute('insert into channels(channel_id, base_channel) values(?, ?)', (channel_id, True))
+    conn.commit()
+
+
+def create_channels(size):
+    return [{
+        'channel_id': 'UC%022d' % i,
+        'priority': i % 7,
+        'full_description': None,
+        'short_description': '{"title": "channel %d"}' % i,
+    } for i in range(size)]
+
+
+def measure(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def bench(tmp_dir, size):
+    channels = create_channels(size)
+    # Half of channels exists into data base, so both insert and update paths are used
+    half = channels[:size // 2]
+    channel_ids = [channel['channel_id'] for channel in channels]
+
+    old_path = os.path.join(tmp_dir, 'old_%d.sqlite' % size)
+    DBSqlLiteCache(path=old_path, db_mod=DB_MOD.NEW).close()
+    conn = sqlite3.connect(old_path)
+    conn.execute('pragma journal_mode=wal')
+    conn.execute('pragma synchronous=normal')
+    per_channel_set_channels(conn, half, False, True)
+    old_channels = measure(per_channel_set_channels, conn, channels, True, True)
+    old_base = measure(per_channel_set_base_channels, conn, channel_ids)
+    conn.close()
+
+    cache = DBSqlLiteCache(path=os.path.join(tmp_dir, 'new_%d.sqlite' % size), db_mod=DB_MOD.NEW)
+    cache.set_channels(half, scrapped=False, valid=True)
+    new_channels = measure(cache.set_channels, channels, True, True)
+    new_base = measure(cache.set_base_channels, channel_ids)
+    cache.close()
+    return (old_channels, new_channels), (old_base, new_base)
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--sizes', default=[10000, 100000, 1000000], nargs='+', type=int, help='count of channels')
+    args = args.parse_args()
+
+    print('%-10s %-18s %12s %12s %9s' % ('rows', 'method', 'per row, s', 'upsert, s', 'speedup'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            results = zip(('set_channels', 'set_base_channels'), bench(tmp_dir, size))
+            for name, (old, new) in results:
+                print('%-10d %-18s %12.3f %12.3f %8.1fx' % (size, name, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
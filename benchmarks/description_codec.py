@@ -0,0 +1,126 @@
+"""
+Size and throughput of compression of full descriptions (crawler.codec) on synthetic youtube-dl descriptions.
+
+    python -m benchmarks.description_codec --count 2000
+"""
+import argparse
+import json
+import os
+import random
+import string
+import tempfile
+import time
+
+from crawler import codec
+from crawler.cache import DBSqlLiteCache, DB_MOD
+from crawler.codec import COMPRESSION, DescriptionCodec
+
+
+def random_token(rnd, size):
+    return ''.join(rnd.choice(string.ascii_letters + string.digits + '-_') for _ in range(size))
+
+
+def create_descr(rnd, i):
+    """
+    Description is similar to result of youtube-dl extractor: many formats, thumbnails and captions with signed urls
+    """
+    video_id = random_token(rnd, 11)
+    base_url = 'https://r%d---sn-%s.googlevideo.com/videoplayback?expire=1548%06d&ei=%s&id=o-%s&itag=%%s&source=youtube'
+    base_url = base_url % (rnd.randint(1, 9), random_token(rnd, 8), rnd.randint(0, 999999), random_token(rnd, 20),
+                           random_token(rnd, 40))
+    formats = [{
+        'format_id': str(itag),
+        'url': base_url % itag,
+        'ext': rnd.choice(['webm', 'm4a', 'mp4', '3gp']),
+        'width': rnd.choice([None, 256, 426, 640, 854, 1280, 1920]),
+        'height': rnd.choice([None, 144, 240, 360, 480, 720, 1080]),
+        'acodec': rnd.choice(['opus', 'mp4a.40.2', 'none']),
+        'vcodec': rnd.choice(['vp9', 'avc1.4d401e', 'none']),
+        'filesize': rnd.randint(10 ** 5, 10 ** 8),
+        'tbr': rnd.random() * 3000,
+        'format_note': rnd.choice(['tiny', '144p', '360p', '720p', 'DASH audio']),
+        'http_headers': {'User-Agent': 'Mozilla/5.0', 'Accept-Language': 'en-us,en;q=0.5'},
+    } for itag in rnd.sample(range(5, 400), 24)]
+    captions = {
+        lang: [{'ext': ext, 'url': 'https://www.youtube.com/api/timedtext?v=%s&lang=%s&fmt=%s&signature=%s' % (
+            video_id, lang, ext, random_token(rnd, 40))} for ext in ['srv1', 'srv2', 'srv3', 'ttml', 'vtt']]
+        for lang in rnd.sample(['ru', 'en', 'de', 'fr', 'es', 'it', 'uk', 'pl', 'ja', 'ko', 'zh-Hans'], 8)
+    }
+    return json.dumps({
+        'id': video_id,
+        'title': 'Video number %d %s' % (i, random_token(rnd, 20)),
+        'description': ' '.join(random_token(rnd, rnd.randint(2, 10)) for _ in range(rnd.randint(10, 200))),
+        'uploader': 'Channel %d' % (i % 50),
+        'channel_id': 'UC' + random_token(rnd, 22),
+        'duration': rnd.randint(10, 7200),
+        'view_count': rnd.randint(0, 10 ** 7),
+        'upload_date': '2019%02d%02d' % (rnd.randint(1, 12), rnd.randint(1, 28)),
+        'tags': [random_token(rnd, 8) for _ in range(rnd.randint(0, 15))],
+        'thumbnails': [{'url': 'https://i.ytimg.com/vi/%s/%s.jpg' % (video_id, name), 'id': str(j)}
+                       for j, name in enumerate(['default', 'mqdefault', 'hqdefault', 'sddefault', 'maxresdefault'])],
+        'formats': formats,
+        'requested_formats': formats[:2],
+        'automatic_captions': captions,
+    })
+
+
+def create_codecs(train_samples):
+    codecs = [
+        ('text', DescriptionCodec()),
+        ('zlib-1', DescriptionCodec(COMPRESSION.ZLIB, level=1)),
+        ('zlib-6', DescriptionCodec(COMPRESSION.ZLIB, level=6)),
+        ('zlib-9', DescriptionCodec(COMPRESSION.ZLIB, level=9)),
+    ]
+    if codec.zstandard is not None:
+        zstd_dict = codec.train_zstd_dict(train_samples)
+        codecs += [
+            ('zstd-3', DescriptionCodec(COMPRESSION.ZSTD, level=3)),
+            ('zstd-19', DescriptionCodec(COMPRESSION.ZSTD, level=19)),
+            ('zstd-3+dict', DescriptionCodec(COMPRESSION.ZSTD, level=3, zstd_dict=zstd_dict)),
+        ]
+    return codecs
+
+
+def db_size(tmp_dir, name, c, descrs):
+    path = os.path.join(tmp_dir, name + '.sqlite')
+    with DBSqlLiteCache(path=path, db_mod=DB_MOD.NEW, codec=c, video_batch_size=1000) as cache:
+        for i, descr in enumerate(descrs):
+            cache.insert_video_descr({
+                'video_id': 'video%08d' % i, 'channel_id': 'X', 'valid': True, 'priority': 0,
+                'full_description': descr, 'short_description': None,
+            })
+        cache.vacuum()
+    return os.path.getsize(path)
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--count', default=2000, type=int, help='count of descriptions')
+    args.add_argument('--seed', default=0, type=int, help='seed of generator of descriptions')
+    args = args.parse_args()
+
+    rnd = random.Random(args.seed)
+    train_samples = [create_descr(rnd, i) for i in range(1000)]
+    descrs = [create_descr(rnd, i) for i in range(args.count)]
+    raw_size = sum(len(descr.encode('utf-8')) for descr in descrs)
+
+    print('descriptions: %d, avg size: %.1f KiB' % (len(descrs), raw_size / len(descrs) / 1024))
+    print('%-12s %8s %12s %12s %12s' % ('codec', 'ratio', 'encode MB/s', 'decode MB/s', 'db, MiB'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, c in create_codecs(train_samples):
+            start = time.perf_counter()
+            values = [c.encode(descr) for descr in descrs]
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for value in values:
+                c.decode(value)
+            decode_time = time.perf_counter() - start
+            size = sum(len(value) if isinstance(value, bytes) else len(value.encode('utf-8')) for value in values)
+            print('%-12s %8.2f %12.1f %12.1f %12.1f' % (
+                name, raw_size / size, raw_size / encode_time / 1e6, raw_size / decode_time / 1e6,
+                db_size(tmp_dir, name, c, descrs) / 2 ** 20,
+            ))
+
+
+if __name__ == '__main__':
+    main()
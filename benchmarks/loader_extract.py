@@ -0,0 +1,93 @@
+"""
+Throughput of extraction of ytInitialData and ytInitialPlayerResponse from channel page (crawler.loaders.Loader)
+against extraction by slices of page. Row 'data only' decodes the only section which is needed by parsers (see
+crawler.loaders.PageConfig). Page is built from tests/data/om_tv.json (data config) and tests/data/wild_fox.json
+(player config).
+
+    python -m benchmarks.loader_extract --pages 200
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from crawler.loaders import Loader, Section
+
+PAGE = '''<!DOCTYPE html><html><head><title>channel</title>%(padding)s</head><body><script >
+    window["ytInitialData"] = %(data)s;
+    window["ytInitialPlayerResponse"] = (
+        %(player)s);
+    if (window.ytcsi) {window.ytcsi.tick("pdr", null, '')}
+</script>%(padding)s</body></html>'''
+
+
+def create_page(data_path, player_path):
+    with open(data_path) as fd:
+        data = json.dumps(json.load(fd), separators=(',', ':'), ensure_ascii=False)
+    with open(player_path) as fd:
+        player = json.dumps(json.load(fd), separators=(',', ':'), ensure_ascii=False)
+    padding = '<script>var x = "%s";</script>' % ('a' * 100000)
+    return PAGE % {'data': data, 'player': player, 'padding': padding}
+
+
+def extract_by_slices(text, config, pattern_found):
+    """
+    Extraction before raw_decode: rest of page is copied by slice to find terminator of script
+    """
+    start_ind = text.find(config) + len(config)
+    finish_ind = start_ind + text[start_ind:].find(pattern_found)
+    return json.loads(text[start_ind:finish_ind])
+
+
+def parse_by_slices(text, loader):
+    data_config = extract_by_slices(text, loader._data_config_prefix, ';\n')
+    player_config = extract_by_slices(text, loader._player_config_prefix, ');\n')
+    return player_config, data_config
+
+
+def measure(parse, text, pages):
+    start = time.perf_counter()
+    for _ in range(pages):
+        res = parse(text)
+    return (time.perf_counter() - start) / pages, res
+
+
+def peak_memory(parse, text):
+    """
+    :return: peak of memory (in bytes) which is allocated by parsing of page, decoded configs are included
+    """
+    tracemalloc.start()
+    parse(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--pages', default=200, type=int, help='count of parsed pages')
+    args.add_argument('--data', default='tests/data/om_tv.json', help='json of data config')
+    args.add_argument('--player', default='tests/data/wild_fox.json', help='json of player config')
+    args = args.parse_args()
+
+    text = create_page(args.data, args.player)
+    loader = Loader()
+    size = len(text.encode('utf-8'))
+    print('page size: %.1f KiB, pages: %d' % (size / 1024, args.pages))
+    print('%-12s %12s %12s %16s' % ('extraction', 'ms/page', 'MB/s', 'peak mem, MiB'))
+    results = []
+    for name, parse in [
+        ('slices', lambda t: parse_by_slices(t, loader)),
+        ('raw_decode', lambda t: tuple(loader._parse_page(t))),
+        ('data only', lambda t: (results[0][0], loader._parse_page(t)[Section.Data])),
+    ]:
+        latency, res = measure(parse, text, args.pages)
+        results.append(res)
+        print('%-12s %12.2f %12.1f %16.2f' % (
+            name, latency * 1000, size / latency / 1e6, peak_memory(parse, text) / 2 ** 20,
+        ))
+    assert results[0] == results[1] == results[2]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Latency of page loading by loaders with shared HTTP session (crawler.loaders.create_session) against new connection
+per page. Local HTTPS server with self-signed certificate stands in for youtube (openssl is required).
+
+    python -m benchmarks.loader_session --pages 500 --workers 1 8
+"""
+import argparse
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from crawler.loaders import Reloader, create_session
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = b''
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NewConnectionSession:
+    """
+    Every request opens new connection, as loaders did before shared session
+    """
+
+    @staticmethod
+    def request(method, url, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+
+def create_cert(tmp_dir):
+    cert_path, key_path = os.path.join(tmp_dir, 'cert.pem'), os.path.join(tmp_dir, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1', '-keyout', key_path, '-out', cert_path,
+    ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_path, key_path
+
+
+def start_server(cert_path, key_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(reloader, pages, workers):
+    def load(i):
+        start = time.perf_counter()
+        reloader.load({'ctoken': 'token%d' % i, 'itct': 'itct'})
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        latencies = sorted(executor.map(load, range(pages)))
+    total = time.perf_counter() - start
+    return latencies, pages / total
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--pages', default=500, type=int, help='count of loaded pages')
+    args.add_argument('--workers', default=[1, 8], type=int, nargs='+', help='counts of threads')
+    args.add_argument('--page-size', default=100, type=int, help='size of page in KiB')
+    args = args.parse_args()
+
+    Handler.body = json.dumps({'data': 'x' * (args.page_size * 1024)}).encode('utf-8')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cert_path, key_path = create_cert(tmp_dir)
+        # Self-signed certificate is trusted by requests and sessions
+        os.environ['REQUESTS_CA_BUNDLE'] = cert_path
+        server = start_server(cert_path, key_path)
+        url = 'https://127.0.0.1:%d/browse_ajax/' % server.server_port
+
+        print('pages: %d, page size: %d KiB' % (args.pages, args.page_size))
+        print('%-16s %8s %10s %10s %10s %10s' % ('session', 'workers', 'mean, ms', 'p50, ms', 'p95, ms', 'pages/s'))
+        for workers in args.workers:
+            for name, session in [
+                    ('new connection', NewConnectionSession()),
+                    ('shared session', create_session(pool_maxsize=workers))]:
+                latencies, throughput = measure(Reloader(base_url=url, session=session), args.pages, workers)
+                print('%-16s %8d %10.2f %10.2f %10.2f %10.0f' % (
+                    name, workers, statistics.mean(latencies) * 1000, latencies[len(latencies) // 2] * 1000,
+                    latencies[int(len(latencies) * 0.95)] * 1000, throughput,
+                ))
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Memory and lookup speed of in-memory seen index (crawler.id_set) against python set of str.
+
+    python -m benchmarks.seen_ids --size 10000000
+"""
+import argparse
+import base64
+import os
+import time
+import tracemalloc
+
+from crawler.id_set import BloomFilter, PackedIdSet, pack_channel_id, pack_video_id
+
+
+def create_video_ids(size):
+    raw = os.urandom(8 * size)
+    return [base64.urlsafe_b64encode(raw[i:i + 8])[:11].decode('ascii') for i in range(0, len(raw), 8)]
+
+
+def create_channel_ids(size):
+    raw = os.urandom(16 * size)
+    return ['UC' + base64.urlsafe_b64encode(raw[i:i + 16])[:22].decode('ascii') for i in range(0, len(raw), 16)]
+
+
+def python_set_memory(ids):
+    tracemalloc.start()
+    s = set(ids)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del s
+    # Memory of str objects themselves
+    return size + sum(len(id_) + 49 for id_ in ids)
+
+
+def lookups_per_second(seen, ids):
+    start = time.perf_counter()
+    for id_ in ids:
+        _ = id_ in seen
+    return len(ids) / (time.perf_counter() - start)
+
+
+def main():
+    args = argparse.ArgumentParser()
+    args.add_argument('--size', default=1000000, type=int, help='count of ids')
+    args.add_argument('--set-sample', default=1000000, type=int,
+                      help='count of ids for measure python set (result is scaled to size)')
+    args.add_argument('--bloom-error-rate', default=0.01, type=float, help='error rate of Bloom filter')
+    args = args.parse_args()
+
+    rows = []
+    for name, create, pack, width in [
+            ('videos', create_video_ids, pack_video_id, 8),
+            ('channels', create_channel_ids, pack_channel_id, 16)]:
+        ids = create(args.size)
+        probes = create(100000)
+
+        start = time.perf_counter()
+        packed = PackedIdSet(pack, width)
+        packed.update(ids)
+        build_time = time.perf_counter() - start
+        rows.append((name, 'packed set', packed.memory_usage(), build_time, lookups_per_second(packed, probes)))
+        del packed
+
+        if name == 'channels':
+            start = time.perf_counter()
+            bloom = BloomFilter(args.size, args.bloom_error_rate)
+            bloom.update(ids)
+            build_time = time.perf_counter() - start
+            rows.append((name, 'bloom filter', bloom.memory_usage(), build_time, lookups_per_second(bloom, probes)))
+            del bloom
+
+        sample = ids[:min(args.set_sample, args.size)]
+        memory = python_set_memory(sample) * args.size / len(sample)
+        rows.append((name, 'python set of str', memory, float('nan'), lookups_per_second(set(sample), probes)))
+
+    print('size: %d' % args.size)
+    print('%-10s %-18s %12s %10s %14s' % ('ids', 'structure', 'memory, MiB', 'build, s', 'lookups/s'))
+    for name, structure, memory, build_time, lookups in rows:
+        print('%-10s %-18s %12.1f %10.2f %14.0f' % (name, structure, memory / 2 ** 20, build_time, lookups))
+
+
+if __name__ == '__main__':
+    main()
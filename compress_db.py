@@ -0,0 +1,68 @@
+import argparse
+import logging
+import sqlite3
+
+from crawler.cache import DBSqlLiteCache, DB_MOD
+from crawler.codec import COMPRESSION, DescriptionCodec, train_zstd_dict
+
+
+# One-shot migration of full descriptions of channels and videos to another compression:
+#     python compress_db.py --sqlite-path data/db.sqlite --compression zstd --train-zstd-dict 10000 \
+#         --zstd-dict-path data/descr.dict
+
+
+def parse():
+    args = argparse.ArgumentParser()
+    args.add_argument('--sqlite-path', default='data/db.sqlite', type=str, help='path to sqlite database file')
+    args.add_argument(
+        '--compression',
+        default=COMPRESSION.ZLIB,
+        choices=[COMPRESSION.NONE, COMPRESSION.ZLIB, COMPRESSION.ZSTD],
+        type=COMPRESSION,
+        help='compression of full descriptions',
+    )
+    args.add_argument('--compression-level', default=None, type=int, help='level of compression')
+    args.add_argument('--zstd-dict-path', default=None, type=str, help='path to zstd dictionary')
+    args.add_argument(
+        '--train-zstd-dict',
+        default=0,
+        type=int,
+        help='count of video descriptions for training of zstd dictionary. Dictionary is saved to --zstd-dict-path',
+    )
+    args.add_argument('--batch-size', default=1000, type=int, help='count of rows into one transaction')
+    args.add_argument('--vacuum', action='store_true', help='return free pages to file system after migration')
+    return vars(args.parse_args())
+
+
+def load_samples(path, count):
+    conn = sqlite3.connect(path)
+    c = conn.execute('select full_description from videos where full_description is not null limit ?', (count,))
+    decoder = DescriptionCodec()
+    samples = [decoder.decode(row[0]) for row in c]
+    conn.close()
+    return samples
+
+
+def main():
+    logging.basicConfig(format='%(asctime)-15s %(levelname)s [%(name)s]: %(message)s', level=logging.INFO)
+    args = parse()
+
+    zstd_dict = None
+    if args['train_zstd_dict'] > 0:
+        zstd_dict = train_zstd_dict(load_samples(args['sqlite_path'], args['train_zstd_dict']))
+        with open(args['zstd_dict_path'], 'wb') as fd:
+            fd.write(zstd_dict)
+    elif args['zstd_dict_path'] is not None:
+        with open(args['zstd_dict_path'], 'rb') as fd:
+            zstd_dict = fd.read()
+
+    codec = DescriptionCodec(args['compression'], level=args['compression_level'], zstd_dict=zstd_dict)
+    with DBSqlLiteCache(path=args['sqlite_path'], db_mod=DB_MOD.OLD, codec=codec) as cache:
+        count = cache.recode_descriptions(batch_size=args['batch_size'])
+        logging.info("descriptions were rewritten: %d" % count)
+        if args['vacuum']:
+            cache.vacuum()
+
+
+if __name__ == '__main__':
+    main()
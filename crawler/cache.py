@@ -1,9 +1,15 @@
+import json
 import logging
 import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from enum import Enum
 
 from crawler import utils
+from crawler.codec import DescriptionCodec
+from crawler.id_set import BloomFilter, PackedIdSet, pack_channel_id, pack_video_id
 
 
 class DB_MOD(Enum):
@@ -22,29 +28,28 @@ class DB_MOD(Enum):
         return self.value
 
 
-def create_args_set_update_base_channels(channel_id):
-    return [
-        channel_id,
-        True,
-        channel_id
-    ]
+# Count of ids into one IN-list. It is less than SQLITE_MAX_VARIABLE_NUMBER of old sqlite versions (999)
+MAX_IN_LIST_SIZE = 500
 
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SYNCHRONOUS_MODES = ('off', 'normal', 'full', 'extra')
 
-def create_args_set_insert_base_channels(channel_id):
+
+def create_args_set_base_channels(channel_id):
     return [
         channel_id,
         True
     ]
 
 
-def create_args_update_channels(channel, scrapped, valid):
+def create_args_update_channels(channel, scrapped, valid, encode=None):
     return [
         channel['channel_id'],
         valid,
         scrapped,
         False,
         channel['priority'],
-        channel['full_description'],
+        channel['full_description'] if encode is None else encode(channel['full_description']),
         channel['short_description']
     ]
 
@@ -67,6 +72,9 @@ class DBSqlLiteCache:
         * field downloaded: if field sets True, then channel was download with all available videos (or limited videos)
 
     You can set hard, new or old DB (see DB_MOD)
+
+    Cache holds the only connection to the data base during its lifetime. Connection is shared between threads and
+    guarded by lock. Call method close (or use cache as context manager) for releasing connection.
     """
 
     __sql_query_create_channel = '''
@@ -91,30 +99,25 @@ class DBSqlLiteCache:
       short_description text
     );'''
 
-    __sql_update_channel = '''
-    update channels
-    set
-      channel_id=?,
-      valid=?,
-      scrapped=?,
-      downloaded=?,
-      priority=?,
-      full_description=?,
-      short_description=?
-    where channel_id=?;
-    '''
-
-    __sql_insert_channel = '''
+    __sql_upsert_channel = '''
     insert into channels(
       channel_id,
-      valid, 
-      scrapped, 
-      downloaded, 
-      priority, 
-      full_description, 
+      valid,
+      scrapped,
+      downloaded,
+      priority,
+      full_description,
       short_description
-    ) 
+    )
     values(?, ?, ?, ?, ?, ?, ?)
+    on conflict(channel_id) do update
+    set
+      valid=excluded.valid,
+      scrapped=excluded.scrapped,
+      downloaded=excluded.downloaded,
+      priority=excluded.priority,
+      full_description=excluded.full_description,
+      short_description=excluded.short_description;
     '''
 
     __sql_insert_video = '''
@@ -124,25 +127,46 @@ class DBSqlLiteCache:
       valid,
       priority,
       full_description,
-      short_description
-    ) 
-    values(?, ?, ?, ?, ?, ?)
+      short_description,
+      archive_description
+    )
+    values(?, ?, ?, ?, ?, ?, ?)
+    on conflict(video_id) do nothing;
     '''
 
     __sql_insert_base_channel = '''
     insert into channels(
       channel_id,
       base_channel
-    ) 
+    )
     values(?, ?)
+    on conflict(channel_id) do nothing;
     '''
 
-    __sql_update_base_channel = '''
-    update channels
+    # Discovered channel is inserted if it is absent. Existing channel keeps its state, its short description is
+    # filled only if it was not known
+    __sql_insert_neighb_channel = '''
+    insert into channels(
+      channel_id,
+      priority,
+      short_description
+    )
+    values(?, ?, ?)
+    on conflict(channel_id) do update
     set
-      channel_id=?,
-      base_channel=?
-    where channel_id=?;
+      short_description=excluded.short_description
+    where channels.short_description is null and excluded.short_description is not null;
+    '''
+
+    __sql_upsert_base_channel = '''
+    insert into channels(
+      channel_id,
+      base_channel
+    )
+    values(?, ?)
+    on conflict(channel_id) do update
+    set
+      base_channel=excluded.base_channel;
     '''
 
     __sql_update_failed_channel = '''
@@ -162,10 +186,17 @@ class DBSqlLiteCache:
     __sql_update_downloaded_channel = '''
     update channels
     set
-      downloaded=?
+      downloaded=?,
+      last_crawl=?,
+      upload_rate=?,
+      next_visit=?
     where channel_id=?;
     '''
 
+    __sql_select_crawl_stats = '''
+    select last_crawl, upload_rate from channels where channel_id=?
+    '''
+
     __sql_update_video = '''
     update videos
     set
@@ -181,20 +212,238 @@ class DBSqlLiteCache:
     select video_id from videos where video_id=? 
     '''
 
+    __sql_select_exist_videos = '''
+    select video_id from videos where video_id in (%s)
+    '''
+
+    __sql_select_exist_channels = '''
+    select channel_id from channels where channel_id in (%s)
+    '''
+
+    __sql_select_crawled_channels = '''
+    select channel_id from channels
+    where channel_id in (%s) and (scrapped = TRUE or downloaded = TRUE or valid = FALSE)
+    '''
+
+    __sql_select_videos = '''
+    select video_id from videos
+    '''
+
+    __sql_select_channels = '''
+    select channel_id from channels
+    '''
+
+    __sql_select_video = '''
+    select channel_id, video_id, valid, priority, full_description, short_description, archive_description
+    from videos where video_id=?
+    '''
+
+    __sql_select_channel = '''
+    select channel_id, base_channel, valid, scrapped, downloaded, priority, full_description, short_description
+    from channels where channel_id=?
+    '''
+
+    __sql_select_descriptions = '''
+    select rowid, %(column)s from %(table)s
+    where rowid > ? and %(column)s is not null
+    order by rowid limit ?
+    '''
+
+    __sql_update_description = '''
+    update %(table)s set %(column)s=? where rowid=?
+    '''
+
     __sql_get_best_channel = '''
     select channel_id from channels
     where channels.valid = TRUE and channels.downloaded = FALSE 
+      and (channels.lease_expires is null or channels.lease_expires <= ?)
     order by NOT channels.scrapped, NOT channels.base_channel, -channels.priority 
     '''
 
+    __sql_get_best_channels = __sql_get_best_channel + '''
+    limit ?
+    '''
+
+    # Downloaded channels are visited again after next_visit (see update_channel_downloaded). Query is served by
+    # partial index channels_revisit
+    __sql_get_due_channels = '''
+    select channel_id from channels
+    where channels.valid = TRUE and channels.downloaded = TRUE and channels.next_visit <= ?
+      and (channels.lease_expires is null or channels.lease_expires <= ?)
+    order by channels.next_visit
+    limit ?
+    '''
+
+    __sql_update_lease = '''
+    update channels
+    set
+      lease_owner=?,
+      lease_expires=?
+    where channel_id=?;
+    '''
+
+    __sql_renew_lease = '''
+    update channels
+    set
+      lease_expires=?
+    where channel_id=? and lease_owner=? and lease_expires > ?;
+    '''
+
+    __sql_release_lease = '''
+    update channels
+    set
+      lease_owner=NULL,
+      lease_expires=NULL
+    where channel_id=? and lease_owner=?;
+    '''
+
+    __sql_release_leases = '''
+    update channels
+    set
+      lease_owner=NULL,
+      lease_expires=NULL
+    where lease_owner=?;
+    '''
+
+    # Deferred channel keeps lease without owner, so it is skipped by all workers till lease expires and it isn't
+    # released by release_channels
+    __sql_defer_channel = '''
+    update channels
+    set
+      lease_owner=NULL,
+      lease_expires=?,
+      last_crawl=NULL
+    where channel_id=?;
+    '''
+
+    __sql_select_last_crawl = '''
+    select last_crawl, full_description from channels where channel_id=?
+    '''
+
+    # Each item is one version of data base schema (pragma user_version). Migrations are applied to old data bases
+    # in order of versions, new data bases get all of them after creating tables
+    __migrations = [
+        # 1: partial index over frontier. It has the same expressions as order of __sql_get_best_channel, so
+        # selection of the best channel is index seek instead of full scan and sort
+        [
+            '''
+            create index if not exists channels_frontier
+            on channels(NOT scrapped, NOT base_channel, -priority)
+            where valid = TRUE and downloaded = FALSE;
+            ''',
+        ],
+        # 2: full youtube-dl description of video (opt-in archive, see crawler.YoutubeCrawler)
+        [
+            '''
+            alter table videos add column archive_description blob;
+            ''',
+        ],
+        # 3: leases of channels which are claimed by workers (see claim_best_channels)
+        [
+            '''
+            alter table channels add column lease_owner text;
+            ''',
+            '''
+            alter table channels add column lease_expires float;
+            ''',
+        ],
+        # 4: freshness of downloaded channels (see update_channel_downloaded and revisit_budget)
+        [
+            '''
+            alter table channels add column last_crawl float;
+            ''',
+            '''
+            alter table channels add column upload_rate float;
+            ''',
+            '''
+            alter table channels add column next_visit float;
+            ''',
+            # Channels which were downloaded before migration are due for revisit
+            '''
+            update channels set next_visit = 0 where downloaded = TRUE;
+            ''',
+            '''
+            create index if not exists channels_revisit
+            on channels(next_visit)
+            where valid = TRUE and downloaded = TRUE;
+            ''',
+        ],
+    ]
+
     def __create_db(self, conn):
         conn.execute(self.__sql_query_create_channel)
         conn.execute(self.__sql_query_create_videos)
         conn.commit()
 
-    def __init__(self, path='data/db.sqlite', db_mod=DB_MOD.NEW):
-        if db_mod == DB_MOD.HARD and os.path.exists(path):
-            os.remove(path)
+    def __migrate(self, conn):
+        # Several processes can open one data base at once, so version is read under write lock of migration. Else
+        # both processes would apply the same migration
+        while True:
+            conn.execute('begin immediate')
+            try:
+                version = conn.execute('pragma user_version').fetchone()[0]
+                if version >= len(self.__migrations):
+                    conn.rollback()
+                    return
+                logging.info("migrate data base %s to version %d" % (self.db_path, version + 1))
+                for query in self.__migrations[version]:
+                    conn.execute(query)
+                conn.execute('pragma user_version=%d' % (version + 1))
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def __init__(self, path='data/db.sqlite', db_mod=DB_MOD.NEW, journal_mode='wal', synchronous='normal',
+                 cache_size=-64000, timeout=30., cached_statements=128, seen_index=False,
+                 channel_bloom_capacity=None, channel_bloom_error_rate=0.01, video_batch_size=1,
+                 video_flush_interval=None, codec=None, revisit_budget=0., revisit_min_interval=86400.,
+                 revisit_max_interval=30 * 86400., upload_rate_smoothing=0.5):
+        """
+        :param path: path to sqlite data base file
+        :param db_mod: mod of data base (see DB_MOD)
+        :param journal_mode: sqlite journal mode (see JOURNAL_MODES). WAL allows readers don't block writer
+        :param synchronous: sqlite synchronous mode (see SYNCHRONOUS_MODES). NORMAL is safe enough for WAL
+        :param cache_size: sqlite page cache size. Negative value is size in KiB, positive value is count of pages
+        :param timeout: how many seconds connection waits for lock of data base
+        :param cached_statements: count of prepared statements which connection reuses
+        :param seen_index: if it is True, then ids of videos and channels are kept into memory (see
+            crawler.id_set.PackedIdSet). Index is warmed from data base and updated on every insert, so checks of
+            exist don't touch data base. Index is process-local: rows inserted by another process are not seen
+        :param channel_bloom_capacity: if it is set, then channels are kept into Bloom filter of this capacity
+            instead of exact set. Negative answers don't touch data base, positive answers are checked into data base
+        :param channel_bloom_error_rate: probability of false positive answer of Bloom filter
+        :param video_batch_size: videos are buffered and are inserted by one transaction when count of them reaches
+            video_batch_size. Buffer is flushed before channel is marked as downloaded and on close too, so videos of
+            downloaded channel are never lost. 1 means that every video is inserted at once
+        :param video_flush_interval: buffer of videos is flushed on insert if first buffered video is older than
+            video_flush_interval seconds. None means that buffer is flushed by size only
+        :param codec: codec of full descriptions of channels and videos (see crawler.codec.DescriptionCodec). By
+            default descriptions are stored as text
+        :param revisit_budget: share of selected channels (from 0 to 1) which are due revisits of downloaded channels
+            instead of channels of frontier. Due revisits are selected when frontier is empty too. 0 means that
+            downloaded channels are never visited again
+        :param revisit_min_interval: min time (in seconds) between crawls of channel. Channel with unknown upload rate
+            is visited again after it
+        :param revisit_max_interval: max time (in seconds) between crawls of channel. Channel without new videos is
+            visited again after it
+        :param upload_rate_smoothing: weight of last observed upload rate into estimated one (exponential smoothing)
+        """
+        if video_batch_size < 1:
+            raise AttributeError("Attribute video_batch_size must be more 0")
+        if journal_mode not in JOURNAL_MODES:
+            raise AttributeError("Attribute journal_mode must be one of: %s" % ', '.join(JOURNAL_MODES))
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise AttributeError("Attribute synchronous must be one of: %s" % ', '.join(SYNCHRONOUS_MODES))
+        if not 0 <= revisit_budget <= 1:
+            raise AttributeError("Attribute revisit_budget must be from 0 to 1")
+        if not 0 < revisit_min_interval <= revisit_max_interval:
+            raise AttributeError("Attribute revisit_min_interval must be more 0 and not more revisit_max_interval")
+        if not 0 < upload_rate_smoothing <= 1:
+            raise AttributeError("Attribute upload_rate_smoothing must be more 0 and not more 1")
+
+        if db_mod == DB_MOD.HARD:
+            self.__remove_db_files(path)
 
         if db_mod == DB_MOD.NEW and os.path.exists(path):
             msg = "data base has already exist. set DB_MODE == HARD or DB_MODE == OLD. path: %s"
@@ -203,10 +452,90 @@ class DBSqlLiteCache:
             msg = "data base has not already exist. set DB_MODE == HARD or DB_MODE == NEW. path: %s"
             raise FileExistsError(msg % os.path.abspath(path))
         self.db_path = path
-        conn = sqlite3.connect(self.db_path)
+        self.__lock = threading.RLock()
+        self.__conn = sqlite3.connect(
+            self.db_path, timeout=timeout, check_same_thread=False, cached_statements=cached_statements
+        )
+        self.__conn.execute('pragma journal_mode=%s' % journal_mode)
+        self.__conn.execute('pragma synchronous=%s' % synchronous)
+        self.__conn.execute('pragma cache_size=%d' % int(cache_size))
         if db_mod != DB_MOD.OLD:
-            self.__create_db(conn)
-        conn.close()
+            self.__create_db(self.__conn)
+        self.__migrate(self.__conn)
+
+        self.__codec = codec if codec is not None else DescriptionCodec()
+        self.__video_batch_size = video_batch_size
+        self.__video_flush_interval = video_flush_interval
+        self.__video_buffer = []
+        self.__video_buffer_ids = set()
+        self.__video_buffer_start = None
+
+        self.__revisit_budget = revisit_budget
+        self.__revisit_min_interval = revisit_min_interval
+        self.__revisit_max_interval = revisit_max_interval
+        self.__upload_rate_smoothing = upload_rate_smoothing
+        # Budget is accumulated by every selected channel and is spent by revisits, so they are interleaved evenly
+        self.__revisit_credit = 0.
+
+        self.__seen_videos = None
+        self.__seen_channels = None
+        self.__seen_channels_exact = channel_bloom_capacity is None
+        if seen_index:
+            self.__warm_seen_index(channel_bloom_capacity, channel_bloom_error_rate)
+
+    def __warm_seen_index(self, channel_bloom_capacity, channel_bloom_error_rate, batch_size=100000):
+        self.__seen_videos = PackedIdSet(pack_video_id, 8)
+        self.__seen_channels = PackedIdSet(pack_channel_id, 16)
+        if channel_bloom_capacity is not None:
+            self.__seen_channels = BloomFilter(channel_bloom_capacity, channel_bloom_error_rate)
+        tables = [
+            (self.__seen_videos, self.__sql_select_videos),
+            (self.__seen_channels, self.__sql_select_channels),
+        ]
+        for seen, query in tables:
+            c = self.__conn.execute(query)
+            rows = c.fetchmany(batch_size)
+            while len(rows) != 0:
+                seen.update(row[0] for row in rows)
+                rows = c.fetchmany(batch_size)
+            c.close()
+        msg = "seen index was warmed. videos: %d (%d bytes), channels: %d bytes"
+        logging.info(msg % (len(self.__seen_videos), self.__seen_videos.memory_usage(),
+                            self.__seen_channels.memory_usage()))
+
+    @staticmethod
+    def __remove_db_files(path):
+        # WAL and shared memory files of old data base must be removed too, else sqlite applies them to new one
+        for filename in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        This method flushes buffered videos and closes connection to data base. Cache can't be used after that
+        """
+        with self.__lock:
+            if self.__conn is not None:
+                self.flush_videos()
+                self.__conn.close()
+                self.__conn = None
+
+    @contextmanager
+    def _transaction(self):
+        """
+        This context manager locks connection and commits changes on exit (or rollbacks them after exception)
+        """
+        with self.__lock:
+            if self.__conn is None:
+                raise utils.CacheError(msg="connection to data base was closed")
+            with self.__conn:
+                yield self.__conn
 
     def __deduplicate_channels(self, channels):
         s = set()
@@ -228,16 +557,18 @@ class DBSqlLiteCache:
         :param video_id: failed video id (str)
         :exception utils.CacheError: it is not found video id
         """
-        conn = sqlite3.connect(self.db_path)
-        if not self.__check_exist_video_id(conn, video_id):
-            raise utils.CacheError(channel_id=video_id, msg="Not found video in DB")
-        conn.execute(self.__sql_update_failed_video, (False, video_id))
-        conn.commit()
-        conn.close()
+        with self.__lock:
+            with self._transaction() as conn:
+                self.__write_video_buffer(conn)
+                if not self.__check_exist_video_id(conn, video_id):
+                    raise utils.CacheError(channel_id=video_id, msg="Not found video in DB")
+                conn.execute(self.__sql_update_failed_video, (False, video_id))
+            self.__clear_video_buffer()
 
     def insert_video_descr(self, video):
         """
-        This method inserts video description into data base
+        This method inserts video description into data base. Video is buffered (see video_batch_size) and video which
+        already exists into data base is ignored
 
         :param video: description of video: (
             {
@@ -247,6 +578,7 @@ class DBSqlLiteCache:
                 'short_description': short_descr,
                 'valid': valid,
                 'priority': priority,
+                'archive_description': archive_descr,  # optional
             }
         )
         """
@@ -256,15 +588,49 @@ class DBSqlLiteCache:
             video['video_id'],
             video['valid'],
             video['priority'],
-            video['full_description'],
+            self.__codec.encode(video['full_description']),
             video['short_description'],
+            self.__codec.encode(video.get('archive_description')),
         )
 
-        # TODO: this method doesn't tested
-        conn = sqlite3.connect(self.db_path)
-        conn.execute(self.__sql_insert_video, data)
-        conn.commit()
-        conn.close()
+        with self.__lock:
+            if video['video_id'] in self.__video_buffer_ids:
+                return
+            if self.__video_buffer_start is None:
+                self.__video_buffer_start = time.monotonic()
+            self.__video_buffer.append(data)
+            self.__video_buffer_ids.add(video['video_id'])
+            if self.__seen_videos is not None:
+                self.__seen_videos.add(video['video_id'])
+            if self.__is_video_buffer_full():
+                self.flush_videos()
+
+    def __is_video_buffer_full(self):
+        if len(self.__video_buffer) >= self.__video_batch_size:
+            return True
+        if self.__video_flush_interval is None:
+            return False
+        return time.monotonic() - self.__video_buffer_start >= self.__video_flush_interval
+
+    def __write_video_buffer(self, conn):
+        if len(self.__video_buffer) != 0:
+            conn.executemany(self.__sql_insert_video, self.__video_buffer)
+
+    def __clear_video_buffer(self):
+        self.__video_buffer = []
+        self.__video_buffer_ids = set()
+        self.__video_buffer_start = None
+
+    def flush_videos(self):
+        """
+        This method inserts all buffered videos by one transaction
+        """
+        with self.__lock:
+            if len(self.__video_buffer) == 0:
+                return
+            with self._transaction() as conn:
+                self.__write_video_buffer(conn)
+            self.__clear_video_buffer()
 
     def check_exist_video(self, video_id):
         """
@@ -273,14 +639,62 @@ class DBSqlLiteCache:
         :param video_id: video id
         :return exist video (bool)
         """
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute(self.__sql_select_exist_video, (video_id,))
-        res = c.fetchone()
-        c.close()
-        return res is not None and len(res) != 0
+        with self._transaction() as conn:
+            return self.__check_exist_video_id(conn, video_id)
+
+    def check_exist_videos(self, video_ids):
+        """
+        This method checks exist of many videos by chunked IN-list queries
+
+        :param video_ids: iterable of video ids
+        :return set of video ids which exist into data base
+        """
+        with self._transaction() as conn:
+            if self.__seen_videos is not None:
+                return {video_id for video_id in video_ids if video_id in self.__seen_videos}
+            video_ids = list(video_ids)
+            exist_ids = {video_id for video_id in video_ids if video_id in self.__video_buffer_ids}
+            return exist_ids | self.__select_exist(conn, self.__sql_select_exist_videos, video_ids)
+
+    def check_exist_channel(self, channel_id):
+        """
+        This method check exist channel and returns True if there is one or else another
+
+        :param channel_id: channel id
+        :return exist channel (bool)
+        """
+        with self._transaction() as conn:
+            return self.__check_exist_channel_id(conn, channel_id)
+
+    def check_exist_channels(self, channel_ids):
+        """
+        This method checks exist of many channels by chunked IN-list queries
+
+        :param channel_ids: iterable of channel ids
+        :return set of channel ids which exist into data base
+        """
+        with self._transaction() as conn:
+            if self.__seen_channels is not None:
+                channel_ids = [channel_id for channel_id in channel_ids if channel_id in self.__seen_channels]
+                if self.__seen_channels_exact:
+                    return set(channel_ids)
+            return self.__select_exist(conn, self.__sql_select_exist_channels, channel_ids)
+
+    @staticmethod
+    def __select_exist(conn, query, ids):
+        ids = list(set(ids))
+        exist_ids = set()
+        for i in range(0, len(ids), MAX_IN_LIST_SIZE):
+            chunk = ids[i:i + MAX_IN_LIST_SIZE]
+            c = conn.execute(query % ','.join('?' * len(chunk)), chunk)
+            exist_ids.update(row[0] for row in c)
+        return exist_ids
 
     def __check_exist_video_id(self, conn, video_id):
+        if self.__seen_videos is not None:
+            return video_id in self.__seen_videos
+        if video_id in self.__video_buffer_ids:
+            return True
         c = conn.cursor()
         c.execute(self.__sql_select_exist_video, (video_id,))
         res = c.fetchone()
@@ -288,6 +702,11 @@ class DBSqlLiteCache:
         return res is not None and len(res) != 0
 
     def __check_exist_channel_id(self, conn, channel_id):
+        if self.__seen_channels is not None:
+            if channel_id not in self.__seen_channels:
+                return False
+            if self.__seen_channels_exact:
+                return True
         c = conn.cursor()
         c.execute(self.__sql_select_exist_channel, (channel_id,))
         res = c.fetchone()
@@ -300,27 +719,17 @@ class DBSqlLiteCache:
 
         :param channels_id: list of channel ids for insert
         :param replace: field is True, then duplicate channel is replace else is not replace. Base_channel was updated.
-            Another fields don't update
+            Another fields don't update. All channels are upserted by one batch into one transaction
         """
 
         channels = []
         for channel_id in channels_id:
             channels.append({'channel_id': channel_id})
         channels = self.__deduplicate_channels(channels)
-        conn = sqlite3.connect(self.db_path)
-        for channel in channels:
-            channel_id = channel['channel_id']
-            query = self.__sql_insert_base_channel
-            args = create_args_set_insert_base_channels(channel_id)
-            is_exist_channel_id = self.__check_exist_channel_id(conn, channel_id)
-            if is_exist_channel_id and not replace:
-                continue
-            if is_exist_channel_id and replace:
-                query = self.__sql_update_base_channel
-                args = create_args_set_update_base_channels(channel_id)
-            conn.execute(query, args)
-        conn.commit()
-        conn.close()
+        query = self.__sql_upsert_base_channel if replace else self.__sql_insert_base_channel
+        with self._transaction() as conn:
+            conn.executemany(query, (create_args_set_base_channels(channel['channel_id']) for channel in channels))
+        self.__add_seen_channels(channels)
 
     def set_channels(self, channels, scrapped, valid):
         """
@@ -330,7 +739,8 @@ class DBSqlLiteCache:
             * valid==False, scrapped==False, downloaded==False
         If you want got more information, see class description.
 
-        This function insert new channel and update old channels fully (without field base_channel)
+        This function insert new channel and update old channels fully (without field base_channel). All channels are
+        upserted by one batch into one transaction
 
         :param channels: describe of channel: (
             [{
@@ -343,18 +753,41 @@ class DBSqlLiteCache:
         :param scrapped: scrapped or not channel (bool)
         :param valid: valid or invalid channel (bool)
         """
-        conn = sqlite3.connect(self.db_path)
         channels = self.__deduplicate_channels(channels)
-        for channel in channels:
-            channel_id = channel['channel_id']
-            query = self.__sql_insert_channel
-            args = create_args_update_channels(channel, scrapped, valid)
-            if self.__check_exist_channel_id(conn, channel_id):
-                query = self.__sql_update_channel
-                args.append(channel_id)
-            conn.execute(query, args)
-        conn.commit()
-        conn.close()
+        with self._transaction() as conn:
+            conn.executemany(
+                self.__sql_upsert_channel,
+                (create_args_update_channels(ch, scrapped, valid, self.__codec.encode) for ch in channels)
+            )
+        self.__add_seen_channels(channels)
+
+    def add_neighb_channels(self, channels):
+        """
+        This method inserts channels which were discovered on pages of another channels. Unlike set_channels, existing
+        channels aren't updated (only unknown short description is filled), so scrapped, downloaded and invalid
+        channels don't come back to frontier. All channels are inserted by one batch into one transaction
+
+        :param channels: describe of channel (see set_channels). Field full_description is ignored
+        :return: count of existing channels which were scrapped, downloaded or invalid. set_channels would have
+            returned them to frontier, so it is count of avoided re-crawls
+        """
+        channels = self.__deduplicate_channels(channels)
+        with self._transaction() as conn:
+            channel_ids = [channel['channel_id'] for channel in channels]
+            if self.__seen_channels is not None:
+                channel_ids = [channel_id for channel_id in channel_ids if channel_id in self.__seen_channels]
+            crawled_ids = self.__select_exist(conn, self.__sql_select_crawled_channels, channel_ids)
+            conn.executemany(
+                self.__sql_insert_neighb_channel,
+                ((ch['channel_id'], ch['priority'], ch['short_description']) for ch in channels)
+            )
+        self.__add_seen_channels(channels)
+        return len(crawled_ids)
+
+    def __add_seen_channels(self, channels):
+        if self.__seen_channels is not None:
+            with self.__lock:
+                self.__seen_channels.update(channel['channel_id'] for channel in channels)
 
     def update_failed_channel(self, channel_id):
         """
@@ -363,43 +796,257 @@ class DBSqlLiteCache:
         :param channel_id: failed channel id (str)
         :exception utils.CacheError: it is not found channel id
         """
-        conn = sqlite3.connect(self.db_path)
-        if not self.__check_exist_channel_id(conn, channel_id):
-            raise utils.CacheError(channel_id=channel_id, msg="not found channel in DB")
-        conn.execute(self.__sql_update_failed_channel, (False, channel_id))
-        conn.commit()
-        conn.close()
+        with self._transaction() as conn:
+            if not self.__check_exist_channel_id(conn, channel_id):
+                raise utils.CacheError(channel_id=channel_id, msg="not found channel in DB")
+            conn.execute(self.__sql_update_failed_channel, (False, channel_id))
 
-    def update_channel_downloaded(self, channel_id):
+    def update_channel_downloaded(self, channel_id, new_videos=None):
         """
         This function process next cases:
             * valid==False, scrapped==False, downloaded==True
-        If you want got more information, see c  lass description
+        If you want got more information, see class description
+
+        Buffered videos are inserted by the same transaction, so channel is never marked as downloaded without them.
+        Time of crawl is stored and next visit of channel is scheduled by its upload rate (see revisit_budget)
 
         :param channel_id: field downloaded sets as True
+        :param new_videos: count of videos which were found since previous crawl. Upload rate is estimated by it.
+            None means that upload rate is unknown
         :exception utils.CacheError: it is not found channel id
         """
-        conn = sqlite3.connect(self.db_path)
-        if not self.__check_exist_channel_id(conn, channel_id):
+        with self.__lock:
+            with self._transaction() as conn:
+                self.__write_video_buffer(conn)
+                res = conn.execute(self.__sql_select_crawl_stats, (channel_id,)).fetchone()
+                if res is None:
+                    raise utils.CacheError(channel_id=channel_id, msg="not found channel in DB")
+                now = time.time()
+                upload_rate = self.__estimate_upload_rate(res[0], res[1], now, new_videos)
+                next_visit = now + self.__revisit_interval(upload_rate)
+                conn.execute(self.__sql_update_downloaded_channel, (True, now, upload_rate, next_visit, channel_id))
+            self.__clear_video_buffer()
+
+    def __estimate_upload_rate(self, last_crawl, upload_rate, now, new_videos):
+        # Videos of first crawl are the whole history of channel, so rate is known since second crawl
+        if new_videos is None or last_crawl is None or now <= last_crawl:
+            return upload_rate
+        observed_rate = new_videos / (now - last_crawl)
+        if upload_rate is None:
+            return observed_rate
+        return self.__upload_rate_smoothing * observed_rate + (1 - self.__upload_rate_smoothing) * upload_rate
+
+    def __revisit_interval(self, upload_rate):
+        # Channel is visited again when one new video is expected
+        if upload_rate is None:
+            return self.__revisit_min_interval
+        if upload_rate <= 0:
+            return self.__revisit_max_interval
+        return min(max(1 / upload_rate, self.__revisit_min_interval), self.__revisit_max_interval)
+
+    def is_crawl_complete(self, channel_id):
+        """
+        Crawl of channel is complete if channel was downloaded (see update_channel_downloaded), its tabs weren't cut
+        (see crawler.scrapper.Scrapper.allow_partial) and it wasn't deferred since then (see defer_channel). Only
+        then all videos of channel before the newest known one are known (see crawler.parsers.ReloaderParser)
+
+        :param channel_id: channel id
+        :return: True if the last crawl of channel was complete
+        """
+        with self._transaction() as conn:
+            res = conn.execute(self.__sql_select_last_crawl, (channel_id,)).fetchone()
+        if res is None or res[0] is None:
+            return False
+        full_descr = self.__codec.decode(res[1])
+        return full_descr is None or 'partial_tabs' not in json.loads(full_descr)
+
+    def get_video_descr(self, video_id):
+        """
+        This method returns video description. Full description is decoded (see codec)
+
+        :param video_id: video id
+        :return: description of video (see insert_video_descr)
+        :exception utils.CacheError: it is not found video id
+        """
+        fields = [
+            'channel_id', 'video_id', 'valid', 'priority', 'full_description', 'short_description',
+            'archive_description',
+        ]
+        with self.__lock:
+            if video_id in self.__video_buffer_ids:
+                self.flush_videos()
+            with self._transaction() as conn:
+                res = conn.execute(self.__sql_select_video, (video_id,)).fetchone()
+        if res is None:
+            raise utils.CacheError(video_id=video_id, msg="not found video in DB")
+        video = dict(zip(fields, res))
+        video['full_description'] = self.__codec.decode(video['full_description'])
+        video['archive_description'] = self.__codec.decode(video['archive_description'])
+        return video
+
+    def get_channel_descr(self, channel_id):
+        """
+        This method returns channel description. Full description is decoded (see codec)
+
+        :param channel_id: channel id
+        :return: description of channel (see set_channels) with fields base_channel, valid, scrapped, downloaded
+        :exception utils.CacheError: it is not found channel id
+        """
+        fields = [
+            'channel_id', 'base_channel', 'valid', 'scrapped', 'downloaded', 'priority', 'full_description',
+            'short_description',
+        ]
+        with self._transaction() as conn:
+            res = conn.execute(self.__sql_select_channel, (channel_id,)).fetchone()
+        if res is None:
             raise utils.CacheError(channel_id=channel_id, msg="not found channel in DB")
-        conn.execute(self.__sql_update_downloaded_channel, (True, channel_id))
-        conn.commit()
-        conn.close()
+        channel = dict(zip(fields, res))
+        channel['full_description'] = self.__codec.decode(channel['full_description'])
+        return channel
+
+    def recode_descriptions(self, batch_size=1000):
+        """
+        This method rewrites full descriptions of all channels and videos (and archive descriptions of videos) by
+        codec of cache (for instance, it compresses old text descriptions). Every batch is rewritten by one
+        transaction, so method can be interrupted and can be restarted. Call vacuum after that for return free pages
+        to file system
+
+        :param batch_size: count of rows into one transaction
+        :return: count of rewritten rows
+        """
+        self.flush_videos()
+        count = 0
+        columns = [
+            {'table': 'channels', 'column': 'full_description'},
+            {'table': 'videos', 'column': 'full_description'},
+            {'table': 'videos', 'column': 'archive_description'},
+        ]
+        for column in columns:
+            last_rowid = 0
+            while True:
+                with self._transaction() as conn:
+                    rows = conn.execute(self.__sql_select_descriptions % column, (last_rowid, batch_size)).fetchall()
+                    if len(rows) == 0:
+                        break
+                    last_rowid = rows[-1][0]
+                    args = []
+                    for rowid, value in rows:
+                        new_value = self.__codec.encode(self.__codec.decode(value))
+                        if new_value != value:
+                            args.append((new_value, rowid))
+                    conn.executemany(self.__sql_update_description % column, args)
+                    count += len(args)
+        return count
+
+    def vacuum(self):
+        """
+        This method rebuilds data base file and returns free pages to file system
+        """
+        with self.__lock:
+            self.flush_videos()
+            if self.__conn is None:
+                raise utils.CacheError(msg="connection to data base was closed")
+            self.__conn.execute('vacuum')
 
     def get_best_channel_id(self):
         """
         This method returns the best channel_id. This method selects all channels except downloaded==True
         or valid==False. All channels ranges by priority. But there are two flags, which ones set additional ranges.
-        (see sql-query)
+        (see sql-query). Query is served by partial index channels_frontier. Channels which are leased by workers
+        (see claim_best_channels) are skipped. Downloaded channels which are due for revisit are interleaved with
+        channels of frontier by revisit_budget
 
         :return the best channel_id (str) by priority or '' if there are not any actual channels
         :exception utils.CacheError: it is not found any channel id for return
         """
-        conn = sqlite3.connect(self.db_path)
-
-        # It uses fetch one instead of top 1 as not all data bases have top directive
-        res = conn.execute(self.__sql_get_best_channel).fetchone()
-        conn.close()
-        if res is None or len(res) == 0:
+        with self._transaction() as conn:
+            channel_ids = self.__select_best_channels(conn, time.time(), 1)
+        if len(channel_ids) == 0:
             raise utils.CacheError(msg="there are not any channels")
-        return res[0]
+        return channel_ids[0]
+
+    def __select_best_channels(self, conn, now, k):
+        frontier = [row[0] for row in conn.execute(self.__sql_get_best_channels, (now, k))]
+        if self.__revisit_budget == 0:
+            return frontier
+        due = [row[0] for row in conn.execute(self.__sql_get_due_channels, (now, now, k))]
+        channel_ids = []
+        while len(channel_ids) < k and (frontier or due):
+            # Credit is capped, so revisits aren't selected by burst after long time without due channels
+            self.__revisit_credit = min(self.__revisit_credit + self.__revisit_budget, 1.)
+            if due and (self.__revisit_credit >= 1. or not frontier):
+                self.__revisit_credit = max(self.__revisit_credit - 1., 0.)
+                channel_ids.append(due.pop(0))
+            else:
+                channel_ids.append(frontier.pop(0))
+        return channel_ids
+
+    def claim_best_channels(self, worker_id, k=1, lease_seconds=600.):
+        """
+        This method atomically leases the k best channels (see get_best_channel_id) to worker. Leased channels are
+        skipped by other workers till lease expires, so several processes can crawl one data base. Channels of
+        crashed worker come back to frontier after expiration of their leases
+
+        :param worker_id: id of worker (str). It must be unique among processes which use data base
+        :param k: max count of claimed channels
+        :param lease_seconds: duration of lease. Worker must renew lease (see renew_leases) if channel is crawled
+            longer
+        :return: list of claimed channel ids ordered by priority. List is empty if there are not any free channels
+        """
+        if k < 1:
+            raise AttributeError("Attribute k must be more 0")
+        with self._transaction() as conn:
+            # Write lock is taken before select, so another process can't claim the same channels
+            conn.execute('begin immediate')
+            now = time.time()
+            channel_ids = self.__select_best_channels(conn, now, k)
+            args = [(worker_id, now + lease_seconds, channel_id) for channel_id in channel_ids]
+            conn.executemany(self.__sql_update_lease, args)
+        return channel_ids
+
+    def renew_leases(self, worker_id, channel_ids, lease_seconds=600.):
+        """
+        This method prolongs leases of channels which are still owned by worker
+
+        :param worker_id: id of worker (str)
+        :param channel_ids: list of channel ids
+        :param lease_seconds: new duration of lease from now
+        :return: set of renewed channel ids. Expired leases aren't renewed, as channel could be claimed by another
+            worker
+        """
+        renewed = set()
+        with self._transaction() as conn:
+            now = time.time()
+            for channel_id in channel_ids:
+                c = conn.execute(self.__sql_renew_lease, (now + lease_seconds, channel_id, worker_id, now))
+                if c.rowcount > 0:
+                    renewed.add(channel_id)
+        return renewed
+
+    def defer_channel(self, channel_id, delay):
+        """
+        This method returns channel to frontier after delay (e.g. its loading was stopped by deadline). Channel isn't
+        marked as failed, its lease is replaced by lease without owner. Some videos of channel can be stored already,
+        so its crawl is marked as incomplete (see is_crawl_complete)
+
+        :param channel_id: channel id (str)
+        :param delay: delay (in seconds)
+        :exception utils.CacheError: it is not found channel id
+        """
+        with self._transaction() as conn:
+            c = conn.execute(self.__sql_defer_channel, (time.time() + delay, channel_id))
+            if c.rowcount == 0:
+                raise utils.CacheError(channel_id=channel_id, msg="not found channel in DB")
+
+    def release_channels(self, worker_id, channel_ids=None):
+        """
+        This method releases leases of worker
+
+        :param worker_id: id of worker (str)
+        :param channel_ids: list of channel ids. None means all channels of worker
+        """
+        with self._transaction() as conn:
+            if channel_ids is None:
+                conn.execute(self.__sql_release_leases, (worker_id,))
+            else:
+                conn.executemany(self.__sql_release_lease, [(channel_id, worker_id) for channel_id in channel_ids])
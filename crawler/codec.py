@@ -0,0 +1,120 @@
+import threading
+import zlib
+from enum import Enum
+
+from crawler import utils
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class COMPRESSION(Enum):
+    """
+    This is different compression of descriptions into DataBase
+
+    :cvar NONE: descriptions are stored as text
+    :cvar ZLIB: descriptions are stored as zlib blobs
+    :cvar ZSTD: descriptions are stored as zstd blobs (package zstandard is required)
+    """
+    NONE = "none"
+    ZLIB = "zlib"
+    ZSTD = "zstd"
+
+    def __str__(self):
+        return self.value
+
+
+# The first byte of blob is compression of it. Text descriptions are stored as is, so old rows are decoded too
+_HEADERS = {
+    COMPRESSION.ZLIB: b'\x01',
+    COMPRESSION.ZSTD: b'\x02',
+}
+
+
+def train_zstd_dict(samples, dict_size=112640):
+    """
+    This function trains zstd dictionary by samples of descriptions
+
+    :param samples: list of descriptions (str)
+    :param dict_size: max size of dictionary in bytes
+    :return: dictionary (bytes)
+    """
+    if zstandard is None:
+        raise ImportError("package zstandard is required for training of zstd dictionary")
+    samples = [sample.encode('utf-8') for sample in samples]
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+
+class DescriptionCodec:
+    def __init__(self, compression=COMPRESSION.NONE, level=None, zstd_dict=None):
+        """
+        Codec encodes descriptions before they are written into data base and decodes them after reading. Decoding
+        doesn't depend on compression of codec: text, zlib and zstd values are decoded by their header
+
+        :param compression: compression of new descriptions (see COMPRESSION)
+        :param level: level of compression. None means default level of compressor
+        :param zstd_dict: trained zstd dictionary (bytes, see train_zstd_dict). Dictionary is required for decoding
+            of descriptions which were encoded with it
+
+        Codec is shared by threads of cache. zstd compressor and decompressor can't be used by several threads at
+        once, so every thread creates its own ones
+        """
+        if compression == COMPRESSION.ZSTD and zstandard is None:
+            raise ImportError("package zstandard is required for zstd compression")
+        self.compression = compression
+        self._level = level
+        self._zstd_dict = zstd_dict
+        self._local = threading.local()
+
+    def _zstd_params(self):
+        params = {}
+        if self._zstd_dict is not None:
+            params['dict_data'] = zstandard.ZstdCompressionDict(self._zstd_dict)
+        return params
+
+    def _get_zstd_compressor(self):
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            params = self._zstd_params()
+            if self._level is not None:
+                params['level'] = self._level
+            compressor = self._local.compressor = zstandard.ZstdCompressor(**params)
+        return compressor
+
+    def _get_zstd_decompressor(self):
+        decompressor = getattr(self._local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor(**self._zstd_params())
+        return decompressor
+
+    def encode(self, descr):
+        """
+        :param descr: description (str or None)
+        :return: description for data base (str, bytes or None)
+        """
+        if descr is None or self.compression == COMPRESSION.NONE:
+            return descr
+        data = descr.encode('utf-8')
+        if self.compression == COMPRESSION.ZLIB:
+            data = zlib.compress(data, -1 if self._level is None else self._level)
+        else:
+            data = self._get_zstd_compressor().compress(data)
+        return _HEADERS[self.compression] + data
+
+    def decode(self, value):
+        """
+        :param value: description from data base (str, bytes or None)
+        :return: description (str or None)
+        """
+        if value is None or isinstance(value, str):
+            return value
+        header, data = value[:1], value[1:]
+        if header == _HEADERS[COMPRESSION.ZLIB]:
+            return zlib.decompress(data).decode('utf-8')
+        if header == _HEADERS[COMPRESSION.ZSTD]:
+            if zstandard is None:
+                raise ImportError("package zstandard is required for zstd decompression")
+            return self._get_zstd_decompressor().decompress(data).decode('utf-8')
+        raise utils.CacheError(msg="unknown compression of description: %r" % header)
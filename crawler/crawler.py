@@ -1,22 +1,116 @@
+import asyncio
+import inspect
 import logging
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from crawler import parsers, utils
 from crawler.cache import DBSqlLiteCache
 from crawler.loaders import Loader, Reloader, YoutubeDlLoader, Tab
+from crawler.retry import RetryPolicy
 from crawler.scrapper import Scrapper
 
 
+# Fields of youtube-dl description of video which are stored into data base. Big lists of formats, thumbnails and
+# signed urls of captions aren't stored (see archive_video_descr of YoutubeCrawler)
+DEFAULT_VIDEO_FIELDS = (
+    'id',
+    'title',
+    'description',
+    'duration',
+    'view_count',
+    'like_count',
+    'upload_date',
+    'uploader',
+    'channel_id',
+    'tags',
+    'categories',
+    'automatic_captions',
+    'subtitles',
+)
+
+# Captions are projected into list of languages
+_CAPTION_FIELDS = ('automatic_captions', 'subtitles')
+
+
+def project_video_descr(descr, fields=DEFAULT_VIDEO_FIELDS):
+    """
+    This function projects youtube-dl description of video into fields. Captions (automatic_captions and subtitles)
+    are replaced by sorted list of their languages
+
+    :param descr: youtube-dl description of video (dict)
+    :param fields: projected fields. None means all fields of description except subtitles, as they have signed urls
+    :return: projected description (dict)
+    """
+    if fields is None:
+        return {k: v for k, v in descr.items() if k != 'subtitles'}
+    projection = {}
+    for field in fields:
+        if field not in descr:
+            continue
+        value = descr[field]
+        if field in _CAPTION_FIELDS and value is not None:
+            value = sorted(value)
+        projection[field] = value
+    return projection
+
+
 class YoutubeCrawler:
     # TODO: указано скачать не все видео, а только часть, то при повторной загрузке, будет выбран другой набор видео
     # TODO: Скрапер обкачивает k видео, а Crawler m из них может отбраковать, после чего не скачает новые k - m видео
 
-    def __init__(self, cache=None, ydl_loader=None, scraper=None, max_attempts=5):
+    def __init__(self, cache=None, ydl_loader=None, scraper=None, max_attempts=5, video_fields=DEFAULT_VIDEO_FIELDS,
+                 archive_video_descr=False, worker_id=None, lease_seconds=600., workers=1, idle_interval=5.,
+                 stream=True, retry_policy=None, defer_seconds=600.):
+        """
+        :param cache: cache of channels and videos (see crawler.cache.DBSqlLiteCache)
+        :param ydl_loader: loader of videos (see crawler.loaders.YoutubeDlLoader)
+        :param scraper: scrapper of channels (see crawler.scrapper.Scrapper)
+        :param max_attempts: max count of attempts of scrapping and downloading (see retry_policy)
+        :param video_fields: fields of youtube-dl description of video which are stored (see project_video_descr)
+        :param archive_video_descr: if it is True, then full youtube-dl description of video is stored too
+        :param worker_id: id of worker. If it is set, then channels are claimed with lease (see
+            DBSqlLiteCache.claim_best_channels), so several processes of crawler can use one data base
+        :param lease_seconds: duration of lease of claimed channel
+        :param workers: count of threads which crawl channels. Every thread claims channels with own worker id
+            (worker_id with suffix), so threads don't crawl the same channel. Cache, scrapper and loaders are shared
+            by threads. If scrapper is async, then it is count of channels which are crawled by event loop at once
+            (see process_async)
+        :param idle_interval: max time (in seconds) which idle thread waits for new channels of another threads
+        :param stream: if it is True and scrapper has method iter_parse, then neighbours are inserted and videos are
+            downloaded page by page while next pages are loading. Else they are processed after all pages of channel
+        :param retry_policy: policy of retries of scrapping and downloading (see crawler.retry.RetryPolicy). It
+            replaces max_attempts. Its metrics are available as retry_metrics
+        :param defer_seconds: channel which loading was stopped by deadline of scrapper (see utils.DeadlineError) isn't
+            failed, it returns to frontier after this delay (see DBSqlLiteCache.defer_channel)
+        """
+        if workers < 1:
+            raise AttributeError("Attribute workers must be more 0")
         # TODO: переписать на StateMachine
         # TODO: выводить инфу о способе запуска
         # TODO: сделать options для конфигурирования
         # TODO: как быть, если в scrapper передан один логгер, а в качестве аргумента в YoutubeCrawler -- другой?
-        self.__max_attempts = max_attempts
+        self.__retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_attempts=max_attempts)
+        self.retry_metrics = self.__retry_policy.metrics
+        self.__video_fields = video_fields
+        self.__archive_video_descr = archive_video_descr
+        self.__worker_id = worker_id
+        self.__lease_seconds = lease_seconds
+        self.__defer_seconds = defer_seconds
+        self.__workers = workers
+        self.__idle_interval = idle_interval
+        # Count of threads which crawl channel now. Idle threads wait for them, as they can add new channels
+        self.__active_workers = 0
+        self.__workers_cond = threading.Condition()
+        self.__stats_lock = threading.Lock()
+        # Executor of blocking parts of async crawling (see process_async)
+        self.__executor = None
+        # Count of known channels which were listed as neighbours and were not returned to frontier
+        self.avoided_recrawls = 0
+        # Count of downloaded videos of channels in flight. Cache estimates upload rate of channel by it
+        self.__new_videos = {}
 
         self.__cache = cache
         if self.__cache is None:
@@ -29,6 +123,11 @@ class YoutubeCrawler:
         self.__scraper = scraper
         if self.__scraper is None:
             self.__init_none_scraper()
+        self.__stream = stream and hasattr(self.__scraper, 'iter_parse')
+        # Scrapper which retries requests itself keeps parsed pages, so channel isn't retried as a whole
+        self.__channel_policy = self.__retry_policy
+        if getattr(self.__scraper, 'max_attempts', 1) > 1:
+            self.__channel_policy = RetryPolicy(max_attempts=1, metrics=self.retry_metrics)
 
         self.__crash_msg = "channel from cache isn't got (%s=%s). crawler interrupts execute..."
 
@@ -47,35 +146,28 @@ class YoutubeCrawler:
         self.__scraper = scrapper
 
     def scrappy_decorator(self, fn, *args, **kwargs):
-        count = 0
-        e = None
-        while count < self.__max_attempts:
-            try:
-                return fn(*args, **kwargs)
-            except Exception as e:
-                logging.warning(utils.CrawlerError(e=e, msg="problem into scrapper. retry: %d" % count))
-                count += 1
-        raise e
+        # Only transient errors are retried with backoff (see crawler.retry)
+        return self.__retry_policy.call(fn, *args, **kwargs)
 
-    @staticmethod
-    def __create_video(video_id, channel_id, full_descr, short_descr):
+    def __create_video(self, video_id, channel_id, full_descr, short_descr):
         # TODO: заменить на алгоритмы valid и priority
         valid = True
         priority = 0
 
-        if 'subtitles' in full_descr:
-            del full_descr['subtitles']
-        return {
+        video = {
             'video_id': video_id,
             'channel_id': channel_id,
-            'full_description': json.dumps(full_descr),
+            'full_description': json.dumps(project_video_descr(full_descr, self.__video_fields)),
             'short_description': json.dumps(short_descr),
             'valid': valid,
             'priority': priority
         }
+        if self.__archive_video_descr:
+            video['archive_description'] = json.dumps(project_video_descr(full_descr, fields=None))
+        return video
 
     @staticmethod
-    def __create_cur_channel(channel_id, full_descr, short_descr):
+    def __create_cur_channel(channel_id, full_descr, short_descr, partial_tabs=None):
         # TODO: заменить на алгоритмы valid и priority
         priority = 0
 
@@ -83,6 +175,9 @@ class YoutubeCrawler:
         if full_descr is not None:
             for k in full_descr:
                 new_full_descr[k.value] = full_descr[k]
+        if partial_tabs:
+            # Tabs were cut by failed requests (see crawler.scrapper.Scrapper)
+            new_full_descr['partial_tabs'] = sorted(tab.value for tab in partial_tabs)
 
         return [{
             'channel_id': channel_id,
@@ -103,23 +198,44 @@ class YoutubeCrawler:
         except Exception as e:
             logging.exception(e)
 
-    def __download_videos(self, descrs):
-        channel_id = descrs[Tab.HomePage][0]['owner_channel']['id']
-        for descr in descrs[Tab.Videos]:
+    def __set_failed_video(self, video_id, channel_id, short_descr):
+        # Failed video isn't stored yet, so it is inserted as invalid. Failure of one video doesn't fail channel
+        try:
+            self.__cache.insert_video_descr({
+                'video_id': video_id,
+                'channel_id': channel_id,
+                'full_description': None,
+                'short_description': json.dumps(short_descr),
+                'valid': False,
+                'priority': 0,
+            })
+        except Exception as e:
+            logging.exception(e)
+
+    def __download_videos(self, channel_id, video_descrs, worker_id=None, lease_channel_id=None):
+        """
+        :return: False if lease of channel was expired, so downloading is stopped
+        """
+        # Check in Cache all video_ids by one request
+        exist_video_ids = self.__cache.check_exist_videos([descr['id'] for descr in video_descrs])
+        for descr in video_descrs:
             video_id = descr['id']
 
-            # Check in Cache video_id
-            if self.__cache.check_exist_video(video_id):
+            if video_id in exist_video_ids:
                 logging.info("such video already exist (video_id=%s)" % video_id)
                 continue
 
+            # Downloading of media takes long time, so lease is renewed before every video
+            if not self.__renew_lease(worker_id, lease_channel_id or channel_id):
+                return False
+
             # Download video
             try:
                 full_video_descr = self.scrappy_decorator(self.__video_downloader.load, video_id)
             except Exception as e:
-                self.__cache.update_failed_video(video_id)
                 msg = "problem with video downloading (video_id=%s)" % video_id
                 logging.warning(utils.CrawlerError(e=e, msg=msg))
+                self.__set_failed_video(video_id, channel_id, descr)
                 continue
 
             data = self.__create_video(video_id, channel_id, full_video_descr, descr)
@@ -129,6 +245,10 @@ class YoutubeCrawler:
                 msg = "problem with video inserting into db (video_id=%s)" % video_id
                 logging.warning(utils.CrawlerError(e=e, msg=msg))
                 logging.error(e)
+                continue
+            with self.__stats_lock:
+                self.__new_videos[channel_id] = self.__new_videos.get(channel_id, 0) + 1
+        return True
 
     def __set_base_videos(self, channel_ids):
         msg = None
@@ -140,34 +260,91 @@ class YoutubeCrawler:
             logging.exception(utils.CrawlerError(e=e, msg=msg))
             # raise exception
 
+    def __is_incremental(self, channel_id):
+        # Parsers stop after known items, but items before them are known only if previous crawl of channel was
+        # complete. Else older items of channel would be never loaded
+        parsers = getattr(self.__scraper, 'parsers', None) or []
+        if all(getattr(p, 'stop_after_known', None) is None for p in parsers):
+            return True
+        try:
+            return self.__cache.is_crawl_complete(channel_id)
+        except Exception as e:
+            logging.exception(e)
+            return False
+
+    @staticmethod
+    def __first_attempt(incremental):
+        # Pages of failed attempt can be stored already (see stream), so only the first attempt is incremental
+        attempts = iter([incremental])
+        return lambda: next(attempts, False)
+
+    def __parse(self, channel_id, incremental):
+        partial_tabs = set()
+        return self.__scraper.parse(channel_id, partial_tabs=partial_tabs, incremental=incremental()), partial_tabs
+
     def __scrappy(self, channel_id):
         logging.info("scrappy channelId=%s" % channel_id)
         try:
-            full_descr = self.scrappy_decorator(self.__scraper.parse, channel_id)
+            incremental = self.__first_attempt(self.__is_incremental(channel_id))
+            full_descr, partial_tabs = self.__channel_policy.call(self.__parse, channel_id, incremental)
+        except Exception as e:
+            return self.__fail_scrappy(channel_id, e)
+        return self.__set_cur_channel(channel_id, full_descr, partial_tabs)
+
+    def __set_cur_channel(self, channel_id, full_descr, partial_tabs=None):
+        if partial_tabs:
+            logging.warning("channel is partial (channel_id=%s, tabs=%s)" % (
+                channel_id, ','.join(sorted(tab.value for tab in partial_tabs))))
+        try:
             # Extract full_descr
-            channel = self.__create_cur_channel(channel_id, full_descr, None)
+            channel = self.__create_cur_channel(channel_id, full_descr, None, partial_tabs)
             # Setting current channel into Cache. ChannelId
             self.__cache.set_channels(channel, scrapped=True, valid=True)
         except Exception as e:
-            self.__set_failed_channel(channel_id)
-            logging.error(e)
-            return None, False
+            return self.__fail_scrappy(channel_id, e)
         return full_descr, True
 
+    def __fail_scrappy(self, channel_id, e):
+        self.__pop_new_videos(channel_id)
+        if isinstance(e, utils.DeadlineError):
+            self.__defer_channel(channel_id, e)
+            return None, False
+        self.__set_failed_channel(channel_id)
+        logging.error(e)
+        return None, False
+
+    def __defer_channel(self, channel_id, e):
+        logging.warning(utils.CrawlerError(e=e, msg="channel is deferred for %.0f seconds (channel_id=%s)" % (
+            self.__defer_seconds, channel_id)))
+        try:
+            self.__cache.defer_channel(channel_id, self.__defer_seconds)
+        except Exception as e:
+            logging.exception(e)
+
     def __set_neighb_channels(self, full_descr):
-        neighb_channels = None
+        neighb_channels = []
         try:
-            # Setting neighbours channels into Cache. ChannelId
+            # Setting neighbours channels into Cache. ChannelId. Known channels are not updated, so they are not
+            # crawled again
             neighb_channels = self.__get_neighb_channels(full_descr)
-            self.__cache.set_channels(neighb_channels, scrapped=False, valid=True)
+            avoided_recrawls = self.__cache.add_neighb_channels(neighb_channels)
+            with self.__stats_lock:
+                self.avoided_recrawls += avoided_recrawls
+                total = self.avoided_recrawls
+            logging.info("neighbour channels: %d, avoided re-crawls: %d (total: %d)" % (
+                len(neighb_channels), avoided_recrawls, total))
         except Exception as e:
-            ch_ids_str = ','.join([ch['id'] for ch in neighb_channels])
+            ch_ids_str = ','.join([ch['channel_id'] for ch in neighb_channels])
             e = utils.CrawlerError(e=e, msg=self.__crash_msg % ("channel_ids", ch_ids_str))
             logging.error(e)
 
+    def __pop_new_videos(self, channel_id):
+        with self.__stats_lock:
+            return self.__new_videos.pop(channel_id, 0)
+
     def __update_channel_downloaded(self, channel_id):
         try:
-            self.__cache.update_channel_downloaded(channel_id)
+            self.__cache.update_channel_downloaded(channel_id, new_videos=self.__pop_new_videos(channel_id))
         except Exception as e:
             msg = "problem with update channel_id. " + self.__crash_msg % ("channel_id", channel_id)
             e = utils.CrawlerError(e=e, msg=msg)
@@ -175,33 +352,286 @@ class YoutubeCrawler:
             return False
         return True
 
-    def process(self, channel_ids=None):
+    def __get_best_channel_id(self, worker_id):
+        if worker_id is None:
+            return self.__cache.get_best_channel_id()
+        # Previous channel was processed, so its lease isn't needed
+        self.__cache.release_channels(worker_id)
+        channel_ids = self.__cache.claim_best_channels(worker_id, k=1, lease_seconds=self.__lease_seconds)
+        if len(channel_ids) == 0:
+            return None
+        return channel_ids[0]
+
+    def __renew_lease(self, worker_id, channel_id):
+        if worker_id is None:
+            return True
+        try:
+            renewed = self.__cache.renew_leases(worker_id, [channel_id], lease_seconds=self.__lease_seconds)
+        except Exception as e:
+            logging.error(utils.CrawlerError(e=e, msg="problem with renew of lease (channel_id=%s)" % channel_id))
+            return False
+        if channel_id not in renewed:
+            logging.warning("lease of channel was expired (channel_id=%s)" % channel_id)
+            return False
+        return True
+
+    def __worker_ids(self):
+        worker_id = self.__worker_id
+        if worker_id is None:
+            worker_id = 'pid%d' % os.getpid()
+        return ['%s-%d' % (worker_id, i) for i in range(self.__workers)]
+
+    def close(self):
+        """
+        This method releases leases of workers, flushes buffered data of cache and closes it
+        """
+        if self.__worker_id is not None:
+            self.__cache.release_channels(self.__worker_id)
+        if self.__workers > 1:
+            for worker_id in self.__worker_ids():
+                self.__cache.release_channels(worker_id)
+        self.__cache.close()
+
+    def __process_channel(self, worker_id, channel_id):
+        if self.__stream:
+            self.__process_channel_stream(worker_id, channel_id)
+            return
+        full_descr, is_scrappy = self.__scrappy(channel_id)
+        if not is_scrappy:
+            return
+        self.__process_scrapped(worker_id, channel_id, full_descr)
+
+    def __process_scrapped(self, worker_id, channel_id, full_descr):
+        self.__set_neighb_channels(full_descr)
+
+        # Scrapping may take long time, so lease is renewed before downloading. Channel with expired lease could
+        # be claimed by another worker
+        if not self.__renew_lease(worker_id, channel_id):
+            self.__pop_new_videos(channel_id)
+            return
+
+        # Downloading youtube for ChannelId
+        # TODO: move to scrapper
+        owner_id = full_descr[Tab.HomePage][0]['owner_channel']['id']
+        if not self.__download_videos(owner_id, full_descr[Tab.Videos], worker_id, channel_id):
+            self.__pop_new_videos(owner_id)
+            return
+        # The last video could outlive lease, so channel is marked as downloaded only by owner of lease
+        if not self.__renew_lease(worker_id, channel_id):
+            self.__pop_new_videos(owner_id)
+            return
+
+        # Channel was downloaded
+        self.__update_channel_downloaded(channel_id)
+
+    def __process_page(self, worker_id, channel_id, tab, descrs):
+        """
+        :return: False if lease of channel was expired, so channel is crawled by another worker
+        """
+        if tab == Tab.Channels:
+            self.__set_neighb_channels({Tab.Channels: descrs})
+        elif tab == Tab.Videos:
+            # Page can wait for downloading of previous pages, so lease is renewed before every page
+            if not self.__renew_lease(worker_id, channel_id):
+                return False
+            return self.__download_videos(channel_id, descrs, worker_id)
+        return True
+
+    def __scrappy_stream(self, worker_id, channel_id, incremental):
+        """
+        :return: None if lease of channel was expired, else (description of channel, set of partial tabs)
+        """
+        full_descr, partial_tabs = {}, set()
+        pages = self.__scraper.iter_parse(channel_id, partial_tabs=partial_tabs, incremental=incremental())
+        for tab, descrs, page_no in pages:
+            logging.info("page was parsed: %s, %d (channel_id=%s)" % (tab.value, page_no, channel_id))
+            full_descr.setdefault(tab, []).extend(descrs)
+            if not self.__process_page(worker_id, channel_id, tab, descrs):
+                return None
+        # The last video could outlive lease, so channel is marked as downloaded only by owner of lease
+        if not self.__renew_lease(worker_id, channel_id):
+            return None
+        return full_descr, partial_tabs
+
+    def __finish_stream(self, channel_id, scrapped):
+        if scrapped is None:
+            self.__pop_new_videos(channel_id)
+            return
+        _, is_scrappy = self.__set_cur_channel(channel_id, *scrapped)
+        if is_scrappy:
+            self.__update_channel_downloaded(channel_id)
+
+    def __process_channel_stream(self, worker_id, channel_id):
+        logging.info("scrappy channelId=%s" % channel_id)
+        try:
+            # Known videos and channels are skipped by retry, so it doesn't repeat downloading
+            incremental = self.__first_attempt(self.__is_incremental(channel_id))
+            scrapped = self.__channel_policy.call(self.__scrappy_stream, worker_id, channel_id, incremental)
+        except Exception as e:
+            self.__fail_scrappy(channel_id, e)
+            return
+        self.__finish_stream(channel_id, scrapped)
+
+    def __claim_channel(self, worker_id):
+        # Frontier can be empty while another threads crawl channels, so thread waits for their neighbours
+        with self.__workers_cond:
+            channel_id = self.__get_best_channel_id(worker_id)
+            while channel_id is None and self.__active_workers > 0:
+                self.__workers_cond.wait(timeout=self.__idle_interval)
+                channel_id = self.__get_best_channel_id(worker_id)
+            if channel_id is not None:
+                self.__active_workers += 1
+            return channel_id
+
+    def __work(self, worker_id):
+        try:
+            channel_id = self.__claim_channel(worker_id)
+            while channel_id is not None:
+                try:
+                    self.__process_channel(worker_id, channel_id)
+                finally:
+                    with self.__workers_cond:
+                        self.__active_workers -= 1
+                        self.__workers_cond.notify_all()
+                channel_id = self.__claim_channel(worker_id)
+        finally:
+            self.__cache.release_channels(worker_id)
+
+    async def __run_blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, fn, *args)
+
+    async def __parse_async(self, channel_id, incremental):
+        partial_tabs = set()
+        descrs = await self.__scraper.parse(channel_id, partial_tabs=partial_tabs, incremental=incremental())
+        return descrs, partial_tabs
+
+    async def __scrappy_async(self, channel_id):
+        logging.info("scrappy channelId=%s" % channel_id)
+        try:
+            incremental = self.__first_attempt(await self.__run_blocking(self.__is_incremental, channel_id))
+            full_descr, partial_tabs = await self.__channel_policy.call_async(
+                self.__parse_async, channel_id, incremental,
+            )
+        except Exception as e:
+            return await self.__run_blocking(self.__fail_scrappy, channel_id, e)
+        return await self.__run_blocking(self.__set_cur_channel, channel_id, full_descr, partial_tabs)
+
+    async def __scrappy_stream_async(self, worker_id, channel_id, incremental):
+        full_descr, partial_tabs = {}, set()
+        pages = self.__scraper.iter_parse(channel_id, partial_tabs=partial_tabs, incremental=incremental())
+        async for tab, descrs, page_no in pages:
+            logging.info("page was parsed: %s, %d (channel_id=%s)" % (tab.value, page_no, channel_id))
+            full_descr.setdefault(tab, []).extend(descrs)
+            if not await self.__run_blocking(self.__process_page, worker_id, channel_id, tab, descrs):
+                return None
+        if not await self.__run_blocking(self.__renew_lease, worker_id, channel_id):
+            return None
+        return full_descr, partial_tabs
+
+    async def __process_channel_stream_async(self, worker_id, channel_id):
+        logging.info("scrappy channelId=%s" % channel_id)
+        try:
+            incremental = self.__first_attempt(await self.__run_blocking(self.__is_incremental, channel_id))
+            scrapped = await self.__channel_policy.call_async(
+                self.__scrappy_stream_async, worker_id, channel_id, incremental,
+            )
+        except Exception as e:
+            await self.__run_blocking(self.__fail_scrappy, channel_id, e)
+            return
+        await self.__run_blocking(self.__finish_stream, channel_id, scrapped)
+
+    async def __claim_channel_async(self, worker_id, cond):
+        # The same as __claim_channel, but idle task waits for another tasks of event loop
+        async with cond:
+            channel_id = await self.__run_blocking(self.__get_best_channel_id, worker_id)
+            while channel_id is None and self.__active_workers > 0:
+                try:
+                    await asyncio.wait_for(cond.wait(), self.__idle_interval)
+                except asyncio.TimeoutError:
+                    pass
+                channel_id = await self.__run_blocking(self.__get_best_channel_id, worker_id)
+            if channel_id is not None:
+                self.__active_workers += 1
+            return channel_id
+
+    async def __work_async(self, worker_id, cond):
+        try:
+            channel_id = await self.__claim_channel_async(worker_id, cond)
+            while channel_id is not None:
+                try:
+                    if self.__stream:
+                        await self.__process_channel_stream_async(worker_id, channel_id)
+                    else:
+                        full_descr, is_scrappy = await self.__scrappy_async(channel_id)
+                        if is_scrappy:
+                            await self.__run_blocking(self.__process_scrapped, worker_id, channel_id, full_descr)
+                finally:
+                    async with cond:
+                        self.__active_workers -= 1
+                        cond.notify_all()
+                channel_id = await self.__claim_channel_async(worker_id, cond)
+        finally:
+            await self.__run_blocking(self.__cache.release_channels, worker_id)
+
+    async def process_async(self, channel_ids=None):
+        """
+        This method crawls channels by event loop. Scrapper must be async (see crawler.scrapper.AsyncScrapper).
+        Every one of workers is task which crawls channels one by one, so count of channels in flight is workers.
+        Blocking parts (data base, youtube-dl) are executed by pool of workers threads
+
+        :param channel_ids: list of base channel ids
+        """
         if channel_ids is None:
             channel_ids = []
         if not isinstance(channel_ids, list):
             raise utils.CrawlerError("channel_ids is not list")
         logging.info("setting channel ids from arguments into cache")
 
-        self.__set_base_videos(channel_ids)
-        # Getting first channel from Cache
-        channel_id = self.__cache.get_best_channel_id()
+        self.__executor = ThreadPoolExecutor(max_workers=self.__workers)
+        try:
+            await self.__run_blocking(self.__set_base_videos, channel_ids)
+            logging.info("crawling by %d async workers" % self.__workers)
+            cond = asyncio.Condition()
+            await asyncio.gather(*[self.__work_async(worker_id, cond) for worker_id in self.__worker_ids()])
+        finally:
+            await self.__scraper.close()
+            self.__executor.shutdown()
+            self.__executor = None
 
-        while channel_id is not None:
-            full_descr, is_scrappy = self.__scrappy(channel_id)
-            if not is_scrappy:
-                channel_id = self.__cache.get_best_channel_id()
-                continue
+    def process(self, channel_ids=None):
+        try:
+            self.__process(channel_ids)
+        finally:
+            logging.info("retry metrics: %s" % self.retry_metrics.as_dict())
+            loader = getattr(self.__scraper, 'loader', None)
+            stream_stats = loader.stream_stats() if hasattr(loader, 'stream_stats') else {}
+            if len(stream_stats) != 0:
+                logging.info("stream stats of pages: %s" % stream_stats)
+
+    def __process(self, channel_ids):
+        if inspect.iscoroutinefunction(self.__scraper.parse):
+            asyncio.run(self.process_async(channel_ids))
+            return
 
-            self.__set_neighb_channels(full_descr)
+        if channel_ids is None:
+            channel_ids = []
+        if not isinstance(channel_ids, list):
+            raise utils.CrawlerError("channel_ids is not list")
+        logging.info("setting channel ids from arguments into cache")
 
-            # Downloading youtube for ChannelId
-            # TODO: move to scrapper
-            self.__download_videos(full_descr)
+        self.__set_base_videos(channel_ids)
 
-            # Channel was downloaded
-            if not self.__update_channel_downloaded(channel_id):
-                channel_id = self.__cache.get_best_channel_id()
-                continue
+        if self.__workers > 1:
+            logging.info("crawling by %d workers" % self.__workers)
+            with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+                futures = [executor.submit(self.__work, worker_id) for worker_id in self.__worker_ids()]
+                for future in futures:
+                    future.result()
+            return
 
+        # Getting first channel from Cache
+        channel_id = self.__get_best_channel_id(self.__worker_id)
+        while channel_id is not None:
+            self.__process_channel(self.__worker_id, channel_id)
             # Getting next channel from Cache
-            channel_id = self.__cache.get_best_channel_id()
+            channel_id = self.__get_best_channel_id(self.__worker_id)
@@ -0,0 +1,166 @@
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+
+class LatencyTracker:
+    def __init__(self, percentile=95., window=256, min_samples=20, initial_delay=1.):
+        """
+        Tracker keeps latencies of the last requests and returns their percentile online
+
+        :param percentile: percentile (from 0 to 100) of latencies
+        :param window: count of the last latencies which are kept
+        :param min_samples: percentile isn't computed by fewer latencies, initial_delay is returned instead
+        :param initial_delay: value (in seconds) which is returned till min_samples latencies are known
+        """
+        if not 0 < percentile <= 100:
+            raise AttributeError("Attribute percentile must be more 0 and not more 100")
+        if window < 1:
+            raise AttributeError("Attribute window must be more 0")
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.__lock = threading.Lock()
+        self.__latencies = deque(maxlen=window)
+
+    def add(self, latency):
+        with self.__lock:
+            self.__latencies.append(latency)
+
+    def value(self):
+        """
+        :return: percentile of the last latencies (in seconds)
+        """
+        with self.__lock:
+            if len(self.__latencies) < max(self.min_samples, 1):
+                return self.initial_delay
+            latencies = sorted(self.__latencies)
+        # Nearest-rank percentile
+        return latencies[max(math.ceil(self.percentile / 100 * len(latencies)) - 1, 0)]
+
+
+class Hedging:
+    def __init__(self, percentile=95., window=256, min_samples=20, initial_delay=1., max_ratio=0.1, max_workers=16):
+        """
+        Hedging duplicates request which hasn't answered within percentile of latencies of previous requests. Result
+        of the first successful request is returned, another one is cancelled. So one slow response doesn't stall chain
+        of continuations. Duplicates are requests too, so they wait for rate limiter of loader, and their count is
+        limited by max_ratio of all requests
+
+        :param percentile: see LatencyTracker. Request which is slower than this percentile is duplicated
+        :param window: see LatencyTracker
+        :param min_samples: see LatencyTracker
+        :param initial_delay: see LatencyTracker
+        :param max_ratio: max share of duplicated requests
+        :param max_workers: count of threads of sync requests (see call). It should be not less than twice count of
+            threads which call requests, else requests wait for free thread
+        """
+        if not 0 <= max_ratio <= 1:
+            raise AttributeError("Attribute max_ratio must be from 0 to 1")
+        if max_workers < 2:
+            raise AttributeError("Attribute max_workers must be more 1")
+        self.tracker = LatencyTracker(
+            percentile=percentile, window=window, min_samples=min_samples, initial_delay=initial_delay,
+        )
+        self.max_ratio = max_ratio
+        self.max_workers = max_workers
+        self.__lock = threading.Lock()
+        self.__executor = None
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def as_dict(self):
+        with self.__lock:
+            return {'requests': self.requests, 'hedges': self.hedges, 'hedge_wins': self.hedge_wins}
+
+    def __get_executor(self):
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self.__executor
+
+    def __count_request(self):
+        with self.__lock:
+            self.requests += 1
+
+    def __allow_hedge(self):
+        with self.__lock:
+            if self.hedges + 1 > self.max_ratio * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def __count_win(self):
+        with self.__lock:
+            self.hedge_wins += 1
+
+    def __timed(self, fn, args, kwargs):
+        start = time.monotonic()
+        res = fn(*args, **kwargs)
+        # Only successful requests are tracked, as fast errors would lower percentile
+        self.tracker.add(time.monotonic() - start)
+        return res
+
+    async def __timed_async(self, fn, args, kwargs):
+        start = time.monotonic()
+        res = await fn(*args, **kwargs)
+        self.tracker.add(time.monotonic() - start)
+        return res
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Requests are run by threads of hedging. Thread of request can't be interrupted, so the slower request is
+        abandoned and it is finished in background (it is limited by timeout of loader)
+
+        :return: result of the first successful call of fn
+        :exception: exception of the first call if both calls were failed
+        """
+        self.__count_request()
+        executor = self.__get_executor()
+        primary = executor.submit(self.__timed, fn, args, kwargs)
+        try:
+            return primary.result(timeout=self.tracker.value())
+        except TimeoutError:
+            pass
+        if not self.__allow_hedge():
+            return primary.result()
+        hedge = executor.submit(self.__timed, fn, args, kwargs)
+        pending = {primary, hedge}
+        while len(pending) != 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        self.__count_win()
+                    return future.result()
+        return primary.result()
+
+    async def call_async(self, fn, *args, **kwargs):
+        """
+        Async version of call. fn returns awaitable. The slower request is cancelled
+        """
+        self.__count_request()
+        primary = asyncio.ensure_future(self.__timed_async(fn, args, kwargs))
+        done, _ = await asyncio.wait([primary], timeout=self.tracker.value())
+        if len(done) != 0 or not self.__allow_hedge():
+            return await primary
+        hedge = asyncio.ensure_future(self.__timed_async(fn, args, kwargs))
+        pending = {primary, hedge}
+        try:
+            while len(pending) != 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.__count_win()
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in (primary, hedge):
+                task.cancel()
@@ -0,0 +1,206 @@
+import base64
+import bisect
+from array import array
+import hashlib
+import math
+import re
+import sys
+
+
+# Trailing bits of the last char are dropped while decoding. Ids with non-zero trailing bits are not canonical
+_video_id_pattern = re.compile(r'[A-Za-z0-9_-]{10}[AEIMQUYcgkosw048]')
+_channel_id_pattern = re.compile(r'UC[A-Za-z0-9_-]{21}[AQgw]')
+
+
+def pack_video_id(video_id):
+    """
+    Video id is 11 chars of url-safe base64 (64 bits)
+
+    :param video_id: video id (str)
+    :return: 8 bytes or None if video id is not canonical
+    """
+    if _video_id_pattern.fullmatch(video_id) is None:
+        return None
+    return base64.urlsafe_b64decode(video_id + '=')
+
+
+def pack_channel_id(channel_id):
+    """
+    Channel id is prefix UC and 22 chars of url-safe base64 (128 bits)
+
+    :param channel_id: channel id (str)
+    :return: 16 bytes or None if channel id is not canonical
+    """
+    if _channel_id_pattern.fullmatch(channel_id) is None:
+        return None
+    return base64.urlsafe_b64decode(channel_id[2:] + '==')
+
+
+class PackedIdSet:
+    def __init__(self, pack, width, merge_ratio=0.125, min_merge_size=65536):
+        """
+        Set of ids which are packed into fixed width keys (8 or 16 bytes). Keys are kept into sorted arrays of 64-bit
+        words (binary search), new keys are buffered into small set and are merged into arrays from time to time. Ids
+        which can't be packed are kept as is.
+
+        :param pack: function which packs id to bytes of width or returns None (see pack_video_id, pack_channel_id)
+        :param width: width of packed key: 8 or 16
+        :param merge_ratio: new keys are merged when their count is more than merge_ratio of packed keys
+        :param min_merge_size: new keys are not merged while their count is less than min_merge_size
+        """
+        if width not in (8, 16):
+            raise AttributeError("Attribute width must be 8 or 16")
+        self._pack = pack
+        self._width = width
+        self._merge_ratio = merge_ratio
+        self._min_merge_size = min_merge_size
+        # High and low 64-bit words of keys. Low words are used for width 16 only
+        self._hi = array('Q')
+        self._lo = array('Q')
+        self._pending = set()
+        self._others = set()
+
+    def __len__(self):
+        return len(self._hi) + len(self._pending) + len(self._others)
+
+    def __contains__(self, id_):
+        key = self.__key(id_)
+        if key is None:
+            return id_ in self._others
+        return key in self._pending or self.__find(key)[1]
+
+    def __key(self, id_):
+        raw = self._pack(id_)
+        return None if raw is None else int.from_bytes(raw, 'big')
+
+    def __split(self, key):
+        if self._width == 8:
+            return key, 0
+        return key >> 64, key & 0xFFFFFFFFFFFFFFFF
+
+    def __find(self, key, lo=0):
+        """
+        :return: position of key into arrays and exist flag
+        """
+        hi, low = self.__split(key)
+        i = bisect.bisect_left(self._hi, hi, lo)
+        if self._width == 8:
+            return i, i < len(self._hi) and self._hi[i] == hi
+        while i < len(self._hi) and self._hi[i] == hi and self._lo[i] < low:
+            i += 1
+        return i, i < len(self._hi) and self._hi[i] == hi and self._lo[i] == low
+
+    def __should_merge(self):
+        return len(self._pending) >= max(self._min_merge_size, len(self._hi) * self._merge_ratio)
+
+    def add(self, id_):
+        key = self.__key(id_)
+        if key is None:
+            self._others.add(id_)
+            return
+        if key in self._pending or self.__find(key)[1]:
+            return
+        self._pending.add(key)
+        if self.__should_merge():
+            self.merge()
+
+    def update(self, ids):
+        keys = set()
+        for id_ in ids:
+            key = self.__key(id_)
+            if key is None:
+                self._others.add(id_)
+                continue
+            keys.add(key)
+        # Large batch (for instance, warming from data base) is merged at once
+        if len(keys) >= self._min_merge_size:
+            self._pending |= keys
+            self.merge()
+            return
+        for key in keys:
+            if key not in self._pending and not self.__find(key)[1]:
+                self._pending.add(key)
+        if self.__should_merge():
+            self.merge()
+
+    def merge(self):
+        """
+        This method merges buffered keys into sorted arrays. Each merge copies arrays once
+        """
+        if len(self._hi) == 0:
+            keys = sorted(self._pending)
+            if self._width == 8:
+                self._hi = array('Q', keys)
+            else:
+                self._hi = array('Q', (key >> 64 for key in keys))
+                self._lo = array('Q', (key & 0xFFFFFFFFFFFFFFFF for key in keys))
+            self._pending = set()
+            return
+        out_hi, out_lo = array('Q'), array('Q')
+        pos = 0
+        for key in sorted(self._pending):
+            i, exist = self.__find(key, pos)
+            out_hi += self._hi[pos:i]
+            out_lo += self._lo[pos:i]
+            pos = i
+            if exist:
+                continue
+            hi, low = self.__split(key)
+            out_hi.append(hi)
+            if self._width == 16:
+                out_lo.append(low)
+        out_hi += self._hi[pos:]
+        out_lo += self._lo[pos:]
+        self._hi, self._lo = out_hi, out_lo
+        self._pending = set()
+
+    def memory_usage(self):
+        """
+        :return: approximate count of bytes which are used by set
+        """
+        size = sys.getsizeof(self._hi) + sys.getsizeof(self._lo)
+        size += sys.getsizeof(self._pending) + sys.getsizeof(self._others)
+        size += sum(sys.getsizeof(key) for key in self._pending)
+        size += sum(sys.getsizeof(id_) for id_ in self._others)
+        return size
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        Probabilistic set. It has not false negative answers and has false positive answers with probability
+        error_rate while count of added ids is less than capacity
+
+        :param capacity: expected count of ids
+        :param error_rate: probability of false positive answer
+        """
+        if capacity < 1:
+            raise AttributeError("Attribute capacity must be more 0")
+        if not 0 < error_rate < 1:
+            raise AttributeError("Attribute error_rate must be into (0, 1)")
+        self._size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self._count_hashes = max(1, int(round(self._size / capacity * math.log(2))))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def __indexes(self, id_):
+        digest = hashlib.blake2b(id_.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self._size for i in range(self._count_hashes))
+
+    def __contains__(self, id_):
+        return all(self._bits[i >> 3] & (1 << (i & 7)) for i in self.__indexes(id_))
+
+    def add(self, id_):
+        for i in self.__indexes(id_):
+            self._bits[i >> 3] |= 1 << (i & 7)
+
+    def update(self, ids):
+        for id_ in ids:
+            self.add(id_)
+
+    def memory_usage(self):
+        """
+        :return: approximate count of bytes which are used by filter
+        """
+        return sys.getsizeof(self._bits)
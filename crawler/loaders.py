@@ -1,13 +1,28 @@
+import codecs
 import json
+import re
+import threading
+import time
 
 import requests
 from copy import deepcopy
+from requests.adapters import HTTPAdapter
 from enum import Enum
 import youtube_dl
 
 from crawler import utils
+from crawler.rate_limit import youtube_dl_status_code
 from crawler.utils import ReloadTokenError
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+_JSON_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
 
 class Tab(Enum):
     Channels = 'channels'
@@ -16,8 +31,160 @@ class Tab(Enum):
     About = 'about'
 
 
+class Section(Enum):
+    Data = 'ytInitialData'
+    Player = 'ytInitialPlayerResponse'
+
+
+def extract_json(text, prefix, msg):
+    """
+    Json is decoded in place from the end of prefix till the end of its value, so page isn't copied and
+    terminator of script isn't needed
+
+    :param text: page
+    :param prefix: text before json
+    :param msg: message of exception
+    :return: decoded json
+    :exception utils.JsonSerializableError: prefix isn't found or json is invalid
+    """
+    start_ind = text.find(prefix)
+    if start_ind == -1:
+        raise utils.JsonSerializableError(msg, ValueError("prefix is not found: %s" % prefix))
+    start_ind = _WHITESPACE.match(text, start_ind + len(prefix)).end()
+    try:
+        config, _ = _JSON_DECODER.raw_decode(text, start_ind)
+    except Exception as e:
+        raise utils.JsonSerializableError(msg, e)
+    return config
+
+
+class PageConfig:
+    _messages = {
+        Section.Data: "Data config serialize is failed",
+        Section.Player: "Player config serialize is failed",
+    }
+
+    def __init__(self, text, prefixes):
+        """
+        Configs of page are located and decoded on first access, so sections which aren't used (e.g. player config,
+        see crawler.parsers.BaseParser.sections) are never decoded. Page can be unpacked as (player config,
+        data config), then both configs are decoded
+
+        :param text: page
+        :param prefixes: dict of prefixes of configs by sections (see Section)
+        """
+        self._text = text
+        self._prefixes = prefixes
+        self._configs = {}
+
+    def __getitem__(self, section):
+        """
+        :param section: Section
+        :return: decoded config
+        :exception utils.JsonSerializableError: config isn't found or it is invalid
+        """
+        if section not in self._configs:
+            self._configs[section] = extract_json(self._text, self._prefixes[section], self._messages[section])
+        return self._configs[section]
+
+    def __iter__(self):
+        yield self[Section.Player]
+        yield self[Section.Data]
+
+
+class _ConfigScanner:
+    def __init__(self, prefix, terminator='</script>'):
+        """
+        Scanner finds prefix of config and then terminator of its script while page is received by chunks. Json isn't
+        decoded by scanner, so it is decoded once by PageConfig
+
+        :param prefix: text before json
+        :param terminator: text after json
+        """
+        self.done = False
+        self.__patterns = [prefix, terminator]
+        self.__tail = ''
+
+    def feed(self, chunk):
+        """
+        :param chunk: next part of page (str)
+        :return: True if script of config was received completely
+        """
+        if self.done:
+            return True
+        # Patterns can be split by chunks, so end of previous chunks is kept
+        window = self.__tail + chunk
+        while len(self.__patterns) != 0:
+            pattern = self.__patterns[0]
+            ind = window.find(pattern)
+            if ind == -1:
+                self.__tail = window[max(len(window) - len(pattern) + 1, 0):]
+                return False
+            window = window[ind + len(pattern):]
+            self.__patterns.pop(0)
+        self.__tail = ''
+        self.done = True
+        return True
+
+
+class PageScanner:
+    def __init__(self, prefixes, encoding='utf-8'):
+        """
+        Incremental scanner of page which is received by chunks. Reading of page can be stopped as soon as scripts
+        of all prefixes were received, as the rest of page isn't needed. Scanner only finds prefixes and terminators
+        of scripts by str.find, so it is cheaper than decoding of configs
+
+        :param prefixes: prefixes of needed configs
+        :param encoding: encoding of page
+        """
+        self.__decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        self.__scanners = [_ConfigScanner(prefix) for prefix in prefixes]
+        self.__chunks = []
+
+    def feed(self, chunk):
+        """
+        :param chunk: next bytes of page
+        :return: True if all needed configs were received
+        """
+        text = self.__decoder.decode(chunk)
+        self.__chunks.append(text)
+        done = True
+        for scanner in self.__scanners:
+            done = scanner.feed(text) and done
+        return done
+
+    def text(self):
+        return ''.join(self.__chunks)
+
+
+def create_session(pool_connections=10, pool_maxsize=10):
+    """
+    This function creates HTTP session which keeps alive connections to hosts, so pages don't need new TCP and TLS
+    handshakes. Adapter doesn't retry requests, as loaders are retried by crawler. Pool of connections is thread-safe,
+    so one session can be shared by loaders of all workers
+
+    :param pool_connections: count of hosts which pools are kept
+    :param pool_maxsize: max count of kept connections to one host. It should be not less than count of workers,
+        else extra connections are closed after requests
+    :return: requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 class BaseLoader:
-    def __init__(self):
+    def __init__(self, session=None, rate_limiter=None, timeout=(10., 30.)):
+        """
+        :param session: HTTP session (see create_session). By default loader creates own session on first request
+        :param rate_limiter: limiter of requests which is shared by all loaders (see
+            crawler.rate_limit.AdaptiveRateLimiter). Responses adjust its rate. None means that requests aren't limited
+        :param timeout: timeout (in seconds) of request: (connect timeout, read timeout) or one number for both.
+            Read timeout limits pauses between bytes of response, so stalled connection doesn't hang worker. None
+            means that requests wait forever
+        """
         user_agent = \
             "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"
         cache_control = 'no-cache'
@@ -30,24 +197,58 @@ class BaseLoader:
             'x-youtube-client-name': x_youtube_client_name,
             'x-youtube-client-version': x_youtube_client_version,
         }
+        self._session = session
+        self._session_lock = threading.Lock()
+        self._rate_limiter = rate_limiter
+        self._timeout = timeout
+
+    def _get_session(self):
+        with self._session_lock:
+            if self._session is None:
+                self._session = create_session()
+            return self._session
+
+    def _record(self, status_code, start):
+        if self._rate_limiter is not None:
+            self._rate_limiter.record(status_code, time.monotonic() - start)
 
     def _get_resp_text(self, url, params=None, headers=None, method='GET'):
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        start = time.monotonic()
         try:
             params = {} if params is None else params
             headers = self._headers if headers is None else headers
-            resp = requests.request(method, url, headers=headers, params=params)
+            resp = self._get_session().request(method, url, headers=headers, params=params, timeout=self._timeout)
         except Exception as e:
+            self._record(None, start)
             raise utils.RequestError("Connection is failed", e)
+        self._record(resp.status_code, start)
         utils.check_resp(resp)
         return resp.text
 
 
 class Reloader(BaseLoader):
-    def __init__(self, base_url='https://www.youtube.com/browse_ajax/'):
-        super().__init__()
+    def __init__(self, base_url='https://www.youtube.com/browse_ajax/', session=None, rate_limiter=None,
+                 timeout=(10., 30.), hedging=None):
+        """
+        :param hedging: crawler.hedging.Hedging. If it is set, then continuation which hasn't answered within
+            percentile of latencies is requested again and the first response is taken. None means that continuations
+            aren't duplicated
+        """
+        super().__init__(session=session, rate_limiter=rate_limiter, timeout=timeout)
         self._base_url = base_url
+        self._hedging = hedging
 
     def load(self, next_page_token):
+        headers, query_params = self._create_request(next_page_token)
+        if self._hedging is None:
+            config = self._get_resp_text(self._base_url, headers=headers, params=query_params)
+        else:
+            config = self._hedging.call(self._get_resp_text, self._base_url, headers=headers, params=query_params)
+        return self._parse_config(config)
+
+    def _create_request(self, next_page_token):
         if len(next_page_token['ctoken']) == 0:
             raise ReloadTokenError("ctoken length equal 0")
         if len(next_page_token['itct']) == 0:
@@ -58,8 +259,10 @@ class Reloader(BaseLoader):
             'continuation': next_page_token['ctoken'],
             'itct': next_page_token['itct'],
         }
+        return headers, query_params
 
-        config = self._get_resp_text(self._base_url, headers=headers, params=query_params)
+    @staticmethod
+    def _parse_config(config):
         try:
             return json.loads(config)
         except Exception as e:
@@ -70,29 +273,230 @@ class Loader(BaseLoader):
     def __init__(
             self, data_config_prefix='window["ytInitialData"] = ',
             player_config_prefix='window["ytInitialPlayerResponse"] = (\n        ',
-            base_url='https://www.youtube.com/channel/'):
-        super().__init__()
+            base_url='https://www.youtube.com/channel/', session=None, rate_limiter=None, timeout=(10., 30.),
+            stream_sections=None, chunk_size=16384):
+        """
+        :param stream_sections: sections of page (see Section) which are needed by parsers (see
+            crawler.parsers.BaseParser.sections). If they are set, then page is read by chunks and reading is stopped
+            as soon as configs of these sections were received. Connection of stopped response is closed, as the rest
+            of page isn't read. Another sections are unavailable then. None means that the whole page is read
+        :param chunk_size: size (in bytes) of chunk of streamed page
+        """
+        super().__init__(session=session, rate_limiter=rate_limiter, timeout=timeout)
         self._base_url = base_url
         self._data_config_prefix = data_config_prefix
         self._player_config_prefix = player_config_prefix
+        self._init_stream(stream_sections, chunk_size)
+
+    def _init_stream(self, stream_sections, chunk_size):
+        if chunk_size < 1:
+            raise AttributeError("Attribute chunk_size must be more 0")
+        self._stream_prefixes = None
+        if stream_sections is not None:
+            prefixes = self._prefixes()
+            self._stream_prefixes = [prefixes[section] for section in stream_sections]
+        self._chunk_size = chunk_size
+        self._stream_stats_lock = threading.Lock()
+        self._stream_stats = {}
+
+    def stream_stats(self):
+        """
+        :return: dict of counters of streamed pages by tabs: pages, early_stops (reading was stopped before the end of
+            page), bytes_read and bytes_saved (bytes which weren't read). Saved bytes are known only if response has
+            Content-Length
+        """
+        with self._stream_stats_lock:
+            return deepcopy(self._stream_stats)
+
+    def _add_stream_stats(self, tab, stopped, bytes_read, content_length):
+        bytes_saved = 0
+        if stopped and content_length is not None and bytes_read is not None:
+            bytes_saved = max(int(content_length) - bytes_read, 0)
+        with self._stream_stats_lock:
+            stats = self._stream_stats.setdefault(tab.value, {
+                'pages': 0, 'early_stops': 0, 'bytes_read': 0, 'bytes_saved': 0,
+            })
+            stats['pages'] += 1
+            stats['early_stops'] += stopped
+            stats['bytes_read'] += bytes_read if bytes_read is not None else 0
+            stats['bytes_saved'] += bytes_saved
 
     def load(self, channel_id, tab=Tab.HomePage, query_params=None):
-        text = self._get_resp_text(self._base_url + channel_id + '/' + tab.value, params=query_params)
+        """
+        :return: PageConfig. Configs of page are decoded on access
+        """
+        url = self._base_url + channel_id + '/' + tab.value
+        if self._stream_prefixes is None:
+            text = self._get_resp_text(url, params=query_params)
+        else:
+            text = self._get_resp_text_stream(url, tab, params=query_params)
+        return self._parse_page(text)
 
-        data_config = self.__extractor(text, self._data_config_prefix, "Data config serialize is failed", ';\n')
-        player_config = self.__extractor(text, self._player_config_prefix, "Player config serialize is failed", ');\n')
+    def _get_resp_text_stream(self, url, tab, params=None):
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire()
+        start = time.monotonic()
+        try:
+            params = {} if params is None else params
+            resp = self._get_session().request(
+                'GET', url, headers=self._headers, params=params, timeout=self._timeout, stream=True,
+            )
+        except Exception as e:
+            self._record(None, start)
+            raise utils.RequestError("Connection is failed", e)
+        self._record(resp.status_code, start)
+        try:
+            utils.check_resp(resp)
+            scanner = PageScanner(self._stream_prefixes, encoding=resp.encoding or 'utf-8')
+            stopped = False
+            try:
+                for chunk in resp.iter_content(chunk_size=self._chunk_size):
+                    if scanner.feed(chunk):
+                        stopped = True
+                        break
+            except Exception as e:
+                raise utils.RequestError("Reading of page is failed", e)
+            # Bytes of body which were received by connection (before decompression)
+            self._add_stream_stats(tab, stopped, resp.raw.tell(), resp.headers.get('Content-Length'))
+            return scanner.text()
+        finally:
+            resp.close()
 
-        return player_config, data_config
+    def _prefixes(self):
+        return {
+            Section.Data: self._data_config_prefix,
+            Section.Player: self._player_config_prefix,
+        }
 
-    @staticmethod
-    def __extractor(text, config, msg, pattern_found):
-        start_ind = text.find(config)+len(config)
-        finish_ind = start_ind + text[start_ind:].find(pattern_found)
-        config = text[start_ind:finish_ind]
+    def _parse_page(self, text):
+        return PageConfig(text, self._prefixes())
+
+
+class AsyncBaseLoader(BaseLoader):
+    def __init__(self, session=None, rate_limiter=None, timeout=(10., 30.)):
+        """
+        Async loaders download pages by aiohttp (package aiohttp is required)
+
+        :param session: aiohttp.ClientSession. By default session is created on first request into running event loop
+            and it is closed by method close
+        :param rate_limiter: see BaseLoader. Waiting for limiter doesn't block event loop
+        :param timeout: see BaseLoader. It is converted into aiohttp.ClientTimeout(sock_connect, sock_read)
+        """
+        super().__init__(session=session, rate_limiter=rate_limiter, timeout=timeout)
+        if session is None and aiohttp is None:
+            raise ImportError("package aiohttp is required for async loaders")
+        self._client_timeout = None
+        if aiohttp is not None:
+            connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            self._client_timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._own_session = session is None
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def _get_resp_text(self, url, params=None, headers=None, method='GET'):
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire_async()
+        start = time.monotonic()
         try:
-            return json.loads(config)
+            params = {} if params is None else params
+            headers = self._headers if headers is None else headers
+            async with self._get_session().request(
+                    method, url, headers=headers, params=params, timeout=self._client_timeout) as resp:
+                status, text = resp.status, await resp.text()
         except Exception as e:
-            raise utils.JsonSerializableError(msg, e)
+            self._record(None, start)
+            raise utils.RequestError("Connection is failed", e)
+        self._record(status, start)
+        utils.check_status(status, url)
+        return text
+
+    async def close(self):
+        if self._own_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncReloader(AsyncBaseLoader, Reloader):
+    def __init__(self, base_url='https://www.youtube.com/browse_ajax/', session=None, rate_limiter=None,
+                 timeout=(10., 30.), hedging=None):
+        """
+        :param hedging: see Reloader. The slower request is cancelled
+        """
+        AsyncBaseLoader.__init__(self, session=session, rate_limiter=rate_limiter, timeout=timeout)
+        self._base_url = base_url
+        self._hedging = hedging
+
+    async def load(self, next_page_token):
+        headers, query_params = self._create_request(next_page_token)
+        if self._hedging is None:
+            config = await self._get_resp_text(self._base_url, headers=headers, params=query_params)
+        else:
+            config = await self._hedging.call_async(
+                self._get_resp_text, self._base_url, headers=headers, params=query_params,
+            )
+        return self._parse_config(config)
+
+
+class AsyncLoader(AsyncBaseLoader, Loader):
+    def __init__(
+            self, data_config_prefix='window["ytInitialData"] = ',
+            player_config_prefix='window["ytInitialPlayerResponse"] = (\n        ',
+            base_url='https://www.youtube.com/channel/', session=None, rate_limiter=None, timeout=(10., 30.),
+            stream_sections=None, chunk_size=16384):
+        """
+        :param stream_sections: see Loader. Saved bytes are known only if response isn't compressed
+        :param chunk_size: see Loader
+        """
+        AsyncBaseLoader.__init__(self, session=session, rate_limiter=rate_limiter, timeout=timeout)
+        self._base_url = base_url
+        self._data_config_prefix = data_config_prefix
+        self._player_config_prefix = player_config_prefix
+        self._init_stream(stream_sections, chunk_size)
+
+    async def load(self, channel_id, tab=Tab.HomePage, query_params=None):
+        url = self._base_url + channel_id + '/' + tab.value
+        if self._stream_prefixes is None:
+            text = await self._get_resp_text(url, params=query_params)
+        else:
+            text = await self._get_resp_text_stream(url, tab, params=query_params)
+        return self._parse_page(text)
+
+    async def _get_resp_text_stream(self, url, tab, params=None):
+        if self._rate_limiter is not None:
+            await self._rate_limiter.acquire_async()
+        start = time.monotonic()
+        try:
+            params = {} if params is None else params
+            resp = await self._get_session().request(
+                'GET', url, headers=self._headers, params=params, timeout=self._client_timeout,
+            )
+        except Exception as e:
+            self._record(None, start)
+            raise utils.RequestError("Connection is failed", e)
+        self._record(resp.status, start)
+        try:
+            utils.check_status(resp.status, url)
+            scanner = PageScanner(self._stream_prefixes, encoding=resp.charset or 'utf-8')
+            stopped, bytes_read = False, 0
+            try:
+                async for chunk in resp.content.iter_chunked(self._chunk_size):
+                    bytes_read += len(chunk)
+                    if scanner.feed(chunk):
+                        stopped = True
+                        break
+            except Exception as e:
+                raise utils.RequestError("Reading of page is failed", e)
+            # Chunks are decompressed, so they can't be compared with Content-Length of compressed response
+            if 'Content-Encoding' in resp.headers:
+                bytes_read = None
+            self._add_stream_stats(tab, stopped, bytes_read, resp.headers.get('Content-Length'))
+            return scanner.text()
+        finally:
+            # Connection of unread response isn't returned to pool
+            resp.close()
 
 
 class YDL_LOADER_FORMAT(Enum):
@@ -104,11 +508,18 @@ class YDL_LOADER_FORMAT(Enum):
 
 
 class YoutubeDlLoader:
-    def __init__(self, logger, ydl_params=None, f=YDL_LOADER_FORMAT.MP3, base_url='https://www.youtube.com/watch'):
-        self._base_url = base_url
+    def __init__(self, logger, ydl_params=None, f=YDL_LOADER_FORMAT.MP3, base_url='https://www.youtube.com/watch',
+                 rate_limiter=None):
+        """
+        YoutubeDL objects are not thread-safe, so every thread gets own objects (they are created on first load)
 
-        ydl = youtube_dl.YoutubeDL({'listsubtitles': True, 'logger': logger})
-        self._video_descr_extractor = ydl.get_info_extractor(youtube_dl.gen_extractors()[1125].ie_key())
+        :param rate_limiter: limiter of requests which is shared with page loaders (see BaseLoader). Extraction of
+            description and downloading of media wait for it, so default params of youtube-dl don't sleep before
+            downloading. Errors of youtube-dl with throttled status codes decrease rate of limiter
+        """
+        self._base_url = base_url
+        self._logger = logger
+        self._rate_limiter = rate_limiter
 
         audio_ydl_params = ydl_params
         if audio_ydl_params is None:
@@ -124,18 +535,46 @@ class YoutubeDlLoader:
                 'sleep_interval': 1,
                 'ignoreerrors': False,
             }
+            if rate_limiter is not None:
+                del audio_ydl_params['max_sleep_interval'], audio_ydl_params['sleep_interval']
         audio_ydl_params['logger'] = logger
-        self._audio_ydl = youtube_dl.YoutubeDL(audio_ydl_params)
+        self._audio_ydl_params = audio_ydl_params
+        self._local = threading.local()
+
+    def _get_ydl(self):
+        if not hasattr(self._local, 'audio_ydl'):
+            ydl = youtube_dl.YoutubeDL({'listsubtitles': True, 'logger': self._logger})
+            self._local.video_descr_extractor = ydl.get_info_extractor(youtube_dl.gen_extractors()[1125].ie_key())
+            self._local.audio_ydl = youtube_dl.YoutubeDL(dict(self._audio_ydl_params))
+        return self._local.video_descr_extractor, self._local.audio_ydl
 
     def load(self, video_id):
         # TODO: реализовать обкачку видео, инорфмацию по которым скачали
         # TODO: логгировать все статусы обкачки для того, чтобы можно было возобновить обкачку с прежнего места
         # TODO: заменить на кастомные обкачки, так как youtube-dl использует 2 обращения (за субтитрами и за видео)
 
+        video_descr_extractor, audio_ydl = self._get_ydl()
         url = self._base_url + '?v=%s' % video_id
-        descr = self._video_descr_extractor.extract(url)
+        descr = self._limited(video_descr_extractor.extract, url, measure_latency=True)
         if 'ru' not in descr['automatic_captions']:
             return {}
 
-        self._audio_ydl.download([url])
+        # Duration of downloading depends on size of media, so it doesn't adjust rate
+        self._limited(audio_ydl.download, [url], measure_latency=False)
         return descr
+
+    def _limited(self, fn, arg, measure_latency):
+        if self._rate_limiter is None:
+            return fn(arg)
+        self._rate_limiter.acquire()
+        start = time.monotonic()
+        try:
+            res = fn(arg)
+        except Exception as e:
+            # Status code is unknown for errors without HTTP response, so they don't decrease rate
+            status_code = youtube_dl_status_code(e)
+            if status_code is not None:
+                self._rate_limiter.record(status_code)
+            raise
+        self._rate_limiter.record(200, time.monotonic() - start if measure_latency else None)
+        return res
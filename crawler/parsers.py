@@ -1,10 +1,14 @@
 from jq import jq
 from crawler import utils
-from crawler.loaders import Tab
+from crawler.loaders import Section, Tab
 from crawler.utils import ReloadTokenError
 
 
 class BaseParser:
+    # Sections of the first page (see crawler.loaders.PageConfig) which parser needs. Another sections aren't decoded.
+    # Config of the only section is passed to parse as is, several sections are passed as dict by sections
+    sections = (Section.Data,)
+
     def __init__(self, jq_path, tab, max_page=1):
         """
         This parser loads the only page
@@ -38,7 +42,8 @@ class BaseParser:
 
 
 class ReloaderParser(BaseParser):
-    def __init__(self, max_page, tab, jq_load_path, jq_reload_path):
+    def __init__(self, max_page, tab, jq_load_path, jq_reload_path, stop_after_known=None, check_exist=None,
+                 id_key='id'):
         """
         This parser loads first page and reload next pages
 
@@ -46,10 +51,24 @@ class ReloaderParser(BaseParser):
         :param tab (Tab(Enum)): tab was defined type of parser
         :param jq_load_path (str): path to jq-script of load data
         :param jq_reload_path (str): path to jq-script of reload data
+        :param stop_after_known (int): incremental mode. Parser stops reloading after this count of known items in
+            a row (newest items go first, so items after them are known too). None means that all pages are loaded
+        :param check_exist (callable): it gets list of ids and returns set of known ones
+            (e.g. crawler.cache.DBSqlLiteCache.check_exist_videos)
+        :param id_key (str): key of id into items of page
         """
         super().__init__(max_page=max_page, tab=tab, jq_path=jq_load_path)
-
+        if stop_after_known is not None:
+            if stop_after_known < 1:
+                raise AttributeError("Attribute stop_after_known must be more 0")
+            if check_exist is None:
+                raise AttributeError("Attribute check_exist is required with stop_after_known")
+
+        self.stop_after_known = stop_after_known
+        self.check_exist = check_exist
+        self.id_key = id_key
         self.__count_pages = 0
+        self.__known_in_row = 0
         with open(jq_reload_path) as fd_fq:
             self._jq_reload = jq(fd_fq.read())
         self.next_page_token = None
@@ -59,8 +78,16 @@ class ReloaderParser(BaseParser):
         This method return True if max count pages is downloaded else False
         :return: True or False
         """
+        if self.stop_after_known is not None and self.__known_in_row >= self.stop_after_known:
+            return True
         return not (self.max_page is None or self.__count_pages < self.max_page)
 
+    def __count_known(self, items):
+        ids = [item[self.id_key] for item in items]
+        exist_ids = self.check_exist(ids)
+        for item_id in ids:
+            self.__known_in_row = self.__known_in_row + 1 if item_id in exist_ids else 0
+
     def parse(self, config, is_reload):
         """
         This method return True if max count pages is downloaded else False
@@ -79,6 +106,8 @@ class ReloaderParser(BaseParser):
             next_page_token = data['next_page_token']['ctoken']
         except Exception as e:
             raise utils.ParserError("next page token is not available", e)
+        if self.stop_after_known is not None:
+            self.__count_known(data[self.tab.value])
         if next_page_token is not None and itct is not None:
             return data[self.tab.value], {
                 'ctoken': next_page_token,
@@ -89,7 +118,8 @@ class ReloaderParser(BaseParser):
 
 class VideosParser(ReloaderParser):
     def __init__(
-            self, max_page=None, jq_load_path='crawler/jq/videos.jq', jq_reload_path='crawler/jq/videos_reload.jq'):
+            self, max_page=None, jq_load_path='crawler/jq/videos.jq', jq_reload_path='crawler/jq/videos_reload.jq',
+            stop_after_known=None, check_exist=None):
         """
         This parser loads the pages with videos
 
@@ -97,8 +127,13 @@ class VideosParser(ReloaderParser):
         :param tab (Tab.Enum): tab was defined type of parser
         :param jq_load_path (str): path to jq-script of load data
         :param jq_reload_path (str): path to jq-script of reload data
+        :param stop_after_known (int): count of known videos in a row which stops reloading (see ReloaderParser)
+        :param check_exist (callable): it returns set of known video ids (see ReloaderParser)
         """
-        super().__init__(max_page, Tab.Videos, jq_load_path, jq_reload_path)
+        super().__init__(
+            max_page, Tab.Videos, jq_load_path, jq_reload_path, stop_after_known=stop_after_known,
+            check_exist=check_exist, id_key='id',
+        )
         self.max_page = max_page
 
 
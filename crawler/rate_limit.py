@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+
+# Responses which mean that youtube throttles crawler
+THROTTLE_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+_YOUTUBE_DL_HTTP_ERROR = re.compile(r'HTTP Error (\d{3})')
+
+
+def youtube_dl_status_code(e):
+    """
+    youtube-dl wraps HTTP errors into DownloadError and ExtractorError, so status code is extracted from message
+
+    :param e: exception of youtube-dl
+    :return: status code or None
+    """
+    match = _YOUTUBE_DL_HTTP_ERROR.search(str(e))
+    return int(match.group(1)) if match is not None else None
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rate=5., min_rate=0.2, max_rate=50., burst=5., increase=0.1, decrease_factor=0.5,
+                 target_latency=None, cooldown=1.):
+        """
+        Token bucket which limits rate of all outbound requests (pages, continuations and youtube-dl). Rate is adjusted
+        by AIMD: every good response increases it by increase, throttled response (see THROTTLE_STATUS_CODES), failed
+        connection or response slower than target_latency multiplies it by decrease_factor. So crawler runs as fast
+        as youtube tolerates. Limiter is thread-safe and it can be shared by threads and event loops
+
+        :param rate: initial rate (requests per second)
+        :param min_rate: min rate
+        :param max_rate: max rate
+        :param burst: capacity of bucket. Idle limiter allows so many requests at once
+        :param increase: additive increase of rate after good response
+        :param decrease_factor: multiplicative decrease of rate after throttled response
+        :param target_latency: response which is slower (in seconds) decreases rate. None means that latency is ignored
+        :param cooldown: rate is decreased once per cooldown (in seconds), as requests in flight fail together
+        """
+        if not 0 < min_rate <= rate <= max_rate:
+            raise AttributeError("Attribute rate must be between min_rate and max_rate (min_rate must be more 0)")
+        if burst < 1:
+            raise AttributeError("Attribute burst must not be less 1")
+        if not 0 < decrease_factor < 1:
+            raise AttributeError("Attribute decrease_factor must be from 0 to 1")
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        self.__lock = threading.Lock()
+        self.__rate = rate
+        self.__tokens = burst
+        self.__updated = time.monotonic()
+        self.__decreased = None
+        self.throttled = 0
+        self.wait_seconds = 0.
+
+    @property
+    def rate(self):
+        with self.__lock:
+            return self.__rate
+
+    def _reserve(self):
+        """
+        :return: delay (in seconds) before request. Token is reserved, so concurrent callers wait in turn
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.burst, self.__tokens + (now - self.__updated) * self.__rate)
+            self.__updated = now
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return 0.
+            delay = -self.__tokens / self.__rate
+            self.wait_seconds += delay
+            return delay
+
+    def acquire(self):
+        """
+        This method blocks caller till request is allowed
+        """
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(self, status_code=None, latency=None):
+        """
+        This method adjusts rate by response
+
+        :param status_code: status code of response. None means that connection was failed
+        :param latency: duration of request (in seconds). None means that it is unknown (e.g. downloading of media)
+        """
+        throttled = status_code is None or status_code in THROTTLE_STATUS_CODES
+        if latency is not None and self.target_latency is not None and latency > self.target_latency:
+            throttled = True
+        with self.__lock:
+            if not throttled:
+                self.__rate = min(self.__rate + self.increase, self.max_rate)
+                return
+            now = time.monotonic()
+            if self.__decreased is not None and now - self.__decreased < self.cooldown:
+                return
+            self.__decreased = now
+            self.__rate = max(self.__rate * self.decrease_factor, self.min_rate)
+            self.throttled += 1
+            rate = self.__rate
+        logging.info("rate of requests was decreased to %.2f (status code: %s, latency: %s)" % (
+            rate, status_code, latency))
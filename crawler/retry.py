@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+from youtube_dl.utils import YoutubeDLError
+
+from crawler import utils
+from crawler.rate_limit import youtube_dl_status_code
+
+# Status codes of responses which can succeed on retry. Another status codes (e.g. 404) are permanent
+TRANSIENT_STATUS_CODES = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+# Errors of page layout and of programming are deterministic, so retries don't help
+PERMANENT_ERRORS = (
+    utils.ParserError,
+    utils.JsonExtractionError,
+    utils.JsonSerializableError,
+    utils.ReloadTokenError,
+    utils.ExtensionError,
+    utils.CacheError,
+    utils.DeadlineError,
+    AttributeError,
+    TypeError,
+    KeyError,
+    IndexError,
+    ValueError,
+    NotImplementedError,
+)
+
+
+def is_transient(e):
+    """
+    This function classifies errors of crawler (see crawler.utils) as transient or permanent
+
+        * RequestError is transient if connection was failed or status code is in TRANSIENT_STATUS_CODES
+        * errors of parsing, cache and programming are permanent (see PERMANENT_ERRORS)
+        * base CrawlerError is classified by wrapped exception
+        * errors of youtube-dl are classified by status code (see youtube_dl_status_code). Errors without status code
+          are transient only if they were caused by network, else they repeat on retry (e.g. expected errors of
+          unavailable, private or geo-blocked video)
+        * another exceptions (e.g. errors of network) are transient
+
+    :param e: exception
+    :return: True if request can succeed on retry
+    """
+    if isinstance(e, utils.RequestError):
+        return e.status_code is None or e.status_code in TRANSIENT_STATUS_CODES
+    if isinstance(e, PERMANENT_ERRORS):
+        return False
+    if type(e) is utils.CrawlerError and e.e is not None:
+        return is_transient(e.e)
+    if isinstance(e, YoutubeDLError):
+        return _is_transient_youtube_dl(e)
+    return True
+
+
+def _youtube_dl_causes(e):
+    # DownloadError and ExtractorError keep original exception into exc_info
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        yield e
+        exc_info = getattr(e, 'exc_info', None)
+        e = exc_info[1] if exc_info is not None else getattr(e, 'cause', None)
+
+
+def _is_transient_youtube_dl(e):
+    status_code = youtube_dl_status_code(e)
+    if status_code is not None:
+        return status_code in TRANSIENT_STATUS_CODES
+    # youtube-dl marks errors of network as expected too, so they are found by wrapped exceptions
+    return any(isinstance(cause, OSError) for cause in _youtube_dl_causes(e))
+
+
+class Backoff:
+    def __init__(self, base_delay=0.5, factor=2., max_delay=30., jitter=True):
+        """
+        Exponential backoff: delay of attempt n (from 0) is min(max_delay, base_delay * factor ** n)
+
+        :param base_delay: delay (in seconds) before first retry
+        :param factor: growth of delay with every attempt
+        :param max_delay: max delay (in seconds)
+        :param jitter: if it is True, then delay is uniform from 0 to exponential one ("full jitter"), so workers
+            which were failed together don't retry together
+        """
+        if base_delay < 0:
+            raise AttributeError("Attribute base_delay must not be less 0")
+        if factor < 1:
+            raise AttributeError("Attribute factor must not be less 1")
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * self.factor ** attempt)
+        if self.jitter:
+            return random.uniform(0, delay)
+        return delay
+
+
+class RetryMetrics:
+    """
+    Counters of retries. They are shared by all policies of crawler and are thread-safe
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.retries = 0
+        self.sleep_seconds = 0.
+        self.permanent_errors = 0
+        self.exhausted = 0
+        self.breaker_trips = 0
+        self.breaker_wait_seconds = 0.
+
+    def add(self, **counters):
+        with self.__lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        with self.__lock:
+            return {
+                'retries': self.retries,
+                'sleep_seconds': self.sleep_seconds,
+                'permanent_errors': self.permanent_errors,
+                'exhausted': self.exhausted,
+                'breaker_trips': self.breaker_trips,
+                'breaker_wait_seconds': self.breaker_wait_seconds,
+            }
+
+
+class CircuitBreaker:
+    def __init__(self, window_seconds=60., min_requests=20, failure_rate=0.5, pause_seconds=30., metrics=None):
+        """
+        Circuit breaker pauses all requests which share it when rate of transient errors spikes (e.g. youtube
+        answers 429 to everybody). Breaker is opened for pause_seconds, then window of outcomes starts again
+
+        :param window_seconds: outcomes of requests are counted over this window
+        :param min_requests: breaker isn't opened by fewer outcomes in window
+        :param failure_rate: share of transient errors in window which opens breaker
+        :param pause_seconds: how long breaker is opened
+        :param metrics: RetryMetrics
+        """
+        if min_requests < 1:
+            raise AttributeError("Attribute min_requests must be more 0")
+        if not 0 < failure_rate <= 1:
+            raise AttributeError("Attribute failure_rate must be more 0 and not more 1")
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.pause_seconds = pause_seconds
+        self.metrics = metrics if metrics is not None else RetryMetrics()
+        self.__lock = threading.Lock()
+        self.__outcomes = deque()
+        self.__failures = 0
+        self.__open_until = 0.
+
+    def remaining(self):
+        """
+        :return: seconds till breaker is closed (0 if it is closed)
+        """
+        with self.__lock:
+            return max(self.__open_until - time.monotonic(), 0.)
+
+    def wait(self):
+        """
+        This method blocks caller while breaker is opened
+        """
+        remaining = self.remaining()
+        if remaining > 0:
+            self.metrics.add(breaker_wait_seconds=remaining)
+            time.sleep(remaining)
+
+    async def wait_async(self):
+        remaining = self.remaining()
+        if remaining > 0:
+            self.metrics.add(breaker_wait_seconds=remaining)
+            await asyncio.sleep(remaining)
+
+    def record(self, ok):
+        """
+        :param ok: False if request was failed by transient error, else True
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__outcomes.append((now, ok))
+            self.__failures += not ok
+            while self.__outcomes[0][0] < now - self.window_seconds:
+                _, old_ok = self.__outcomes.popleft()
+                self.__failures -= not old_ok
+            if len(self.__outcomes) < self.min_requests or self.__failures < self.failure_rate * len(self.__outcomes):
+                return
+            logging.warning("circuit breaker is opened for %.1f seconds: %d errors of %d requests" % (
+                self.pause_seconds, self.__failures, len(self.__outcomes)))
+            self.__open_until = now + self.pause_seconds
+            self.__outcomes.clear()
+            self.__failures = 0
+        self.metrics.add(breaker_trips=1)
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, backoff=None, breaker=None, metrics=None, classify=is_transient):
+        """
+        Policy retries transient errors with exponential backoff. Permanent errors are raised at once
+
+        :param max_attempts: max count of attempts of call
+        :param backoff: Backoff. By default it is Backoff()
+        :param breaker: CircuitBreaker which is shared by all workers. None means that requests aren't paused
+        :param metrics: RetryMetrics. By default it is metrics of breaker (or new one)
+        :param classify: function which returns True for transient errors (see is_transient)
+        """
+        if max_attempts < 1:
+            raise AttributeError("Attribute max_attempts must be more 0")
+        self.max_attempts = max_attempts
+        self.backoff = backoff if backoff is not None else Backoff()
+        self.breaker = breaker
+        if metrics is None:
+            metrics = breaker.metrics if breaker is not None else RetryMetrics()
+        self.metrics = metrics
+        self.classify = classify
+
+    def _on_error(self, e, attempt):
+        """
+        :return: delay before next attempt. Exception is raised if call mustn't be retried
+        """
+        if not self.classify(e):
+            self.metrics.add(permanent_errors=1)
+            raise e
+        if self.breaker is not None:
+            self.breaker.record(False)
+        if attempt + 1 >= self.max_attempts:
+            self.metrics.add(exhausted=1)
+            raise e
+        delay = self.backoff.delay(attempt)
+        self.metrics.add(retries=1, sleep_seconds=delay)
+        logging.warning(utils.CrawlerError(e=e, msg="retry: %d, delay: %.2f" % (attempt, delay)))
+        return delay
+
+    def _on_success(self):
+        if self.breaker is not None:
+            self.breaker.record(True)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        :return: result of fn
+        :exception: the last exception of fn
+        """
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                self.breaker.wait()
+            try:
+                res = fn(*args, **kwargs)
+            except Exception as e:
+                time.sleep(self._on_error(e, attempt))
+                continue
+            self._on_success()
+            return res
+
+    async def call_async(self, fn, *args, **kwargs):
+        """
+        Async version of call. fn returns awaitable
+        """
+        for attempt in range(self.max_attempts):
+            if self.breaker is not None:
+                await self.breaker.wait_async()
+            try:
+                res = await fn(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self._on_error(e, attempt))
+                continue
+            self._on_success()
+            return res
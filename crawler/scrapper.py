@@ -1,11 +1,20 @@
+import asyncio
+import copy
 import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from crawler.loaders import Tab
+from crawler import utils
+from crawler.loaders import Section, Tab
+from crawler.retry import RetryPolicy
 
 
 class Scrapper:
 
-    def __init__(self, loader, reloader, parsers=None):
+    def __init__(self, loader, reloader, parsers=None, tab_workers=1, max_queued_pages=16, max_attempts=1,
+                 allow_partial=False, retry_policy=None, channel_deadline=None):
         """
             Scrapper download concrete channel with (or without video) from Youtube.
 
@@ -19,9 +28,38 @@ class Scrapper:
                     * TODO: community
                     * TODO: playlist (https://www.youtube.com/user/Sunfish737/playlists)
                 If you want to add new pages, you should be add new constants int crawler.loaders.Tab
+            :param tab_workers (int): count of threads of channel which load tabs concurrently. Only pages of one tab
+                are loaded one by one (every page has token of next one). Every call of parse has own threads, as
+                loading of tab waits for consumer of its pages (see max_queued_pages), so channels don't wait for each
+                other. 1 means that tabs are loaded one by one into thread of caller
+            :param max_queued_pages (int): max count of pages which were loaded concurrently, but were not consumed by
+                caller of iter_parse yet. Loading of tab waits while queue is full
+            :param max_attempts (int): max count of attempts of every request. Failed request is retried alone, so
+                parsed pages of channel are kept. Only transient errors are retried with backoff (see crawler.retry)
+            :param allow_partial (bool): if it is True, then tab is cut (and marked as partial, see iter_parse) when
+                request of its next page is failed after all attempts. Else channel is failed. First pages of tabs are
+                required always
+            :param retry_policy (crawler.retry.RetryPolicy): policy of retries of requests. It replaces max_attempts.
+                By default it is RetryPolicy(max_attempts)
+            :param channel_deadline (float): max duration (in seconds) of loading of channel over all tabs and
+                continuations. Request isn't started after deadline: tab is cut if allow_partial is True, else
+                utils.DeadlineError is raised. Request in flight is limited by timeout of loader. None means that
+                loading isn't limited
         """
+        if tab_workers < 1:
+            raise AttributeError("Attribute tab_workers must be more 0")
+        if max_queued_pages < 1:
+            raise AttributeError("Attribute max_queued_pages must be more 0")
+        if channel_deadline is not None and channel_deadline <= 0:
+            raise AttributeError("Attribute channel_deadline must be more 0")
 
         self.parsers = parsers if parsers is not None else []
+        self.tab_workers = tab_workers
+        self.max_queued_pages = max_queued_pages
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy(max_attempts=max_attempts)
+        self.max_attempts = self.retry_policy.max_attempts
+        self.allow_partial = allow_partial
+        self.channel_deadline = channel_deadline
         self.reloader = reloader
         self.loader = loader
         self.query_params = {
@@ -31,22 +69,312 @@ class Scrapper:
             Tab.About: None,
         }
 
-    def __reload_pages(self, p, next_page_token):
-        descr_slice = []
+    def _get_deadline(self):
+        """
+        :return: deadline of channel (see time.monotonic) or None
+        """
+        if self.channel_deadline is None:
+            return None
+        return time.monotonic() + self.channel_deadline
+
+    @staticmethod
+    def _check_deadline(deadline):
+        """
+        :return: remaining time (in seconds) or None if there isn't deadline
+        :exception utils.DeadlineError: deadline was expired
+        """
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise utils.DeadlineError("deadline of channel was expired")
+        return remaining
+
+    def _load_page(self, load, *args, deadline=None):
+        def load_before_deadline():
+            # Deadline is checked by every attempt, so retries stop at deadline too
+            self._check_deadline(deadline)
+            return load(*args)
+
+        return self.retry_policy.call(load_before_deadline)
+
+    @staticmethod
+    def _parse_first_page(p, page):
+        """
+        Configs of page are decoded lazily (see crawler.loaders.PageConfig), so only sections which are declared by
+        parser (see crawler.parsers.BaseParser.sections) are decoded
+        """
+        sections = getattr(p, 'sections', (Section.Data,))
+        configs = [page[section] for section in sections]
+        config = configs[0] if len(configs) == 1 else dict(zip(sections, configs))
+        return p.parse(config, is_reload=False)
+
+    def _copy_parsers(self, incremental=True):
+        """
+        Parsers count pages, so every channel works with own copies of them. Incremental mode of parsers (see
+        crawler.parsers.ReloaderParser.stop_after_known) is turned off for channel whose previous crawl wasn't complete
+        """
+        parsers = list(map(copy.copy, self.parsers))
+        if not incremental:
+            for p in parsers:
+                if getattr(p, 'stop_after_known', None) is not None:
+                    p.stop_after_known = None
+        return parsers
+
+    def _cut_tab(self, p, page_no, partial_tabs, e):
+        """
+        :return: True if tab is marked as partial, else exception of request must be raised
+        """
+        if not self.allow_partial:
+            return False
+        logging.warning(utils.CrawlerError(e=e, msg="tab is partial: %s, pages: %d" % (p.tab.value, page_no)))
+        if partial_tabs is not None:
+            partial_tabs.add(p.tab)
+        return True
+
+    def __iter_tab(self, p, channel_id, partial_tabs=None, deadline=None):
+        logging.info("loading: ******** %s ********" % p.tab.value)
+        page = self._load_page(self.loader.load, channel_id, p.tab, self.query_params[p.tab], deadline=deadline)
+        logging.info("loading was finished: %s" % p.tab.value)
+        descr, next_page_token = self._parse_first_page(p, page)
+        page_no = 1
+        yield p.tab, descr, page_no
+
         logging.info("reloading: %s" % p.tab.value)
         while not p.is_final_page() and next_page_token is not None:
-            data_config = self.reloader.load(next_page_token)
+            try:
+                data_config = self._load_page(self.reloader.load, next_page_token, deadline=deadline)
+            except Exception as e:
+                if not self._cut_tab(p, page_no, partial_tabs, e):
+                    raise
+                return
             descr, next_page_token = p.parse(data_config, is_reload=True)
-            descr_slice += descr
+            page_no += 1
+            yield p.tab, descr, page_no
+        logging.info("reloading was finished: %s" % p.tab.value)
+
+    @staticmethod
+    def __put(pages, item, stop):
+        # Caller can stop iteration, so loading of tab doesn't wait for free place forever
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __iter_concurrent(self, parsers, channel_id, partial_tabs, deadline):
+        pages = queue.Queue(maxsize=self.max_queued_pages)
+        stop = threading.Event()
+
+        def load_tab(p):
+            try:
+                for page in self.__iter_tab(p, channel_id, partial_tabs, deadline):
+                    if not self.__put(pages, (page, None), stop):
+                        return
+            except Exception as e:
+                self.__put(pages, (None, e), stop)
+                return
+            # Tab was loaded
+            self.__put(pages, (None, None), stop)
+
+        executor = ThreadPoolExecutor(max_workers=min(self.tab_workers, len(parsers)))
+        futures = [executor.submit(load_tab, p) for p in parsers]
+        try:
+            loaded_tabs = 0
+            while loaded_tabs < len(parsers):
+                page, e = pages.get()
+                if e is not None:
+                    raise e
+                if page is None:
+                    loaded_tabs += 1
+                    continue
+                yield page
+        finally:
+            # Channel is failed (or iteration is stopped), so another tabs are not needed
+            stop.set()
+            for future in futures:
+                future.cancel()
+            # Threads which wait for place of queue see stop soon, so caller doesn't wait for them
+            executor.shutdown(wait=False)
+
+    def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        """
+        This generator yields pages of channel as soon as they are parsed. Pages of one tab are yielded in order,
+        pages of different tabs are mixed if tabs are loaded concurrently (see tab_workers)
+
+        Parsers count pages, so every call works with own copies of them. It allows to parse many channels by one
+        scrapper and to call it from several threads
+
+        :param channel_id: channel id
+        :param partial_tabs: set which gets tabs which were cut by failed requests or by deadline (see allow_partial)
+        :param incremental: if it is False, then parsers load all pages even if they were configured to stop after
+            known items (e.g. previous crawl of channel wasn't complete)
+        :return: generator of (tab, list of descriptions, number of page into tab from 1)
+        """
+        parsers = self._copy_parsers(incremental)
+        deadline = self._get_deadline()
+        if self.tab_workers == 1 or len(parsers) <= 1:
+            for p in parsers:
+                yield from self.__iter_tab(p, channel_id, partial_tabs, deadline)
+            return
+        yield from self.__iter_concurrent(parsers, channel_id, partial_tabs, deadline)
+
+    def parse(self, channel_id, partial_tabs=None, incremental=True):
+        """
+        :param channel_id: channel id
+        :param partial_tabs: see iter_parse
+        :param incremental: see iter_parse
+        :return: dict of descriptions by tabs (all pages of iter_parse)
+        """
+        descrs = {}
+        for tab, descr, _ in self.iter_parse(channel_id, partial_tabs, incremental):
+            descrs.setdefault(tab, []).extend(descr)
+        return descrs
+
+
+class AsyncScrapper(Scrapper):
+
+    def __init__(self, loader, reloader, parsers=None, max_requests=100, executor=None, max_queued_pages=16,
+                 max_attempts=1, allow_partial=False, retry_policy=None, channel_deadline=None):
+        """
+            Async scrapper downloads pages by async loaders (see crawler.loaders.AsyncLoader and
+            crawler.loaders.AsyncReloader). Scrapper is shared by all channels of event loop, so max_requests limits
+            count of requests in flight globally. Parsers transform pages into executor, so event loop isn't blocked by
+            jq. Tabs are loaded concurrently
+
+            :param max_requests: max count of requests in flight
+            :param executor: executor of parsers (concurrent.futures.Executor). None means default executor of loop
+            :param max_queued_pages: see Scrapper
+            :param max_attempts: see Scrapper. Every attempt waits for own place of max_requests
+            :param allow_partial: see Scrapper
+            :param retry_policy: see Scrapper. Backoff doesn't block event loop
+            :param channel_deadline: see Scrapper. Request in flight is cancelled at deadline too
+        """
+        super().__init__(
+            loader=loader, reloader=reloader, parsers=parsers, max_queued_pages=max_queued_pages,
+            max_attempts=max_attempts, allow_partial=allow_partial, retry_policy=retry_policy,
+            channel_deadline=channel_deadline,
+        )
+        if max_requests < 1:
+            raise AttributeError("Attribute max_requests must be more 0")
+        self.max_requests = max_requests
+        self.executor = executor
+        self.__semaphore = None
+        self.__semaphore_loop = None
+
+    def _get_semaphore(self):
+        # Semaphore is bound to event loop, so every loop (call of asyncio.run) gets own one
+        loop = asyncio.get_running_loop()
+        if self.__semaphore_loop is not loop:
+            self.__semaphore = asyncio.Semaphore(self.max_requests)
+            self.__semaphore_loop = loop
+        return self.__semaphore
+
+    async def __parse_page(self, p, data_config, is_reload):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, p.parse, data_config, is_reload)
+
+    async def __parse_first_page(self, p, page):
+        # Configs of page are decoded into executor too
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._parse_first_page, p, page)
+
+    async def __load_limited(self, deadline, load, *args):
+        async with self._get_semaphore():
+            # Request can wait for place of max_requests long, so remaining time is got after it
+            remaining = self._check_deadline(deadline)
+            if remaining is None:
+                return await load(*args)
+            try:
+                return await asyncio.wait_for(load(*args), remaining)
+            except asyncio.TimeoutError:
+                raise utils.DeadlineError("deadline of channel was expired while request was in flight")
+
+    async def _load_page_async(self, load, *args, deadline=None):
+        # Request doesn't hold place of max_requests while it waits for backoff
+        return await self.retry_policy.call_async(self.__load_limited, deadline, load, *args)
+
+    async def __iter_tab(self, p, channel_id, partial_tabs, deadline):
+        logging.info("loading: ******** %s ********" % p.tab.value)
+        page = await self._load_page_async(
+            self.loader.load, channel_id, p.tab, self.query_params[p.tab], deadline=deadline,
+        )
+        logging.info("loading was finished: %s" % p.tab.value)
+        descr, next_page_token = await self.__parse_first_page(p, page)
+        page_no = 1
+        yield p.tab, descr, page_no
+
+        logging.info("reloading: %s" % p.tab.value)
+        while not p.is_final_page() and next_page_token is not None:
+            try:
+                data_config = await self._load_page_async(self.reloader.load, next_page_token, deadline=deadline)
+            except Exception as e:
+                if not self._cut_tab(p, page_no, partial_tabs, e):
+                    raise
+                return
+            descr, next_page_token = await self.__parse_page(p, data_config, is_reload=True)
+            page_no += 1
+            yield p.tab, descr, page_no
         logging.info("reloading was finished: %s" % p.tab.value)
-        return descr_slice
 
-    def parse(self, channel_id):
+    async def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        """
+        Async version of Scrapper.iter_parse. Tabs are loaded concurrently
+
+        :param channel_id: channel id
+        :param partial_tabs: see Scrapper.iter_parse
+        :param incremental: see Scrapper.iter_parse
+        :return: async generator of (tab, list of descriptions, number of page into tab from 1)
+        """
+        parsers = self._copy_parsers(incremental)
+        pages = asyncio.Queue(maxsize=self.max_queued_pages)
+        deadline = self._get_deadline()
+
+        async def load_tab(p):
+            try:
+                async for page in self.__iter_tab(p, channel_id, partial_tabs, deadline):
+                    await pages.put((page, None))
+            except Exception as e:
+                await pages.put((None, e))
+                return
+            # Tab was loaded
+            await pages.put((None, None))
+
+        tasks = [asyncio.ensure_future(load_tab(p)) for p in parsers]
+        try:
+            loaded_tabs = 0
+            while loaded_tabs < len(tasks):
+                page, e = await pages.get()
+                if e is not None:
+                    raise e
+                if page is None:
+                    loaded_tabs += 1
+                    continue
+                yield page
+        finally:
+            # Channel is failed (or iteration is stopped), so another tabs are not needed
+            for task in tasks:
+                task.cancel()
+
+    async def parse(self, channel_id, partial_tabs=None, incremental=True):
+        """
+        Async version of Scrapper.parse
+
+        :param channel_id: channel id
+        :param partial_tabs: see Scrapper.iter_parse
+        :param incremental: see Scrapper.iter_parse
+        :return: dict of descriptions by tabs
+        """
         descrs = {}
-        for p in self.parsers:
-            logging.info("loading: ******** %s ********" % p.tab.value)
-            _, data_config = self.loader.load(channel_id, p.tab, self.query_params[p.tab])
-            logging.info("loading was finished: %s" % p.tab.value)
-            descr, next_page_token = p.parse(data_config, is_reload=False)
-            descrs[p.tab] = descr + self.__reload_pages(p, next_page_token)
+        async for tab, descr, _ in self.iter_parse(channel_id, partial_tabs, incremental):
+            descrs.setdefault(tab, []).extend(descr)
         return descrs
+
+    async def close(self):
+        """
+        This method closes sessions of loaders
+        """
+        await self.loader.close()
+        await self.reloader.close()
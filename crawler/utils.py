@@ -64,7 +64,18 @@ class RequestError(CrawlerError):
     """Json with data not valid. This exception is generated of Scrapper
 
     This exception may be thrown when http-request is failed or
-    body of response is not parsed
+    body of response is not parsed. status_code is None if response was not received
+    """
+    def __init__(self, msg, e=None, status_code=None):
+        super().__init__(msg, e)
+        self.status_code = status_code
+
+
+class DeadlineError(CrawlerError):
+    """Deadline of channel was expired. This exception is generated of Scrapper
+
+    This exception may be thrown when loading of channel takes longer than deadline of Scrapper. Request isn't retried,
+    channel is deferred by Crawler
     """
     def __init__(self, msg, e=None):
         super().__init__(msg, e)
@@ -101,4 +112,10 @@ class ExtensionError(CrawlerError):
 
 def check_resp(resp):
     if resp.status_code != 200:
-        raise RequestError("status code exception: %d. url: %s" % (resp.status_code, resp.url))
+        raise RequestError("status code exception: %d. url: %s" % (resp.status_code, resp.url),
+                           status_code=resp.status_code)
+
+
+def check_status(status_code, url):
+    if status_code != 200:
+        raise RequestError("status code exception: %d. url: %s" % (status_code, url), status_code=status_code)
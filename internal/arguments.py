@@ -2,10 +2,18 @@ import argparse
 import logging
 from os import getenv
 
-from crawler.cache import DB_MOD
+from crawler.cache import DB_MOD, JOURNAL_MODES, SYNCHRONOUS_MODES
+from crawler.codec import COMPRESSION
+from crawler.crawler import DEFAULT_VIDEO_FIELDS
 from crawler.loaders import YDL_LOADER_FORMAT
 
 
+def video_fields(x):
+    if x == 'all':
+        return None
+    return tuple(field.strip() for field in x.split(',') if field.strip() != '')
+
+
 def parse():
 
     args = argparse.ArgumentParser()
@@ -48,12 +56,249 @@ def parse():
         type=DB_MOD,
         help='path to sqlite database file',
     )
+    args.add_argument(
+        '--sqlite-journal-mode',
+        default=getenv('SQLITE_JOURNAL_MODE', 'wal'),
+        choices=list(JOURNAL_MODES),
+        type=str,
+        help='sqlite journal mode',
+    )
+    args.add_argument(
+        '--sqlite-synchronous',
+        default=getenv('SQLITE_SYNCHRONOUS', 'normal'),
+        choices=list(SYNCHRONOUS_MODES),
+        type=str,
+        help='sqlite synchronous mode',
+    )
+    args.add_argument(
+        '--sqlite-cache-size',
+        default=getenv('SQLITE_CACHE_SIZE', -64000),
+        type=int,
+        help='sqlite page cache size (negative value is size in KiB, positive value is count of pages)',
+    )
+    args.add_argument(
+        '--seen-index',
+        default=getenv('SEEN_INDEX', '') != '',
+        action='store_true',
+        help='keep ids of videos and channels into memory, so checks of exist do not touch data base',
+    )
+    args.add_argument(
+        '--channel-bloom-capacity',
+        default=getenv('CHANNEL_BLOOM_CAPACITY', None),
+        type=int,
+        help='keep ids of channels into Bloom filter of this capacity instead of exact set (with --seen-index)',
+    )
+    args.add_argument(
+        '--video-batch-size',
+        default=getenv('VIDEO_BATCH_SIZE', 100),
+        type=int,
+        help='count of videos which are inserted into data base by one transaction',
+    )
+    args.add_argument(
+        '--video-flush-interval',
+        default=getenv('VIDEO_FLUSH_INTERVAL', 60.),
+        type=float,
+        help='max age (in seconds) of buffered videos before they are inserted into data base',
+    )
+    args.add_argument(
+        '--compression',
+        default=getenv('COMPRESSION', COMPRESSION.NONE),
+        choices=[COMPRESSION.NONE, COMPRESSION.ZLIB, COMPRESSION.ZSTD],
+        type=COMPRESSION,
+        help='compression of full descriptions of channels and videos into data base',
+    )
+    args.add_argument(
+        '--compression-level',
+        default=getenv('COMPRESSION_LEVEL', None),
+        type=int,
+        help='level of compression',
+    )
+    args.add_argument(
+        '--zstd-dict-path',
+        default=getenv('ZSTD_DICT_PATH', None),
+        type=str,
+        help='path to trained zstd dictionary (see compress_db.py)',
+    )
+    args.add_argument(
+        '--video-fields',
+        default=getenv('VIDEO_FIELDS', ','.join(DEFAULT_VIDEO_FIELDS)),
+        type=video_fields,
+        help='comma separated fields of youtube-dl description of video which are stored into data base. '
+             '"all" means all fields except subtitles (they have signed urls)',
+    )
+    args.add_argument(
+        '--archive-video-descr',
+        default=getenv('ARCHIVE_VIDEO_DESCR', '') != '',
+        action='store_true',
+        help='store full youtube-dl description of video into data base too',
+    )
+    args.add_argument(
+        '--workers',
+        default=getenv('WORKERS', 1),
+        type=int,
+        help='count of threads which crawl channels',
+    )
+    args.add_argument(
+        '--tab-workers',
+        default=getenv('TAB_WORKERS', 4),
+        type=int,
+        help='count of threads of every worker which load tabs of channel concurrently',
+    )
+    args.add_argument(
+        '--http-pool-size',
+        default=getenv('HTTP_POOL_SIZE', 10),
+        type=int,
+        help='max count of kept alive connections to youtube (it is not less than --workers * --tab-workers)',
+    )
+    args.add_argument(
+        '--async-engine',
+        default=getenv('ASYNC_ENGINE', '') != '',
+        action='store_true',
+        help='download pages by event loop (package aiohttp is required). --workers is count of channels in flight',
+    )
+    args.add_argument(
+        '--max-requests',
+        default=getenv('MAX_REQUESTS', 100),
+        type=int,
+        help='max count of requests in flight (with --async-engine)',
+    )
+    args.add_argument(
+        '--worker-id',
+        default=getenv('WORKER_ID', None),
+        type=str,
+        help='unique id of crawler process. Processes with different ids crawl one data base (--db-mod old) together',
+    )
+    args.add_argument(
+        '--lease-seconds',
+        default=getenv('LEASE_SECONDS', 600.),
+        type=float,
+        help='duration of lease of channel which is claimed by worker (with --worker-id)',
+    )
+    args.add_argument(
+        '--stop-after-known-videos',
+        default=getenv('STOP_AFTER_KNOWN_VIDEOS', None),
+        type=int,
+        help='stop loading of pages of videos of channel after this count of known videos in a row (newest videos '
+             'go first). By default all pages are loaded',
+    )
+    args.add_argument(
+        '--revisit-budget',
+        default=getenv('REVISIT_BUDGET', 0.),
+        type=float,
+        help='share of crawled channels (from 0 to 1) which are revisits of downloaded channels with new videos '
+             'expected. 0 means that downloaded channels are never crawled again',
+    )
+    args.add_argument(
+        '--revisit-min-interval',
+        default=getenv('REVISIT_MIN_INTERVAL', 86400.),
+        type=float,
+        help='min time (in seconds) between crawls of channel',
+    )
+    args.add_argument(
+        '--revisit-max-interval',
+        default=getenv('REVISIT_MAX_INTERVAL', 30 * 86400.),
+        type=float,
+        help='max time (in seconds) between crawls of channel',
+    )
     args.add_argument(
         '--max-attempts',
         default=getenv('MAX_ATTEMPTS', 5),
         type=int,
         help='max attempts retry for requests',
     )
+    args.add_argument(
+        '--retry-base-delay',
+        default=getenv('RETRY_BASE_DELAY', 0.5),
+        type=float,
+        help='delay (in seconds) before first retry of transient error. Delay grows exponentially with jitter',
+    )
+    args.add_argument(
+        '--retry-max-delay',
+        default=getenv('RETRY_MAX_DELAY', 30.),
+        type=float,
+        help='max delay (in seconds) between retries',
+    )
+    args.add_argument(
+        '--breaker-failure-rate',
+        default=getenv('BREAKER_FAILURE_RATE', 0.5),
+        type=float,
+        help='share of transient errors of requests for last minute which pauses all workers',
+    )
+    args.add_argument(
+        '--breaker-pause',
+        default=getenv('BREAKER_PAUSE', 30.),
+        type=float,
+        help='duration (in seconds) of pause of all workers after spike of errors',
+    )
+    args.add_argument(
+        '--rate-limit',
+        default=getenv('RATE_LIMIT', 5.),
+        type=float,
+        help='initial rate (requests per second) of all requests to youtube. Rate is adjusted by responses',
+    )
+    args.add_argument(
+        '--max-rate-limit',
+        default=getenv('MAX_RATE_LIMIT', 50.),
+        type=float,
+        help='max rate (requests per second) of all requests to youtube',
+    )
+    args.add_argument(
+        '--target-latency',
+        default=getenv('TARGET_LATENCY', None),
+        type=float,
+        help='responses which are slower (in seconds) decrease rate of requests. By default latency is ignored',
+    )
+    args.add_argument(
+        '--connect-timeout',
+        default=getenv('CONNECT_TIMEOUT', 10.),
+        type=float,
+        help='timeout (in seconds) of connection of page request',
+    )
+    args.add_argument(
+        '--read-timeout',
+        default=getenv('READ_TIMEOUT', 30.),
+        type=float,
+        help='timeout (in seconds) of reading of page response, so stalled connection does not hang worker',
+    )
+    args.add_argument(
+        '--channel-deadline',
+        default=getenv('CHANNEL_DEADLINE', None),
+        type=float,
+        help='max duration (in seconds) of loading of channel pages. Then tabs are cut (see --allow-partial-tabs) '
+             'or channel is deferred. By default it is not limited',
+    )
+    args.add_argument(
+        '--defer-seconds',
+        default=getenv('DEFER_SECONDS', 600.),
+        type=float,
+        help='delay (in seconds) before channel which was stopped by --channel-deadline is crawled again',
+    )
+    args.add_argument(
+        '--hedge-percentile',
+        default=getenv('HEDGE_PERCENTILE', None),
+        type=float,
+        help='continuation which has not answered within this percentile of latencies is requested again and the '
+             'first response is taken. By default continuations are not duplicated',
+    )
+    args.add_argument(
+        '--hedge-max-ratio',
+        default=getenv('HEDGE_MAX_RATIO', 0.1),
+        type=float,
+        help='max share of duplicated continuations (see --hedge-percentile)',
+    )
+    args.add_argument(
+        '--stream-pages',
+        default=getenv('STREAM_PAGES', '') != '',
+        action='store_true',
+        help='read first page of tab by chunks and close connection as soon as configs which are needed by parsers '
+             'were received',
+    )
+    args.add_argument(
+        '--allow-partial-tabs',
+        default=getenv('ALLOW_PARTIAL_TABS', '') != '',
+        action='store_true',
+        help='keep loaded pages of tab if request of next page was failed after --max-attempts. Else channel is failed',
+    )
     args.add_argument(
         '--log-level',
         default='INFO',
@@ -2,15 +2,28 @@ import logging
 
 from crawler import parsers
 from crawler.cache import DBSqlLiteCache, DB_MOD
-from crawler.crawler import YoutubeCrawler
-from crawler.loaders import YoutubeDlLoader, YDL_LOADER_FORMAT, Loader, Reloader
-from crawler.scrapper import Scrapper
+from crawler.codec import COMPRESSION, DescriptionCodec
+from crawler.hedging import Hedging
+from crawler.crawler import DEFAULT_VIDEO_FIELDS, YoutubeCrawler
+from crawler.loaders import YoutubeDlLoader, YDL_LOADER_FORMAT, Loader, Reloader, AsyncLoader, AsyncReloader, \
+    create_session
+from crawler.rate_limit import AdaptiveRateLimiter
+from crawler.retry import Backoff, CircuitBreaker, RetryPolicy
+from crawler.scrapper import Scrapper, AsyncScrapper
 
 
 def sep_url(x):
     return x.replace('\n', '').split('/')[-1]
 
 
+def build_codec(compression=COMPRESSION.NONE, level=None, zstd_dict_path=None):
+    zstd_dict = None
+    if zstd_dict_path is not None:
+        with open(zstd_dict_path, 'rb') as fd:
+            zstd_dict = fd.read()
+    return DescriptionCodec(compression, level=level, zstd_dict=zstd_dict)
+
+
 def build_crawler(**kwargs):
     """
 
@@ -20,23 +33,103 @@ def build_crawler(**kwargs):
 
     logger = logging.getLogger()
     logger.setLevel(kwargs.pop('log_level', logging.INFO))
-    scrapper = Scrapper(
-        loader=Loader(base_url=kwargs.pop('loader_base_url', 'https://www.youtube.com/channel/')),
-        reloader=Reloader(base_url=kwargs.pop('reloader_base_url', 'https://www.youtube.com/browse_ajax/')),
-        parsers=[
-            parsers.HomePageParser(jq_path=kwargs.pop('homepage_parser_jq_path', 'crawler/jq/home_page.jq')),
-            parsers.VideosParser(
-                max_page=kwargs.pop('max_videos_page', None),
-                jq_load_path=kwargs.pop('video_jq_load_path', 'crawler/jq/videos.jq'),
-                jq_reload_path=kwargs.pop('video_jq_reload_path', 'crawler/jq/videos_reload.jq'),
-            ),
-            parsers.ChannelsParser(
-                max_page=kwargs.pop('max_channels_page', None),
-                jq_load_path=kwargs.pop('channels_jq_load_path', 'crawler/jq/channels.jq'),
-                jq_reload_path=kwargs.pop('channels_jq_reload_path', 'crawler/jq/channels_reload.jq'),
-            ),
-            parsers.AboutParser(jq_path=kwargs.pop('homepage_jq_path', 'crawler/jq/about.jq')),
-        ],
+    workers = kwargs.pop("workers", 1)
+    http_pool_size = kwargs.pop('http_pool_size', 10)
+    max_requests = kwargs.pop('max_requests', 100)
+    tab_workers = kwargs.pop('tab_workers', 4)
+    # Scrapper and youtube-dl share breaker, so all workers are paused when youtube rejects requests
+    retry_policy = RetryPolicy(
+        max_attempts=kwargs.pop("max_attempts", 5),
+        backoff=Backoff(
+            base_delay=kwargs.pop("retry_base_delay", 0.5),
+            max_delay=kwargs.pop("retry_max_delay", 30.),
+        ),
+        breaker=CircuitBreaker(
+            failure_rate=kwargs.pop("breaker_failure_rate", 0.5),
+            pause_seconds=kwargs.pop("breaker_pause", 30.),
+        ),
+    )
+    # Pages, continuations and youtube-dl share limiter, so rate of all requests is adjusted together
+    rate_limiter = AdaptiveRateLimiter(
+        rate=kwargs.pop("rate_limit", 5.),
+        max_rate=kwargs.pop("max_rate_limit", 50.),
+        target_latency=kwargs.pop("target_latency", None),
+    )
+    # Timeouts of connect and read, so stalled connection doesn't hang worker
+    timeout = (kwargs.pop("connect_timeout", 10.), kwargs.pop("read_timeout", 30.))
+    # Continuations which are slower than percentile of latencies are duplicated (opt-in)
+    hedging = None
+    hedge_percentile = kwargs.pop("hedge_percentile", None)
+    hedge_max_ratio = kwargs.pop("hedge_max_ratio", 0.1)
+    if hedge_percentile is not None:
+        hedging = Hedging(
+            percentile=hedge_percentile, max_ratio=hedge_max_ratio, max_workers=2 * workers * tab_workers,
+        )
+    scrapper_kwargs = {'tab_workers': tab_workers}
+    scrapper_cls, loader_cls, reloader_cls = Scrapper, Loader, Reloader
+    # Loader and reloader share one pool of connections. Pool keeps connection for every thread, and every worker has
+    # own threads of tabs
+    session = create_session(pool_maxsize=max(http_pool_size, workers * tab_workers))
+    if kwargs.pop('async_engine', False):
+        scrapper_cls, loader_cls, reloader_cls = AsyncScrapper, AsyncLoader, AsyncReloader
+        scrapper_kwargs = {'max_requests': max_requests}
+        session = None
+    cache = DBSqlLiteCache(
+        path=kwargs.pop("sqlite_path", 'data/db.sqlite'),
+        db_mod=kwargs.pop("db_mod", DB_MOD.NEW),
+        journal_mode=kwargs.pop("sqlite_journal_mode", 'wal'),
+        synchronous=kwargs.pop("sqlite_synchronous", 'normal'),
+        cache_size=kwargs.pop("sqlite_cache_size", -64000),
+        seen_index=kwargs.pop("seen_index", False),
+        channel_bloom_capacity=kwargs.pop("channel_bloom_capacity", None),
+        video_batch_size=kwargs.pop("video_batch_size", 1),
+        video_flush_interval=kwargs.pop("video_flush_interval", None),
+        revisit_budget=kwargs.pop("revisit_budget", 0.),
+        revisit_min_interval=kwargs.pop("revisit_min_interval", 86400.),
+        revisit_max_interval=kwargs.pop("revisit_max_interval", 30 * 86400.),
+        codec=build_codec(
+            compression=kwargs.pop("compression", COMPRESSION.NONE),
+            level=kwargs.pop("compression_level", None),
+            zstd_dict_path=kwargs.pop("zstd_dict_path", None),
+        ),
+    )
+    # Videos parser stops at known videos of channel, so cache is created before scrapper
+    stop_after_known_videos = kwargs.pop('stop_after_known_videos', None)
+    scrapper_parsers = [
+        parsers.HomePageParser(jq_path=kwargs.pop('homepage_parser_jq_path', 'crawler/jq/home_page.jq')),
+        parsers.VideosParser(
+            max_page=kwargs.pop('max_videos_page', None),
+            jq_load_path=kwargs.pop('video_jq_load_path', 'crawler/jq/videos.jq'),
+            jq_reload_path=kwargs.pop('video_jq_reload_path', 'crawler/jq/videos_reload.jq'),
+            stop_after_known=stop_after_known_videos,
+            check_exist=cache.check_exist_videos if stop_after_known_videos is not None else None,
+        ),
+        parsers.ChannelsParser(
+            max_page=kwargs.pop('max_channels_page', None),
+            jq_load_path=kwargs.pop('channels_jq_load_path', 'crawler/jq/channels.jq'),
+            jq_reload_path=kwargs.pop('channels_jq_reload_path', 'crawler/jq/channels_reload.jq'),
+        ),
+        parsers.AboutParser(jq_path=kwargs.pop('homepage_jq_path', 'crawler/jq/about.jq')),
+    ]
+    # Only configs which are needed by parsers are read from first pages (opt-in)
+    stream_sections = None
+    if kwargs.pop('stream_pages', False):
+        stream_sections = set().union(*(p.sections for p in scrapper_parsers))
+    scrapper = scrapper_cls(
+        loader=loader_cls(
+            base_url=kwargs.pop('loader_base_url', 'https://www.youtube.com/channel/'), session=session,
+            rate_limiter=rate_limiter, timeout=timeout, stream_sections=stream_sections,
+        ),
+        reloader=reloader_cls(
+            base_url=kwargs.pop('reloader_base_url', 'https://www.youtube.com/browse_ajax/'), session=session,
+            rate_limiter=rate_limiter, timeout=timeout, hedging=hedging,
+        ),
+        parsers=scrapper_parsers,
+        # Failed requests are retried alone, so parsed pages of channel are kept
+        retry_policy=retry_policy,
+        allow_partial=kwargs.pop('allow_partial_tabs', False),
+        channel_deadline=kwargs.pop('channel_deadline', None),
+        **scrapper_kwargs
     )
 
     crwl = YoutubeCrawler(
@@ -45,12 +138,16 @@ def build_crawler(**kwargs):
             f=kwargs.pop("ydl_format", YDL_LOADER_FORMAT.MP3),
             base_url=kwargs.pop("ydl_url", 'https://www.youtube.com/watch'),
             logger=logger,
+            rate_limiter=rate_limiter,
         ),
-        cache=DBSqlLiteCache(
-            path=kwargs.pop("sqlite_path", 'data/db.sqlite'),
-            db_mod=kwargs.pop("db_mod", DB_MOD.NEW),
-        ),
+        cache=cache,
         scraper=scrapper,
-        max_attempts=kwargs.pop("max_attempts", 5),
+        retry_policy=retry_policy,
+        video_fields=kwargs.pop("video_fields", DEFAULT_VIDEO_FIELDS),
+        archive_video_descr=kwargs.pop("archive_video_descr", False),
+        worker_id=kwargs.pop("worker_id", None),
+        lease_seconds=kwargs.pop("lease_seconds", 600.),
+        defer_seconds=kwargs.pop("defer_seconds", 600.),
+        workers=workers,
     )
     return crwl
@@ -18,7 +18,10 @@ def main():
     with open(args['base_channels']) as fd:
         channel_ids = list(filter(lambda x: len(x) > 0, map(compose.sep_url, fd.readlines())))
 
-    crawler.process(channel_ids)
+    try:
+        crawler.process(channel_ids)
+    finally:
+        crawler.close()
 
 
 if __name__ == '__main__':
@@ -1,8 +1,12 @@
+import json
 import logging
 import sqlite3
+import threading
+import time
 
 from crawler import utils
 from crawler.cache import DBSqlLiteCache, DB_MOD
+from crawler.codec import COMPRESSION, DescriptionCodec
 from tests.utils import BaseTestClass, SubTest
 
 
@@ -68,6 +72,11 @@ class TestDBSqlLiteCache(BaseTestClass):
         c.close()
         conn.close()
 
+    @staticmethod
+    def remove_filename(filename):
+        for path in (filename, filename + '-wal', filename + '-shm'):
+            BaseTestClass.remove_filename(path)
+
     def check_db_count_rows(self, db_path, assert_count, table_name):
         conn = sqlite3.connect(db_path)
         c = conn.cursor()
@@ -328,6 +337,34 @@ class TestDBSqlLiteCacheSetChannels(TestDBSqlLiteCache):
                     lambda: self.remove_filename(self.db_path + '10')
                 ],
             ),
+            SubTest(
+                name="Test 11",
+                description="Old channel is updated fully",
+                args={
+                    'channels': [
+                        {
+                            'channel_id': 'XXXX',
+                            'priority': 2,
+                            'full_description': None,
+                            'short_description': None,
+                        },
+                    ],
+                    'scrapped': True,
+                    'valid': False
+                },
+                object=DBSqlLiteCache(path=self.db_path + '11', db_mod=DB_MOD.HARD),
+                middlewares_before=[
+                    lambda: self.set_rows_channels(self.db_path + '11', ['XXXX', 'P'], downloaded=True, priority=1)
+                ],
+                middlewares_after=[
+                    lambda: self.check_field_channels(self.db_path + '11', 0, 'XXXX', field='downloaded'),
+                    lambda: self.check_field_channels(self.db_path + '11', 0, 'XXXX', field='valid'),
+                    lambda: self.check_field_channels(self.db_path + '11', 2, 'XXXX', field='priority'),
+                    lambda: self.check_field_channels(self.db_path + '11', 1, 'P', field='downloaded'),
+                    lambda: self.check_db_count_rows(self.db_path + '11', 2, 'channels'),
+                    lambda: self.remove_filename(self.db_path + '11')
+                ],
+            ),
         ]
 
     def test(self):
@@ -496,6 +533,171 @@ class TestDBSqlLiteCacheConstructor(TestDBSqlLiteCache):
             self.apply_test(test, lambda obj, kwargs: obj(**kwargs))
 
 
+class TestDBSqlLiteCacheConnection(TestDBSqlLiteCache):
+
+    def check_pragma(self, db_path, value, pragma):
+        conn = sqlite3.connect(db_path)
+        res = conn.execute('pragma %s' % pragma).fetchone()
+        self.assertEqual(value, res[0])
+        conn.close()
+
+    @staticmethod
+    def closed_cache(db_path):
+        cache = DBSqlLiteCache(path=db_path, db_mod=DB_MOD.HARD)
+        with cache:
+            cache.set_base_channels(['X'])
+        return cache
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        self.tests = [
+            SubTest(
+                name="Test 1",
+                description="WAL journal mode is persisted into data base file",
+                args={'path': self.db_path + '1', 'db_mod': DB_MOD.HARD},
+                object=DBSqlLiteCache,
+                ignore_want=True,
+                middlewares_after=[
+                    lambda: self.check_pragma(self.db_path + '1', 'wal', 'journal_mode'),
+                    lambda: self.remove_filename(self.db_path + '1')
+                ],
+            ),
+            SubTest(
+                name="Test 2",
+                description="Rollback journal mode",
+                args={'path': self.db_path + '2', 'db_mod': DB_MOD.HARD, 'journal_mode': 'delete'},
+                object=DBSqlLiteCache,
+                ignore_want=True,
+                middlewares_after=[
+                    lambda: self.check_pragma(self.db_path + '2', 'delete', 'journal_mode'),
+                    lambda: self.remove_filename(self.db_path + '2')
+                ],
+            ),
+            SubTest(
+                name="Test 3",
+                description="Invalid journal mode",
+                args={'path': self.db_path + '3', 'db_mod': DB_MOD.HARD, 'journal_mode': 'wal; drop table videos'},
+                object=DBSqlLiteCache,
+                exception=AttributeError,
+                middlewares_after=[lambda: self.remove_filename(self.db_path + '3')],
+            ),
+            SubTest(
+                name="Test 4",
+                description="Invalid synchronous mode",
+                args={'path': self.db_path + '4', 'db_mod': DB_MOD.HARD, 'synchronous': 'fast'},
+                object=DBSqlLiteCache,
+                exception=AttributeError,
+                middlewares_after=[lambda: self.remove_filename(self.db_path + '4')],
+            ),
+        ]
+
+    def test(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: obj(**kwargs))
+
+    def test_closed(self):
+        cache = self.closed_cache(self.db_path + '5')
+        self.check_db_count_rows(self.db_path + '5', 1, 'channels')
+        self.assertRaises(utils.CacheError, cache.get_best_channel_id)
+        self.remove_filename(self.db_path + '5')
+
+    def test_rollback(self):
+        cache = DBSqlLiteCache(path=self.db_path + '6', db_mod=DB_MOD.HARD)
+        channels = [
+            {'channel_id': 'X', 'priority': 0, 'full_description': None, 'short_description': None},
+            {'channel_id': 'Y', 'priority': [], 'full_description': None, 'short_description': None},
+        ]
+        self.assertRaises(sqlite3.Error, cache.set_channels, channels, scrapped=False, valid=True)
+        cache.set_base_channels(['Z'])
+        self.check_db_count_rows(self.db_path + '6', 1, 'channels')
+        cache.close()
+        self.remove_filename(self.db_path + '6')
+
+
+class TestDBSqlLiteCacheMigration(TestDBSqlLiteCache):
+
+    @staticmethod
+    def create_old_db(db_path):
+        conn = sqlite3.connect(db_path)
+        conn.execute('create table channels (channel_id text PRIMARY KEY, base_channel boolean DEFAULT FALSE, '
+                     'valid boolean DEFAULT TRUE, scrapped boolean DEFAULT FALSE, downloaded boolean DEFAULT FALSE, '
+                     'priority float DEFAULT 0, full_description text, short_description text);')
+        conn.execute('create table videos (channel_id text, video_id text PRIMARY KEY, valid boolean, '
+                     'priority float, full_description text, short_description text);')
+        conn.commit()
+        conn.close()
+
+    def check_frontier_plan(self, db_path):
+        conn = sqlite3.connect(db_path)
+        plan = ' '.join(row[3] for row in conn.execute(
+            'explain query plan select channel_id from channels '
+            'where channels.valid = TRUE and channels.downloaded = FALSE '
+            'order by NOT channels.scrapped, NOT channels.base_channel, -channels.priority'
+        ))
+        conn.close()
+        self.assertIn('channels_frontier', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_new(self):
+        cache = DBSqlLiteCache(path=self.db_path + '1', db_mod=DB_MOD.HARD)
+        self.check_frontier_plan(self.db_path + '1')
+        cache.close()
+        self.remove_filename(self.db_path + '1')
+
+    def test_old(self):
+        self.remove_filename(self.db_path + '2')
+        self.create_old_db(self.db_path + '2')
+        self.set_rows_channels(self.db_path + '2', ['X'], scrapped=False, priority=1)
+        self.set_rows_channels(self.db_path + '2', ['Y'], scrapped=True)
+        self.set_rows_channels(self.db_path + '2', ['Z'], downloaded=True)
+        cache = DBSqlLiteCache(path=self.db_path + '2', db_mod=DB_MOD.OLD)
+        self.check_frontier_plan(self.db_path + '2')
+        self.assertEqual('Y', cache.get_best_channel_id())
+        cache.close()
+        # Downloaded channels are due for revisit
+        conn = sqlite3.connect(self.db_path + '2')
+        res = conn.execute('select channel_id, next_visit from channels order by channel_id').fetchall()
+        conn.close()
+        self.assertEqual([('X', None), ('Y', None), ('Z', 0)], res)
+
+        # Migrations are not applied twice
+        cache = DBSqlLiteCache(path=self.db_path + '2', db_mod=DB_MOD.OLD)
+        self.assertEqual('Y', cache.get_best_channel_id())
+        cache.close()
+        # Downloaded channel is revisited
+        cache = DBSqlLiteCache(path=self.db_path + '2', db_mod=DB_MOD.OLD, revisit_budget=1.)
+        self.assertIn('Z', cache.claim_best_channels('w', k=3))
+        cache.close()
+        self.remove_filename(self.db_path + '2')
+
+    def test_concurrent(self):
+        db_path = self.db_path + '3'
+        self.remove_filename(db_path)
+        self.addCleanup(self.remove_filename, db_path)
+        self.create_old_db(db_path)
+        self.set_rows_channels(db_path, ['X'], downloaded=True)
+        errors = []
+        barrier = threading.Barrier(4)
+
+        def open_cache():
+            barrier.wait()
+            try:
+                DBSqlLiteCache(path=db_path, db_mod=DB_MOD.OLD).close()
+            except Exception as e:
+                errors.append(e)
+
+        # Processes of crawler open old data base at once, but every migration is applied once
+        threads = [threading.Thread(target=open_cache) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        conn = sqlite3.connect(db_path)
+        self.assertEqual(0, conn.execute("select next_visit from channels where channel_id='X'").fetchone()[0])
+        conn.close()
+
+
 class TestDBSqlLiteCacheSetFailedChannel(TestDBSqlLiteCache):
 
     def setUp(self):
@@ -728,6 +930,273 @@ class TestDBSqlLiteCacheGetBestChannelId(TestDBSqlLiteCache):
             self.apply_test(test, lambda obj, kwargs: obj.get_best_channel_id(**kwargs))
 
 
+class TestDBSqlLiteCacheAddNeighbChannels(TestDBSqlLiteCache):
+
+    @staticmethod
+    def create_channels(channel_ids):
+        return [
+            {'channel_id': channel_id, 'priority': 0, 'full_description': None, 'short_description': '{"n": 1}'}
+            for channel_id in channel_ids
+        ]
+
+    def get_channel(self, cache, channel_id):
+        channel = cache.get_channel_descr(channel_id)
+        return channel['valid'], channel['scrapped'], channel['downloaded'], channel['short_description']
+
+    def check_neighb_channels(self, seen_index):
+        db_path = self.db_path + ('2' if seen_index else '1')
+        cache = DBSqlLiteCache(path=db_path, db_mod=DB_MOD.HARD)
+        self.set_rows_channels(db_path, ['D'], downloaded=True, scrapped=True)
+        self.set_rows_channels(db_path, ['S'], scrapped=True)
+        self.set_rows_channels(db_path, ['I'], valid=False)
+        self.set_rows_channels(db_path, ['F'])
+        cache.close()
+
+        cache = DBSqlLiteCache(path=db_path, db_mod=DB_MOD.OLD, seen_index=seen_index)
+        self.assertEqual(3, cache.add_neighb_channels(self.create_channels(['D', 'S', 'I', 'F', 'N', 'N'])))
+        self.assertEqual((True, True, True, '{"n": 1}'), self.get_channel(cache, 'D'))
+        self.assertEqual((True, True, False, '{"n": 1}'), self.get_channel(cache, 'S'))
+        self.assertEqual((False, False, False, '{"n": 1}'), self.get_channel(cache, 'I'))
+        self.assertEqual((True, False, False, '{"n": 1}'), self.get_channel(cache, 'F'))
+        self.assertEqual((True, False, False, '{"n": 1}'), self.get_channel(cache, 'N'))
+        self.check_db_count_rows(db_path, 5, 'channels')
+
+        # Known short description isn't replaced
+        channels = self.create_channels(['N'])
+        channels[0]['short_description'] = '{"n": 2}'
+        self.assertEqual(0, cache.add_neighb_channels(channels))
+        self.assertEqual((True, False, False, '{"n": 1}'), self.get_channel(cache, 'N'))
+        self.assertEqual(0, cache.add_neighb_channels([]))
+        cache.close()
+        self.remove_filename(db_path)
+
+    def test_add(self):
+        self.check_neighb_channels(seen_index=False)
+
+    def test_add_seen_index(self):
+        self.check_neighb_channels(seen_index=True)
+
+
+class TestDBSqlLiteCacheClaimBestChannels(TestDBSqlLiteCache):
+
+    def create_cache(self, db_path):
+        cache = DBSqlLiteCache(path=db_path, db_mod=DB_MOD.HARD)
+        self.set_rows_channels(db_path, ['A'], priority=3)
+        self.set_rows_channels(db_path, ['B'], priority=2)
+        self.set_rows_channels(db_path, ['C'], priority=1)
+        return cache
+
+    def test_claim(self):
+        cache = self.create_cache(self.db_path + '1')
+        self.assertEqual(['A', 'B'], cache.claim_best_channels('w1', k=2))
+        self.assertEqual(['C'], cache.claim_best_channels('w2', k=2))
+        self.assertEqual([], cache.claim_best_channels('w3'))
+        self.assertRaises(utils.CacheError, cache.get_best_channel_id)
+        self.assertRaises(AttributeError, cache.claim_best_channels, 'w1', k=0)
+
+        cache.release_channels('w1', ['B'])
+        self.assertEqual('B', cache.get_best_channel_id())
+        cache.release_channels('w2')
+        self.assertEqual(['B', 'C'], cache.claim_best_channels('w3', k=5))
+        cache.close()
+        self.remove_filename(self.db_path + '1')
+
+    def test_expired(self):
+        cache = self.create_cache(self.db_path + '2')
+        self.assertEqual(['A'], cache.claim_best_channels('w1', lease_seconds=0))
+        # Lease of crashed worker is expired, so channel comes back
+        self.assertEqual(['A'], cache.claim_best_channels('w2'))
+        self.assertEqual(set(), cache.renew_leases('w1', ['A']))
+        self.assertEqual({'A'}, cache.renew_leases('w2', ['A', 'B']))
+        cache.close()
+        self.remove_filename(self.db_path + '2')
+
+    def test_downloaded(self):
+        cache = self.create_cache(self.db_path + '3')
+        self.assertEqual(['A'], cache.claim_best_channels('w1'))
+        cache.update_channel_downloaded('A')
+        cache.release_channels('w1')
+        self.assertEqual(['B'], cache.claim_best_channels('w1'))
+        cache.close()
+        self.remove_filename(self.db_path + '3')
+
+    def test_defer(self):
+        db_path = self.db_path + '5'
+        cache = self.create_cache(db_path)
+        self.assertEqual(['A'], cache.claim_best_channels('w1'))
+        cache.defer_channel('A', 60.)
+        # Deferred channel isn't owned by worker, so it isn't released with its leases
+        cache.release_channels('w1')
+        self.assertEqual(['B', 'C'], cache.claim_best_channels('w2', k=3))
+        # Deferred channel isn't failed
+        self.assertTrue(cache.get_channel_descr('A')['valid'])
+        cache.defer_channel('B', 0.)
+        self.assertEqual('B', cache.get_best_channel_id())
+        self.assertRaises(utils.CacheError, cache.defer_channel, 'unknown', 60.)
+        cache.close()
+        self.remove_filename(db_path)
+
+    def test_crawl_complete(self):
+        db_path = self.db_path + '6'
+        cache = self.create_cache(db_path)
+        self.assertFalse(cache.is_crawl_complete('A'))
+        self.assertFalse(cache.is_crawl_complete('unknown'))
+        cache.update_channel_downloaded('A')
+        self.assertTrue(cache.is_crawl_complete('A'))
+        # Some videos of deferred channel were stored, so crawl isn't complete
+        cache.defer_channel('A', 60.)
+        self.assertFalse(cache.is_crawl_complete('A'))
+        # Tab of channel was cut
+        cache.set_channels([{
+            'channel_id': 'B', 'priority': 0, 'full_description': json.dumps({'partial_tabs': ['videos']}),
+            'short_description': None,
+        }], scrapped=True, valid=True)
+        cache.update_channel_downloaded('B')
+        self.assertFalse(cache.is_crawl_complete('B'))
+        cache.close()
+        self.remove_filename(db_path)
+
+    def test_concurrent(self):
+        db_path = self.db_path + '4'
+        self.remove_filename(db_path)
+        cache = DBSqlLiteCache(path=db_path, db_mod=DB_MOD.NEW)
+        channel_ids = ['X%03d' % i for i in range(200)]
+        self.set_rows_channels(db_path, channel_ids)
+
+        # Every worker has own connection as separate process
+        caches = [DBSqlLiteCache(path=db_path, db_mod=DB_MOD.OLD) for _ in range(4)]
+        claimed = [[] for _ in caches]
+
+        def work(i):
+            while True:
+                ids = caches[i].claim_best_channels('w%d' % i, k=3)
+                if len(ids) == 0:
+                    return
+                claimed[i] += ids
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(len(caches))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        all_claimed = [channel_id for ids in claimed for channel_id in ids]
+        self.assertEqual(sorted(channel_ids), sorted(all_claimed))
+        for c in caches + [cache]:
+            c.close()
+        self.remove_filename(db_path)
+
+
+class TestDBSqlLiteCacheRevisit(TestDBSqlLiteCache):
+
+    @staticmethod
+    def set_crawl_stats(db_path, channel_id, last_crawl=None, next_visit=None):
+        conn = sqlite3.connect(db_path)
+        conn.execute('update channels set last_crawl=?, next_visit=? where channel_id=?',
+                     (last_crawl, next_visit, channel_id))
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def get_crawl_stats(db_path, channel_id):
+        conn = sqlite3.connect(db_path)
+        res = conn.execute('select last_crawl, upload_rate, next_visit from channels where channel_id=?',
+                           (channel_id,)).fetchone()
+        conn.close()
+        return res
+
+    def check_next_visit(self, db_path, channel_id, interval, upload_rate):
+        last_crawl, rate, next_visit = self.get_crawl_stats(db_path, channel_id)
+        # Some time passes between setting of stats and update
+        self.assertAlmostEqual(interval, next_visit - last_crawl, delta=interval * 0.01)
+        if upload_rate is None:
+            self.assertIsNone(rate)
+        else:
+            self.assertAlmostEqual(upload_rate, rate, delta=upload_rate * 0.01)
+        return last_crawl
+
+    def test_schedule(self):
+        db_path = self.db_path + '1'
+        cache = DBSqlLiteCache(path=db_path, db_mod=DB_MOD.HARD, revisit_min_interval=100, revisit_max_interval=1000)
+        self.set_rows_channels(db_path, ['A'])
+        self.assertRaises(utils.CacheError, cache.update_channel_downloaded, 'B')
+
+        # Videos of first crawl are the whole history, so upload rate is unknown
+        cache.update_channel_downloaded('A', new_videos=50)
+        last_crawl = self.check_next_visit(db_path, 'A', interval=100, upload_rate=None)
+        self.assertTrue(cache.get_channel_descr('A')['downloaded'])
+
+        # One video per 500 seconds
+        self.set_crawl_stats(db_path, 'A', last_crawl=last_crawl - 500)
+        cache.update_channel_downloaded('A', new_videos=1)
+        last_crawl = self.check_next_visit(db_path, 'A', interval=500, upload_rate=1 / 500)
+
+        # Rate is smoothed and interval is limited by max interval
+        self.set_crawl_stats(db_path, 'A', last_crawl=last_crawl - 10)
+        cache.update_channel_downloaded('A', new_videos=0)
+        last_crawl = self.check_next_visit(db_path, 'A', interval=1000, upload_rate=1 / 1000)
+
+        # Unknown count of new videos keeps rate
+        cache.update_channel_downloaded('A')
+        last_crawl = self.check_next_visit(db_path, 'A', interval=1000, upload_rate=1 / 1000)
+
+        # Interval is limited by min interval
+        self.set_crawl_stats(db_path, 'A', last_crawl=last_crawl - 10)
+        cache.update_channel_downloaded('A', new_videos=10)
+        self.check_next_visit(db_path, 'A', interval=100, upload_rate=0.5 + 1 / 2000)
+        cache.close()
+        self.remove_filename(db_path)
+
+    def create_cache(self, db_path, revisit_budget):
+        cache = DBSqlLiteCache(path=db_path, db_mod=DB_MOD.HARD, revisit_budget=revisit_budget)
+        self.set_rows_channels(db_path, ['A'], priority=3)
+        self.set_rows_channels(db_path, ['B'], priority=2)
+        self.set_rows_channels(db_path, ['C'], priority=1)
+        self.set_rows_channels(db_path, ['D', 'E', 'F'], downloaded=True)
+        self.set_crawl_stats(db_path, 'D', next_visit=1)
+        self.set_crawl_stats(db_path, 'E', next_visit=2)
+        # Visit of F is not due yet
+        self.set_crawl_stats(db_path, 'F', next_visit=time.time() + 1000)
+        return cache
+
+    def test_interleave(self):
+        db_path = self.db_path + '2'
+        cache = self.create_cache(db_path, revisit_budget=0.5)
+        self.assertEqual(['A', 'D', 'B', 'E', 'C'], cache.claim_best_channels('w1', k=10))
+        cache.close()
+        self.remove_filename(db_path)
+
+    def test_empty_frontier(self):
+        db_path = self.db_path + '3'
+        cache = self.create_cache(db_path, revisit_budget=0.1)
+        self.assertEqual(['A', 'B', 'C'], cache.claim_best_channels('w1', k=3))
+        # Due revisits are selected when frontier is empty
+        self.assertEqual('D', cache.get_best_channel_id())
+        self.assertEqual(['D', 'E'], cache.claim_best_channels('w2', k=3))
+        self.assertEqual([], cache.claim_best_channels('w3', k=3))
+        cache.close()
+        self.remove_filename(db_path)
+
+    def test_disabled(self):
+        db_path = self.db_path + '4'
+        cache = self.create_cache(db_path, revisit_budget=0)
+        self.assertEqual(['A', 'B', 'C'], cache.claim_best_channels('w1', k=10))
+        self.assertRaises(utils.CacheError, cache.get_best_channel_id)
+        cache.close()
+        self.remove_filename(db_path)
+
+    def test_wrong_attributes(self):
+        db_path = self.db_path + '5'
+        for kwargs in [
+            {'revisit_budget': -0.1},
+            {'revisit_budget': 1.1},
+            {'revisit_min_interval': 0},
+            {'revisit_min_interval': 10, 'revisit_max_interval': 5},
+            {'upload_rate_smoothing': 0},
+        ]:
+            self.assertRaises(AttributeError, DBSqlLiteCache, path=db_path, db_mod=DB_MOD.HARD, **kwargs)
+        self.remove_filename(db_path)
+
+
 class TestDBSqlLiteCacheCheckExistVideo(TestDBSqlLiteCache):
 
     def setUp(self):
@@ -773,6 +1242,242 @@ class TestDBSqlLiteCacheCheckExistVideo(TestDBSqlLiteCache):
             self.apply_test(test, lambda obj, kwargs: obj.check_exist_video(**kwargs))
 
 
+class TestDBSqlLiteCacheCheckExistVideos(TestDBSqlLiteCache):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        many_video_ids = ['V%d' % i for i in range(1200)]
+        self.tests = [
+            SubTest(
+                name="Test 1",
+                description="Empty input",
+                args={'video_ids': []},
+                object=DBSqlLiteCache(path=self.db_path+'1', db_mod=DB_MOD.HARD),
+                middlewares_before=[
+                    lambda: self.set_rows_videos(self.db_path + '1', ['XXXX', 'P'], valid=True),
+                ],
+                want=set(),
+                middlewares_after=[lambda: self.remove_filename(self.db_path+'1')],
+            ),
+            SubTest(
+                name="Test 2",
+                description="Part of videos exist",
+                args={'video_ids': ['X', 'Y', 'P', 'X']},
+                object=DBSqlLiteCache(path=self.db_path+'2', db_mod=DB_MOD.HARD),
+                middlewares_before=[
+                    lambda: self.set_rows_videos(self.db_path + '2', ['X', 'P', 'Z'], valid=True),
+                ],
+                want={'X', 'P'},
+                middlewares_after=[lambda: self.remove_filename(self.db_path+'2')],
+            ),
+            SubTest(
+                name="Test 3",
+                description="Several chunks of IN-list",
+                args={'video_ids': many_video_ids + ['Y']},
+                object=DBSqlLiteCache(path=self.db_path+'3', db_mod=DB_MOD.HARD),
+                middlewares_before=[
+                    lambda: self.set_rows_videos(self.db_path + '3', many_video_ids[::2], valid=True),
+                ],
+                want=set(many_video_ids[::2]),
+                middlewares_after=[lambda: self.remove_filename(self.db_path+'3')],
+            ),
+        ]
+
+    def test(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: obj.check_exist_videos(**kwargs))
+
+
+class TestDBSqlLiteCacheSeenIndex(TestDBSqlLiteCache):
+
+    @staticmethod
+    def create_cache(db_path, **kwargs):
+        DBSqlLiteCache(path=db_path, db_mod=DB_MOD.HARD).close()
+        TestDBSqlLiteCache.set_rows_videos(db_path, ['77zRrFOuW0k', 'X'])
+        TestDBSqlLiteCache.set_rows_channels(db_path, ['UCzAzPC4VWIMHqrnIM1iBPsQ', 'Y'])
+        return DBSqlLiteCache(path=db_path, db_mod=DB_MOD.OLD, seen_index=True, **kwargs)
+
+    def test_videos(self):
+        cache = self.create_cache(self.db_path + '1')
+        self.assertTrue(cache.check_exist_video('77zRrFOuW0k'))
+        self.assertTrue(cache.check_exist_video('X'))
+        self.assertFalse(cache.check_exist_video('CQbaAZ1px9Y'))
+
+        # Index is not updated by another connections
+        self.set_rows_videos(self.db_path + '1', ['CQbaAZ1px9Y'])
+        self.assertFalse(cache.check_exist_video('CQbaAZ1px9Y'))
+
+        cache.insert_video_descr({
+            'video_id': 'W1vDil6MXV4', 'channel_id': 'Y', 'valid': True, 'priority': 0,
+            'full_description': None, 'short_description': None,
+        })
+        self.assertEqual({'77zRrFOuW0k', 'W1vDil6MXV4'}, cache.check_exist_videos(['77zRrFOuW0k', 'W1vDil6MXV4', 'Z']))
+        cache.close()
+        self.remove_filename(self.db_path + '1')
+
+    def test_channels(self):
+        for i, kwargs in enumerate([{}, {'channel_bloom_capacity': 100}]):
+            cache = self.create_cache(self.db_path + str(i + 2), **kwargs)
+            self.assertTrue(cache.check_exist_channel('UCzAzPC4VWIMHqrnIM1iBPsQ'))
+            self.assertFalse(cache.check_exist_channel('Z'))
+            cache.set_base_channels(['Z'])
+            cache.set_channels(
+                [{'channel_id': 'W', 'priority': 0, 'full_description': None, 'short_description': None}],
+                scrapped=False, valid=True
+            )
+            self.assertEqual({'Y', 'Z', 'W'}, cache.check_exist_channels(['Y', 'Z', 'W', 'V']))
+            cache.update_channel_downloaded('Z')
+            self.assertRaises(utils.CacheError, cache.update_channel_downloaded, 'V')
+            cache.close()
+            self.remove_filename(self.db_path + str(i + 2))
+
+
+class TestDBSqlLiteCacheInsertVideo(TestDBSqlLiteCache):
+
+    @staticmethod
+    def create_video(video_id, channel_id='X'):
+        return {
+            'video_id': video_id,
+            'channel_id': channel_id,
+            'full_description': '{}',
+            'short_description': '{}',
+            'valid': True,
+            'priority': 0,
+        }
+
+    def test_write_through(self):
+        cache = DBSqlLiteCache(path=self.db_path + '1', db_mod=DB_MOD.HARD)
+        cache.insert_video_descr(self.create_video('A'))
+        self.check_db_count_rows(self.db_path + '1', 1, 'videos')
+        # Existing video is ignored
+        cache.insert_video_descr(self.create_video('A'))
+        self.check_db_count_rows(self.db_path + '1', 1, 'videos')
+        cache.close()
+        self.remove_filename(self.db_path + '1')
+
+    def test_batch(self):
+        cache = DBSqlLiteCache(path=self.db_path + '2', db_mod=DB_MOD.HARD, video_batch_size=3)
+        cache.insert_video_descr(self.create_video('A'))
+        cache.insert_video_descr(self.create_video('B'))
+        cache.insert_video_descr(self.create_video('B'))
+        self.check_db_count_rows(self.db_path + '2', 0, 'videos')
+        self.assertTrue(cache.check_exist_video('B'))
+        self.assertEqual({'A', 'B'}, cache.check_exist_videos(['A', 'B', 'C']))
+        cache.insert_video_descr(self.create_video('C'))
+        self.check_db_count_rows(self.db_path + '2', 3, 'videos')
+
+        cache.insert_video_descr(self.create_video('D'))
+        cache.update_failed_video('D')
+        self.check_db_count_rows(self.db_path + '2', 4, 'videos')
+        self.check_field_videos(self.db_path + '2', 0, 'D', field='valid')
+
+        cache.insert_video_descr(self.create_video('E'))
+        cache.close()
+        self.check_db_count_rows(self.db_path + '2', 5, 'videos')
+        self.remove_filename(self.db_path + '2')
+
+    def test_channel_downloaded(self):
+        cache = DBSqlLiteCache(path=self.db_path + '3', db_mod=DB_MOD.HARD, video_batch_size=100)
+        cache.set_base_channels(['X'])
+        cache.insert_video_descr(self.create_video('A'))
+
+        # Buffer is kept if channel is not marked as downloaded
+        self.assertRaises(utils.CacheError, cache.update_channel_downloaded, 'Y')
+        self.check_db_count_rows(self.db_path + '3', 0, 'videos')
+
+        cache.update_channel_downloaded('X')
+        self.check_db_count_rows(self.db_path + '3', 1, 'videos')
+        self.check_field_channels(self.db_path + '3', 1, 'X', field='downloaded')
+        cache.close()
+        self.remove_filename(self.db_path + '3')
+
+    def test_flush_interval(self):
+        cache = DBSqlLiteCache(path=self.db_path + '4', db_mod=DB_MOD.HARD, video_batch_size=100,
+                               video_flush_interval=0)
+        cache.insert_video_descr(self.create_video('A'))
+        self.check_db_count_rows(self.db_path + '4', 1, 'videos')
+        cache.close()
+        self.remove_filename(self.db_path + '4')
+
+
+class TestDBSqlLiteCacheCompression(TestDBSqlLiteCache):
+
+    full_descr = '{"formats": [%s]}' % ', '.join(['{"ext": "webm", "format_id": "%d"}' % i for i in range(50)])
+
+    def check_type_descriptions(self, db_path, value, table_name):
+        conn = sqlite3.connect(db_path)
+        res = conn.execute('select distinct typeof(full_description) from %s' % table_name).fetchall()
+        conn.close()
+        self.assertEqual([(value,)], res)
+
+    def fill_cache(self, cache):
+        cache.set_channels(
+            [{'channel_id': 'X', 'priority': 0, 'full_description': self.full_descr, 'short_description': None}],
+            scrapped=True, valid=True
+        )
+        cache.insert_video_descr({
+            'video_id': 'A', 'channel_id': 'X', 'valid': True, 'priority': 0,
+            'full_description': self.full_descr, 'short_description': '{}',
+        })
+
+    def test_compressed(self):
+        cache = DBSqlLiteCache(path=self.db_path + '1', db_mod=DB_MOD.HARD, codec=DescriptionCodec(COMPRESSION.ZLIB))
+        self.fill_cache(cache)
+        self.check_type_descriptions(self.db_path + '1', 'blob', 'channels')
+        self.check_type_descriptions(self.db_path + '1', 'blob', 'videos')
+        self.assertEqual(self.full_descr, cache.get_channel_descr('X')['full_description'])
+        self.assertEqual(self.full_descr, cache.get_video_descr('A')['full_description'])
+        self.assertRaises(utils.CacheError, cache.get_video_descr, 'B')
+        self.assertRaises(utils.CacheError, cache.get_channel_descr, 'Y')
+        cache.close()
+        self.remove_filename(self.db_path + '1')
+
+    def test_recode(self):
+        cache = DBSqlLiteCache(path=self.db_path + '2', db_mod=DB_MOD.HARD)
+        self.fill_cache(cache)
+        cache.close()
+        self.check_type_descriptions(self.db_path + '2', 'text', 'videos')
+
+        cache = DBSqlLiteCache(path=self.db_path + '2', db_mod=DB_MOD.OLD, codec=DescriptionCodec(COMPRESSION.ZLIB))
+        self.assertEqual(2, cache.recode_descriptions(batch_size=1))
+        self.assertEqual(0, cache.recode_descriptions())
+        cache.vacuum()
+        self.check_type_descriptions(self.db_path + '2', 'blob', 'channels')
+        self.check_type_descriptions(self.db_path + '2', 'blob', 'videos')
+        self.assertEqual(self.full_descr, cache.get_video_descr('A')['full_description'])
+        cache.close()
+
+        # Descriptions are decompressed back
+        cache = DBSqlLiteCache(path=self.db_path + '2', db_mod=DB_MOD.OLD)
+        self.assertEqual(2, cache.recode_descriptions())
+        self.check_type_descriptions(self.db_path + '2', 'text', 'videos')
+        cache.close()
+        self.remove_filename(self.db_path + '2')
+
+    def test_archive(self):
+        cache = DBSqlLiteCache(path=self.db_path + '3', db_mod=DB_MOD.HARD, codec=DescriptionCodec(COMPRESSION.ZLIB))
+        self.fill_cache(cache)
+        cache.insert_video_descr({
+            'video_id': 'B', 'channel_id': 'X', 'valid': True, 'priority': 0,
+            'full_description': '{}', 'short_description': '{}', 'archive_description': self.full_descr,
+        })
+        self.assertIsNone(cache.get_video_descr('A')['archive_description'])
+        self.assertEqual(self.full_descr, cache.get_video_descr('B')['archive_description'])
+        cache.close()
+
+        conn = sqlite3.connect(self.db_path + '3')
+        res = conn.execute("select typeof(archive_description) from videos where video_id='B'").fetchall()
+        conn.close()
+        self.assertEqual([('blob',)], res)
+
+        # Archive descriptions are recoded too
+        cache = DBSqlLiteCache(path=self.db_path + '3', db_mod=DB_MOD.OLD)
+        self.assertEqual(4, cache.recode_descriptions())
+        self.assertEqual(self.full_descr, cache.get_video_descr('B')['archive_description'])
+        cache.close()
+        self.remove_filename(self.db_path + '3')
+
+
 class TestDBSqlLiteCacheSetFailedVideo(TestDBSqlLiteCache):
 
     def setUp(self):
@@ -0,0 +1,107 @@
+import json
+import logging
+import threading
+import unittest
+
+from crawler import codec, utils
+from crawler.codec import COMPRESSION, DescriptionCodec
+from tests.utils import BaseTestClass, SubTest
+
+
+descr = json.dumps({
+    'id': '77zRrFOuW0k',
+    'title': 'Иностранец реагирует на Miyagi & Andy Panda - Get Up',
+    'formats': [{'format_id': str(i), 'ext': 'webm', 'url': 'https://example.com/%d' % i} for i in range(20)],
+})
+
+
+class TestDescriptionCodec(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        self.tests = [
+            SubTest(
+                name="Test 1",
+                description="Without compression",
+                args={'descr': descr},
+                object=DescriptionCodec(),
+                want=descr,
+            ),
+            SubTest(
+                name="Test 2",
+                description="Zlib",
+                args={'descr': descr},
+                object=DescriptionCodec(COMPRESSION.ZLIB),
+                want=descr,
+            ),
+            SubTest(
+                name="Test 3",
+                description="Zlib with level",
+                args={'descr': descr},
+                object=DescriptionCodec(COMPRESSION.ZLIB, level=9),
+                want=descr,
+            ),
+            SubTest(
+                name="Test 4",
+                description="None description",
+                args={'descr': None},
+                object=DescriptionCodec(COMPRESSION.ZLIB),
+                want=None,
+            ),
+        ]
+
+    def test_encode_decode(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: obj.decode(obj.encode(**kwargs)))
+
+    def test_compressed(self):
+        value = DescriptionCodec(COMPRESSION.ZLIB).encode(descr)
+        self.assertIsInstance(value, bytes)
+        self.assertLess(len(value), len(descr.encode('utf-8')))
+        # Every codec decodes text and compressed values
+        self.assertEqual(descr, DescriptionCodec().decode(value))
+        self.assertEqual(descr, DescriptionCodec(COMPRESSION.ZLIB).decode(descr))
+
+    def test_unknown_compression(self):
+        self.assertRaises(utils.CacheError, DescriptionCodec().decode, b'\x7fdata')
+
+
+@unittest.skipIf(codec.zstandard is None, "package zstandard is not installed")
+class TestDescriptionCodecZstd(BaseTestClass):
+
+    def test_zstd(self):
+        c = DescriptionCodec(COMPRESSION.ZSTD, level=3)
+        value = c.encode(descr)
+        self.assertLess(len(value), len(descr.encode('utf-8')))
+        self.assertEqual(descr, c.decode(value))
+        self.assertEqual(descr, DescriptionCodec().decode(value))
+
+    def test_zstd_dict(self):
+        samples = [descr.replace('77zRrFOuW0k', 'video%04d' % i) for i in range(200)]
+        zstd_dict = codec.train_zstd_dict(samples, dict_size=4096)
+        c = DescriptionCodec(COMPRESSION.ZSTD, zstd_dict=zstd_dict)
+        value = c.encode(samples[0])
+        self.assertLess(len(value), len(DescriptionCodec(COMPRESSION.ZSTD).encode(samples[0])))
+        self.assertEqual(samples[0], c.decode(value))
+
+    def test_threads(self):
+        samples = [descr.replace('77zRrFOuW0k', 'video%04d' % i) for i in range(200)]
+        c = DescriptionCodec(COMPRESSION.ZSTD, zstd_dict=codec.train_zstd_dict(samples, dict_size=4096))
+        errors = []
+
+        def run(worker):
+            try:
+                for i in range(200):
+                    sample = samples[(worker + i) % len(samples)]
+                    if c.decode(c.encode(sample)) != sample:
+                        errors.append(sample)
+            except Exception as e:
+                errors.append(e)
+
+        # Threads of cache share one codec
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
@@ -1,7 +1,15 @@
+import asyncio
+import json
 import logging
+import threading
+import time
+
+import youtube_dl
 
 from crawler import utils
-from crawler.crawler import YoutubeCrawler
+from crawler.cache import DBSqlLiteCache, DB_MOD
+from crawler.loaders import Tab
+from crawler.crawler import YoutubeCrawler, project_video_descr
 from crawler.utils import CrawlerError
 from tests import full_descr_mock
 from tests.utils import BaseTestClass, SubTest
@@ -35,7 +43,7 @@ class DownloaderMock:
 
 class ScrapperMock:
 
-    def parse(self, _):
+    def parse(self, _, partial_tabs=None, incremental=True):
         return full_descr_mock
 
 
@@ -88,3 +96,399 @@ class TestScrapper(BaseTestClass):
     def test_parse(self):
         for test in self.tests:
             self.apply_test(test, lambda obj, kwargs: obj.process(**kwargs))
+
+
+class TestProjectVideoDescr(BaseTestClass):
+
+    descr = {
+        'id': '77zRrFOuW0k',
+        'title': 'Title',
+        'duration': 125,
+        'channel_id': 'UCXXXXXXXXXXXXXXXXXXXXXX',
+        'formats': [{'format_id': '251', 'url': 'https://example.com/251'}],
+        'thumbnails': [{'url': 'https://example.com/default.jpg'}],
+        'automatic_captions': {'ru': [{'ext': 'vtt'}], 'en': [{'ext': 'vtt'}]},
+        'subtitles': {'ru': [{'ext': 'vtt', 'url': 'https://example.com/ru.vtt?signature=X'}]},
+    }
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        self.tests = [
+            SubTest(
+                name="Test 1",
+                description="Default fields",
+                args={'descr': self.descr},
+                object=None,
+                want={
+                    'id': '77zRrFOuW0k',
+                    'title': 'Title',
+                    'duration': 125,
+                    'channel_id': 'UCXXXXXXXXXXXXXXXXXXXXXX',
+                    'automatic_captions': ['en', 'ru'],
+                    'subtitles': ['ru'],
+                },
+            ),
+            SubTest(
+                name="Test 2",
+                description="Custom fields",
+                args={'descr': self.descr, 'fields': ('id', 'formats', 'view_count')},
+                object=None,
+                want={'id': '77zRrFOuW0k', 'formats': [{'format_id': '251', 'url': 'https://example.com/251'}]},
+            ),
+            SubTest(
+                name="Test 3",
+                description="All fields, but subtitles with signed urls",
+                args={'descr': self.descr, 'fields': None},
+                object=None,
+                want={k: v for k, v in self.descr.items() if k != 'subtitles'},
+            ),
+            SubTest(
+                name="Test 4",
+                description="Empty description (video without captions)",
+                args={'descr': {}},
+                object=None,
+                want={},
+            ),
+        ]
+
+    def test_project(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: project_video_descr(**kwargs))
+
+
+class GraphScrapperMock:
+    """
+    Channel i has neighbours 2i+1 and 2i+2 (binary tree of channels)
+    """
+
+    def __init__(self, count, latency):
+        self.count = count
+        self.latency = latency
+        self.parsed = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def parse(self, channel_id, partial_tabs=None, incremental=True):
+        with self.lock:
+            self.parsed.append(channel_id)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.latency)
+        i = int(channel_id[1:])
+        neighbours = [{'channel_id': 'C%d' % j} for j in (2 * i + 1, 2 * i + 2) if j < self.count]
+        with self.lock:
+            self.active -= 1
+        return {
+            Tab.HomePage: [{'owner_channel': {'id': channel_id}}],
+            Tab.Videos: [],
+            Tab.Channels: neighbours,
+        }
+
+
+class AsyncGraphScrapperMock(GraphScrapperMock):
+
+    async def parse(self, channel_id, partial_tabs=None, incremental=True):
+        # The same as GraphScrapperMock, but latency doesn't block event loop
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.latency)
+        self.active -= 1
+        self.latency, latency = 0., self.latency
+        descr = super().parse(channel_id)
+        self.latency = latency
+        return descr
+
+    async def close(self):
+        self.closed = True
+
+
+class StreamDownloaderMock:
+    def __init__(self, events):
+        self.events = events
+
+    def load(self, video_id):
+        self.events.append(('download', video_id))
+        return {'id': video_id}
+
+
+class UnavailableStreamDownloaderMock(StreamDownloaderMock):
+
+    def load(self, video_id):
+        if video_id == 'V1':
+            raise youtube_dl.utils.DownloadError("ERROR: Video unavailable")
+        return super().load(video_id)
+
+
+class LeaseStealingDownloaderMock(StreamDownloaderMock):
+    """
+    Downloading of the first video outlives lease, so channel is claimed by another worker
+    """
+
+    def __init__(self, events, cache):
+        super().__init__(events)
+        self.cache = cache
+
+    def load(self, video_id):
+        if video_id == 'V1':
+            self.cache.release_channels('w')
+            self.cache.claim_best_channels('w2')
+        return super().load(video_id)
+
+
+class StreamScrapperMock:
+    """
+    Channel has two pages of videos and page of neighbours. Events store order of loading and processing
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.parse_called = False
+
+    def parse(self, channel_id, partial_tabs=None, incremental=True):
+        self.parse_called = True
+
+    def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        if channel_id != 'C0':
+            yield Tab.HomePage, [{'owner_channel': {'id': channel_id}}], 1
+            return
+        yield Tab.HomePage, [{'owner_channel': {'id': channel_id}}], 1
+        for page_no in (1, 2):
+            self.events.append(('page', page_no))
+            yield Tab.Videos, [{'id': 'V%d' % page_no}], page_no
+        self.events.append(('page', 'channels'))
+        yield Tab.Channels, [{'channel_id': 'C1'}], 1
+
+
+class PagesScrapperMock(StreamScrapperMock):
+    """
+    The same pages, but they are returned by parse at once
+    """
+
+    def parse(self, channel_id, partial_tabs=None, incremental=True):
+        descrs = {Tab.Videos: [], Tab.Channels: []}
+        for tab, descr, _ in self.iter_parse(channel_id, partial_tabs):
+            descrs.setdefault(tab, []).extend(descr)
+        return descrs
+
+
+class OnePageScrapperMock(PagesScrapperMock):
+
+    def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        yield Tab.HomePage, [{'owner_channel': {'id': channel_id}}], 1
+        yield Tab.Videos, [{'id': 'V1'}, {'id': 'V2'}], 1
+
+
+class PartialStreamScrapperMock(StreamScrapperMock):
+
+    def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        yield from super().iter_parse(channel_id, partial_tabs)
+        if channel_id == 'C0':
+            # Next page of videos was failed
+            partial_tabs.add(Tab.Videos)
+
+
+class DeadlineStreamScrapperMock(StreamScrapperMock):
+
+    def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        if channel_id == 'C1':
+            # Loading of neighbour was stopped by deadline of scrapper
+            yield Tab.HomePage, [{'owner_channel': {'id': channel_id}}], 1
+            raise utils.DeadlineError("deadline of channel was expired")
+        yield from super().iter_parse(channel_id, partial_tabs)
+
+
+class KnownVideosParserMock:
+    stop_after_known = 1
+
+
+class IncrementalStreamScrapperMock(StreamScrapperMock):
+    """
+    The first crawl of channel is stopped by deadline after the first page of videos. Scrapper keeps incremental mode
+    of every call
+    """
+
+    def __init__(self, events):
+        super().__init__(events)
+        self.parsers = [KnownVideosParserMock()]
+        self.incremental = []
+
+    def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        self.incremental.append(incremental)
+        if len(self.incremental) == 1:
+            yield Tab.HomePage, [{'owner_channel': {'id': channel_id}}], 1
+            yield Tab.Videos, [{'id': 'V1'}], 1
+            raise utils.DeadlineError("deadline of channel was expired")
+        yield from super().iter_parse(channel_id, partial_tabs)
+
+
+class AsyncStreamScrapperMock(StreamScrapperMock):
+
+    async def parse(self, channel_id, partial_tabs=None, incremental=True):
+        self.parse_called = True
+
+    async def iter_parse(self, channel_id, partial_tabs=None, incremental=True):
+        for page in super().iter_parse(channel_id, partial_tabs):
+            await asyncio.sleep(0)
+            yield page
+
+    async def close(self):
+        pass
+
+
+class TestCrawlerStream(BaseTestClass):
+    db_path = 'data/test_crawler.sqlite'
+
+    def check_stream(self, scrapper_cls, workers):
+        events = []
+        scrapper = scrapper_cls(events)
+        cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.HARD)
+        crawler = YoutubeCrawler(
+            cache=cache, scraper=scrapper, ydl_loader=StreamDownloaderMock(events), workers=workers,
+            idle_interval=0.1, worker_id='w',
+        )
+        crawler.process(['C0'])
+        # Video of first page is downloaded before second page is loaded
+        self.assertEqual([
+            ('page', 1), ('download', 'V1'), ('page', 2), ('download', 'V2'), ('page', 'channels'),
+        ], events)
+        self.assertFalse(scrapper.parse_called)
+        self.assertEqual({'V1', 'V2'}, cache.check_exist_videos(['V1', 'V2', 'V3']))
+        for channel_id in ('C0', 'C1'):
+            self.assertTrue(cache.get_channel_descr(channel_id)['downloaded'])
+        crawler.close()
+        # Descriptions are checked by reopened data base
+        cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.OLD)
+        self.addCleanup(self.remove_db)
+        return cache
+
+    def remove_db(self):
+        for path in (self.db_path, self.db_path + '-wal', self.db_path + '-shm'):
+            self.remove_filename(path)
+
+    def test_stream(self):
+        self.check_stream(StreamScrapperMock, workers=1).close()
+
+    def test_stream_workers(self):
+        self.check_stream(StreamScrapperMock, workers=2).close()
+
+    def test_async_stream(self):
+        self.check_stream(AsyncStreamScrapperMock, workers=2).close()
+
+    def test_partial(self):
+        cache = self.check_stream(PartialStreamScrapperMock, workers=1)
+        self.assertEqual(['videos'], json.loads(cache.get_channel_descr('C0')['full_description'])['partial_tabs'])
+        self.assertNotIn('partial_tabs', json.loads(cache.get_channel_descr('C1')['full_description']))
+        cache.close()
+
+    def test_deadline(self):
+        cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.HARD)
+        self.addCleanup(self.remove_db)
+        crawler = YoutubeCrawler(
+            cache=cache, scraper=DeadlineStreamScrapperMock([]), ydl_loader=StreamDownloaderMock([]),
+            idle_interval=0.1, worker_id='w', defer_seconds=60.,
+        )
+        crawler.process(['C0'])
+        self.assertTrue(cache.get_channel_descr('C0')['downloaded'])
+        # Deferred channel isn't failed, but it isn't claimed till delay
+        channel = cache.get_channel_descr('C1')
+        self.assertTrue(channel['valid'])
+        self.assertFalse(channel['downloaded'])
+        self.assertEqual([], cache.claim_best_channels('w2'))
+        crawler.close()
+
+    def test_failed_video(self):
+        self.addCleanup(self.remove_db)
+        for stream in (True, False):
+            cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.HARD)
+            crawler = YoutubeCrawler(
+                cache=cache, scraper=PagesScrapperMock([]), ydl_loader=UnavailableStreamDownloaderMock([]),
+                idle_interval=0.1, worker_id='w', stream=stream,
+            )
+            crawler.process(['C0'])
+            # Unavailable video is stored as invalid, so channel isn't failed
+            channel = cache.get_channel_descr('C0')
+            self.assertTrue(channel['valid'], stream)
+            self.assertTrue(channel['downloaded'], stream)
+            self.assertFalse(cache.get_video_descr('V1')['valid'], stream)
+            self.assertTrue(cache.get_video_descr('V2')['valid'], stream)
+            crawler.close()
+            self.remove_db()
+
+    def test_expired_lease(self):
+        self.addCleanup(self.remove_db)
+        for stream in (True, False):
+            events = []
+            cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.HARD)
+            crawler = YoutubeCrawler(
+                cache=cache, scraper=OnePageScrapperMock(events), ydl_loader=LeaseStealingDownloaderMock(events, cache),
+                idle_interval=0.1, worker_id='w', stream=stream,
+            )
+            crawler.process(['C0'])
+            # Lease is renewed before every video, so videos of channel aren't downloaded by two workers
+            self.assertEqual([('download', 'V1')], events, stream)
+            self.assertFalse(cache.get_channel_descr('C0')['downloaded'], stream)
+            crawler.close()
+            self.remove_db()
+
+    def test_deferred_incremental(self):
+        cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.HARD)
+        self.addCleanup(self.remove_db)
+        scrapper = IncrementalStreamScrapperMock([])
+        crawler = YoutubeCrawler(
+            cache=cache, scraper=scrapper, ydl_loader=StreamDownloaderMock([]), idle_interval=0.1, worker_id='w',
+            defer_seconds=0.,
+        )
+        crawler.process(['C0'])
+        # Video of the first page was stored before deadline, but channel is loaded again without incremental mode,
+        # else older videos would be never loaded
+        self.assertEqual([False, False], scrapper.incremental[:2])
+        self.assertTrue(cache.get_channel_descr('C0')['downloaded'])
+        self.assertEqual({'V1', 'V2'}, cache.check_exist_videos(['V1', 'V2']))
+        self.assertTrue(cache.is_crawl_complete('C0'))
+        crawler.close()
+
+
+class TestCrawlerWorkers(BaseTestClass):
+    db_path = 'data/test_crawler.sqlite'
+
+    def check_workers(self, workers, worker_id=None):
+        scrapper = GraphScrapperMock(count=31, latency=0.02)
+        cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.HARD)
+        crawler = YoutubeCrawler(
+            cache=cache, scraper=scrapper, ydl_loader=DownloaderMock(), workers=workers, idle_interval=0.1,
+            worker_id=worker_id,
+        )
+        crawler.process(['C0'])
+        self.assertEqual(sorted('C%d' % i for i in range(31)), sorted(scrapper.parsed))
+        for i in range(31):
+            self.assertTrue(cache.get_channel_descr('C%d' % i)['downloaded'])
+        crawler.close()
+        for path in (self.db_path, self.db_path + '-wal', self.db_path + '-shm'):
+            self.remove_filename(path)
+        return scrapper
+
+    def test_one_worker(self):
+        self.assertEqual(1, self.check_workers(1, worker_id='w').max_active)
+
+    def test_many_workers(self):
+        self.assertLess(1, self.check_workers(4).max_active)
+
+    def test_async_workers(self):
+        scrapper = AsyncGraphScrapperMock(count=31, latency=0.02)
+        cache = DBSqlLiteCache(path=self.db_path, db_mod=DB_MOD.HARD)
+        crawler = YoutubeCrawler(cache=cache, scraper=scrapper, ydl_loader=DownloaderMock(), workers=8,
+                                 idle_interval=0.1)
+        crawler.process(['C0'])
+        self.assertEqual(sorted('C%d' % i for i in range(31)), sorted(scrapper.parsed))
+        self.assertLess(1, scrapper.max_active)
+        self.assertTrue(scrapper.closed)
+        for i in range(31):
+            self.assertTrue(cache.get_channel_descr('C%d' % i)['downloaded'])
+        crawler.close()
+        for path in (self.db_path, self.db_path + '-wal', self.db_path + '-shm'):
+            self.remove_filename(path)
+
+    def test_wrong_workers(self):
+        self.assertRaises(AttributeError, YoutubeCrawler, cache=CacheMock(None, 0), scraper=ScrapperMock(),
+                          ydl_loader=DownloaderMock(), workers=0)
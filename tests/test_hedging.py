@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from crawler import loaders
+from crawler.hedging import Hedging, LatencyTracker
+from tests.utils import BaseTestClass
+
+
+class SlowFirstHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in of browse_ajax: the first request of every continuation is slow, its duplicates are fast
+    """
+    protocol_version = 'HTTP/1.1'
+    latency = 0.5
+    lock = threading.Lock()
+    hits = Counter()
+
+    def do_GET(self):
+        ctoken = parse_qs(urlparse(self.path).query)['ctoken'][0]
+        with self.lock:
+            self.hits[ctoken] += 1
+            first = self.hits[ctoken] == 1
+        if first:
+            time.sleep(self.latency)
+        body = b'{"Ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestLatencyTracker(BaseTestClass):
+
+    def test_percentile(self):
+        tracker = LatencyTracker(percentile=90., window=10, min_samples=5, initial_delay=1.)
+        for latency in (0.1, 0.2, 0.3, 0.4):
+            tracker.add(latency)
+        # Too few latencies
+        self.assertEqual(1., tracker.value())
+        for latency in (0.5, 0.6, 0.7, 0.8, 0.9, 2.):
+            tracker.add(latency)
+        self.assertEqual(0.9, tracker.value())
+        # Old latencies are out of window
+        for _ in range(10):
+            tracker.add(0.05)
+        self.assertEqual(0.05, tracker.value())
+
+    def test_wrong_attributes(self):
+        self.assertRaises(AttributeError, LatencyTracker, percentile=0)
+        self.assertRaises(AttributeError, LatencyTracker, window=0)
+        self.assertRaises(AttributeError, Hedging, max_ratio=2.)
+        self.assertRaises(AttributeError, Hedging, max_workers=1)
+
+
+class TestHedgedReloader(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        SlowFirstHandler.hits.clear()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SlowFirstHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/browse_ajax' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @staticmethod
+    def create_hedging(max_ratio=1.):
+        return Hedging(initial_delay=0.05, max_ratio=max_ratio, max_workers=4)
+
+    def test_hedge(self):
+        hedging = self.create_hedging()
+        reloader = loaders.Reloader(base_url=self.url, session=loaders.create_session(), hedging=hedging)
+        start = time.perf_counter()
+        self.assertEqual({'Ok': True}, reloader.load({'ctoken': 'A', 'itct': '1'}))
+        # Duplicate answers before slow request
+        self.assertLess(time.perf_counter() - start, SlowFirstHandler.latency)
+        self.assertEqual({'requests': 1, 'hedges': 1, 'hedge_wins': 1}, hedging.as_dict())
+        self.assertEqual(2, SlowFirstHandler.hits['A'])
+
+    def test_budget(self):
+        hedging = self.create_hedging(max_ratio=0.)
+        reloader = loaders.Reloader(base_url=self.url, session=loaders.create_session(), hedging=hedging)
+        start = time.perf_counter()
+        self.assertEqual({'Ok': True}, reloader.load({'ctoken': 'B', 'itct': '1'}))
+        # Budget of duplicates is empty, so slow request is waited for
+        self.assertLessEqual(SlowFirstHandler.latency, time.perf_counter() - start)
+        self.assertEqual({'requests': 1, 'hedges': 0, 'hedge_wins': 0}, hedging.as_dict())
+        self.assertEqual(1, SlowFirstHandler.hits['B'])
+
+    def test_fast(self):
+        hedging = self.create_hedging()
+        reloader = loaders.Reloader(base_url=self.url, session=loaders.create_session(), hedging=hedging)
+        SlowFirstHandler.hits['C'] = 1
+        self.assertEqual({'Ok': True}, reloader.load({'ctoken': 'C', 'itct': '1'}))
+        # Fast request isn't duplicated
+        self.assertEqual(0, hedging.hedges)
+
+    def test_async_hedge(self):
+        hedging = self.create_hedging()
+        reloader = loaders.AsyncReloader(base_url=self.url, hedging=hedging)
+
+        async def load():
+            try:
+                return await reloader.load({'ctoken': 'D', 'itct': '1'})
+            finally:
+                await reloader.close()
+
+        start = time.perf_counter()
+        self.assertEqual({'Ok': True}, asyncio.run(load()))
+        self.assertLess(time.perf_counter() - start, SlowFirstHandler.latency)
+        self.assertEqual({'requests': 1, 'hedges': 1, 'hedge_wins': 1}, hedging.as_dict())
@@ -0,0 +1,159 @@
+import logging
+
+from crawler.id_set import BloomFilter, PackedIdSet, pack_channel_id, pack_video_id
+from tests.utils import BaseTestClass, SubTest
+
+
+class TestPackIds(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        self.tests_video = [
+            SubTest(
+                name="Test 1",
+                description="Canonical video id",
+                args={'video_id': '77zRrFOuW0k'},
+                object=pack_video_id,
+                want=bytes.fromhex('efbcd1ac53ae5b49'),
+            ),
+            SubTest(
+                name="Test 2",
+                description="Trailing bits of video id are not zero",
+                args={'video_id': '77zRrFOuW0l'},
+                object=pack_video_id,
+                want=None,
+            ),
+            SubTest(
+                name="Test 3",
+                description="Invalid length",
+                args={'video_id': 'XXXX'},
+                object=pack_video_id,
+                want=None,
+            ),
+            SubTest(
+                name="Test 4",
+                description="Invalid chars",
+                args={'video_id': '77zRrFOu+0k'},
+                object=pack_video_id,
+                want=None,
+            ),
+            SubTest(
+                name="Test 5",
+                description="Not ascii chars",
+                args={'video_id': '77zRrFOuЖ0k'},
+                object=pack_video_id,
+                want=None,
+            ),
+        ]
+        self.tests_channel = [
+            SubTest(
+                name="Test 1",
+                description="Canonical channel id",
+                args={'channel_id': 'UCzAzPC4VWIMHqrnIM1iBPsQ'},
+                object=pack_channel_id,
+                want=bytes.fromhex('cc0ccf0b855620c1eaae720cd6204fb1'),
+            ),
+            SubTest(
+                name="Test 2",
+                description="There is not prefix UC",
+                args={'channel_id': 'XXzAzPC4VWIMHqrnIM1iBPsQ'},
+                object=pack_channel_id,
+                want=None,
+            ),
+            SubTest(
+                name="Test 3",
+                description="Trailing bits of channel id are not zero",
+                args={'channel_id': 'UCzAzPC4VWIMHqrnIM1iBPsR'},
+                object=pack_channel_id,
+                want=None,
+            ),
+        ]
+
+    def test_video(self):
+        for test in self.tests_video:
+            self.apply_test(test, lambda obj, kwargs: obj(**kwargs))
+
+    def test_channel(self):
+        for test in self.tests_channel:
+            self.apply_test(test, lambda obj, kwargs: obj(**kwargs))
+
+
+class TestPackedIdSet(BaseTestClass):
+
+    @staticmethod
+    def create_set(ids, min_merge_size=2):
+        s = PackedIdSet(pack_video_id, 8, min_merge_size=min_merge_size)
+        s.update(ids)
+        return s
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        ids = ['77zRrFOuW0k', 'CQbaAZ1px9Y', 'W1vDil6MXV4', '-6RG9SfBkP0', '_1anwjN9tPA', 'XXXX']
+        self.tests = [
+            SubTest(
+                name="Test 1",
+                description="Empty set",
+                args={'id_': '77zRrFOuW0k'},
+                object=self.create_set([]),
+                want=False,
+            ),
+            SubTest(
+                name="Test 2",
+                description="Merged id",
+                args={'id_': '-6RG9SfBkP0'},
+                object=self.create_set(ids),
+                want=True,
+            ),
+            SubTest(
+                name="Test 3",
+                description="Not merged id",
+                args={'id_': '-6RG9SfBkP0'},
+                object=self.create_set(ids, min_merge_size=100),
+                want=True,
+            ),
+            SubTest(
+                name="Test 4",
+                description="Id can't be packed",
+                args={'id_': 'XXXX'},
+                object=self.create_set(ids),
+                want=True,
+            ),
+            SubTest(
+                name="Test 5",
+                description="There is not id",
+                args={'id_': 'W1vDil6MXV8'},
+                object=self.create_set(ids),
+                want=False,
+            ),
+        ]
+
+    def test_contains(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: obj.__contains__(**kwargs))
+
+    def test_len(self):
+        s = self.create_set(['77zRrFOuW0k', 'CQbaAZ1px9Y', '77zRrFOuW0k', 'XXXX', 'W1vDil6MXV4'])
+        self.assertEqual(4, len(s))
+        s.merge()
+        self.assertEqual(4, len(s))
+        s.update(['77zRrFOuW0k', 'CQbaAZ1px9Y', '-6RG9SfBkP0'])
+        self.assertEqual(5, len(s))
+        s.add('_1anwjN9tPA')
+        s.add('_1anwjN9tPA')
+        self.assertEqual(6, len(s))
+
+
+class TestBloomFilter(BaseTestClass):
+
+    def test_contains(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        ids = ['UC%022d' % i for i in range(1000)]
+        bloom.update(ids)
+        for id_ in ids:
+            self.assertIn(id_, bloom)
+        false_positive = sum(1 for i in range(1000, 11000) if 'UC%022d' % i in bloom)
+        self.assertLess(false_positive, 300)
+
+    def test_invalid(self):
+        self.assertRaises(AttributeError, BloomFilter, capacity=0)
+        self.assertRaises(AttributeError, BloomFilter, capacity=10, error_rate=1)
@@ -1,10 +1,16 @@
+import asyncio
 import json
 import logging
+import threading
+import time
 import unittest
 from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
 
 from crawler import utils
-from crawler.loaders import BaseLoader, Tab
+from crawler.loaders import BaseLoader, Section, Tab
 import crawler.loaders as loaders
 
 
@@ -18,7 +24,14 @@ class MockRequests:
         self.params = {} if params is None else params
         self.answ = answ
 
-    def request(self, method, url, headers, params):
+    def Session(self):
+        # Mock is session too (see loaders.create_session)
+        return self
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, headers, params, timeout=None):
         dheaders = set(self.headers.items()) - set(headers.items())
         dparams = set(self.params.items()) - set(params.items())
         if method != self.method or url != self.url or len(dheaders) != 0 or len(dparams) != 0:
@@ -77,6 +90,48 @@ class TestLoader(TestLoaderBaseClass):
         self.assertEqual(data_config, json.loads(data_config_str))
         self.assertEqual(player_config, json.loads(player_config_str))
 
+    def test_load_minified(self):
+        """
+        This data checks page without line breaks. Json contains terminators of script in strings
+        :return:
+        """
+        data_config_str = '{"responseContext":{"text": "a;\\nb", "end": ");"}}'
+        player_config_str = '{"responseContext":{"player": true}}'
+        self.answ = '<script>window["ytInitialData"] = %s;window["ytInitialPlayerResponse"] = (%s);</script>' % (
+            data_config_str, player_config_str)
+        loaders.requests.answ = self.answ
+
+        channel_id = 'test_channel'
+        tab = Tab.HomePage
+        loaders.requests.url = 'https://www.youtube.com/channel/%s/%s' % (channel_id, tab.value)
+        loader = loaders.Loader(player_config_prefix='window["ytInitialPlayerResponse"] = (')
+        player_config, data_config = loader.load(channel_id=channel_id, tab=tab, query_params=self.params)
+        self.assertEqual(data_config, json.loads(data_config_str))
+        self.assertEqual(player_config, json.loads(player_config_str))
+
+    def test_load_big_page(self):
+        """
+        This data checks page of real size (tests/data/om_tv.json)
+        :return:
+        """
+        with open('data/om_tv.json') as fd:
+            data_config = json.load(fd)
+        self.answ = '''<script >
+          window["ytInitialData"] = %s;
+          window["ytInitialPlayerResponse"] = (
+              null);
+        </script>''' % json.dumps(data_config)
+        loaders.requests.answ = self.answ
+
+        channel_id = 'test_channel'
+        tab = Tab.HomePage
+        loaders.requests.url = 'https://www.youtube.com/channel/%s/%s' % (channel_id, tab.value)
+        player_config, loaded_data_config = loaders.Loader().load(
+            channel_id=channel_id, tab=tab, query_params=self.params,
+        )
+        self.assertIsNone(player_config)
+        self.assertEqual(data_config, loaded_data_config)
+
     def test_load_1(self):
         """
         This data checks player config is INVALID
@@ -92,11 +147,11 @@ class TestLoader(TestLoaderBaseClass):
         channel_id = 'test_channel'
         tab = Tab.HomePage
         loaders.requests.url = 'https://www.youtube.com/channel/%s/%s' % (channel_id, tab.value)
-        self.assertRaises(
-            utils.JsonSerializableError,
-            loaders.Loader().load,
-            channel_id=channel_id, tab=tab, query_params=self.params
-        )
+        # Configs are decoded on access, so page without player config is loaded
+        page = loaders.Loader().load(channel_id=channel_id, tab=tab, query_params=self.params)
+        self.assertEqual(json.loads(data_config_str), page[Section.Data])
+        self.assertRaises(utils.JsonSerializableError, page.__getitem__, Section.Player)
+        self.assertRaises(utils.JsonSerializableError, tuple, page)
 
     def test_load_4(self):
         """
@@ -114,11 +169,9 @@ class TestLoader(TestLoaderBaseClass):
         channel_id = 'test_channel'
         tab = Tab.HomePage
         loaders.requests.url = 'https://www.youtube.com/channel/%s/%s' % (channel_id, tab.value)
-        self.assertRaises(
-            utils.JsonSerializableError,
-            loaders.Loader().load,
-            channel_id=channel_id, tab=tab, query_params=self.params
-        )
+        page = loaders.Loader().load(channel_id=channel_id, tab=tab, query_params=self.params)
+        self.assertEqual(json.loads(player_config_str), page[Section.Player])
+        self.assertRaises(utils.JsonSerializableError, page.__getitem__, Section.Data)
 
 
 class TestReloader(TestLoaderBaseClass):
@@ -234,3 +287,246 @@ class TestBaseLoader(TestLoaderBaseClass):
             BaseLoader()._get_resp_text,
             url=self.url, params=self.params, headers={}, method=self.method
         )
+
+
+class MockSession:
+    """
+    This mock replaces aiohttp.ClientSession. Answers are got from MockRequests
+    """
+
+    class Resp:
+        def __init__(self, resp):
+            self.status = resp.status_code
+            self._text = resp.text
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, exc_type, exc_val, exc_tb):
+            return False
+
+        async def text(self):
+            return self._text
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def request(self, method, url, headers, params, timeout=None):
+        return self.Resp(self.requests.request(method, url, headers=headers, params=params))
+
+
+class TestAsyncLoaders(TestLoaderBaseClass):
+
+    def test_load(self):
+        data_config_str = '{"responseContext":{"player": true, "data": false}}'
+        loaders.requests.answ = '''  <script >
+          window["ytInitialData"] = %s;
+          window["ytInitialPlayerResponse"] = (
+              %s);
+        </script>        ''' % (data_config_str, data_config_str)
+        loaders.requests.url = 'https://www.youtube.com/channel/test_channel/featured'
+        loader = loaders.AsyncLoader(session=MockSession(loaders.requests))
+        player_config, data_config = asyncio.run(loader.load('test_channel', Tab.HomePage, self.params))
+        self.assertEqual(data_config, json.loads(data_config_str))
+        self.assertEqual(player_config, json.loads(data_config_str))
+
+        loaders.requests.url = 'https://another.url'
+        self.assertRaises(utils.RequestError, asyncio.run, loader.load('test_channel', Tab.HomePage, self.params))
+
+    def test_reload(self):
+        loaders.requests.url = 'https://www.youtube.com/browse_ajax/'
+        next_page_token = {'ctoken': '123', 'itct': '456'}
+        loaders.requests.params = {'ctoken': '123', 'continuation': '123', 'itct': '456'}
+        reloader = loaders.AsyncReloader(session=MockSession(loaders.requests))
+        self.assertEqual(json.loads(self.answ), asyncio.run(reloader.load(next_page_token)))
+        self.assertRaises(utils.ReloadTokenError, asyncio.run, reloader.load({'ctoken': '', 'itct': '456'}))
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_GET(self):
+        self.connections.add(self.client_address)
+        body = b'{"Ok": true}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StalledHandler(BaseHTTPRequestHandler):
+    """
+    Server accepts request, but doesn't answer
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        time.sleep(1.)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        loaders.requests = requests
+
+    def test_create_session(self):
+        session = loaders.create_session(pool_connections=2, pool_maxsize=20)
+        adapter = session.get_adapter('https://www.youtube.com/')
+        self.assertEqual(20, adapter._pool_maxsize)
+        self.assertEqual(0, adapter.max_retries.total)
+
+    def test_keep_alive(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d/browse_ajax' % server.server_port
+
+        session = loaders.create_session()
+        reloader = loaders.Reloader(base_url=url, session=session)
+        loader = BaseLoader(session=session)
+        for i in range(5):
+            self.assertEqual({'Ok': True}, reloader.load({'ctoken': str(i), 'itct': '1'}))
+            self.assertEqual('{"Ok": true}', loader._get_resp_text(url))
+        # All requests of loaders with one session use one connection
+        self.assertEqual(1, len(KeepAliveHandler.connections))
+        session.close()
+        server.shutdown()
+        server.server_close()
+
+    def test_read_timeout(self):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StalledHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d/browse_ajax' % server.server_port
+
+        # Stalled connection doesn't hang worker
+        start = time.perf_counter()
+        loader = BaseLoader(timeout=(1., 0.2))
+        self.assertRaises(utils.RequestError, loader._get_resp_text, url)
+        async_loader = loaders.AsyncBaseLoader(timeout=(1., 0.2))
+
+        async def load():
+            try:
+                return await async_loader._get_resp_text(url)
+            finally:
+                await async_loader.close()
+
+        self.assertRaises(utils.RequestError, asyncio.run, load())
+        self.assertLess(time.perf_counter() - start, 0.9)
+        server.shutdown()
+        server.server_close()
+
+
+class BigPageHandler(BaseHTTPRequestHandler):
+    """
+    Page with data config at the beginning and long tail after it
+    """
+    protocol_version = 'HTTP/1.1'
+    data_config = {'responseContext': {'data': True, 'text': 'a "quoted" } ] { [ \\ text'}}
+    page = ('<html><script>window["ytInitialData"] = %s;\n</script>%s</html>' % (
+        json.dumps(data_config), '<div>%s</div>' % ('a' * 500000),
+    )).encode('utf-8')
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.page)))
+        self.end_headers()
+        try:
+            for i in range(0, len(self.page), 16384):
+                self.wfile.write(self.page[i:i + 16384])
+        except (BrokenPipeError, ConnectionResetError):
+            # Client closes connection after needed config
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPageScanner(unittest.TestCase):
+
+    def test_chunks(self):
+        prefix = 'window["ytInitialData"] = '
+        config = {'a': 'x"}]\\', 'b': [1, {'c': 'юникод'}]}
+        page = ('<script>%s%s;\n</script><div>tail</div>' % (prefix, json.dumps(config, ensure_ascii=False)))
+        page = page.encode('utf-8')
+        end = page.index(b'</script>') + len('</script>')
+        # Prefix, terminator and multibyte symbols are split by chunks of any size
+        for size in (1, 2, 3, 7, 64):
+            scanner = loaders.PageScanner([prefix])
+            done_at = None
+            for i in range(0, len(page), size):
+                if scanner.feed(page[i:i + size]):
+                    done_at = i + size
+                    break
+            self.assertIsNotNone(done_at, size)
+            self.assertLess(done_at - end, size, size)
+            page_config = loaders.PageConfig(scanner.text(), {Section.Data: prefix})
+            self.assertEqual(config, page_config[Section.Data], size)
+
+    def test_prefixes(self):
+        scanner = loaders.PageScanner(['a = ', 'b = '])
+        self.assertFalse(scanner.feed(b'<script>a = null;</script>'))
+        self.assertFalse(scanner.feed(b'<script>b = {"x": 1};</scr'))
+        self.assertTrue(scanner.feed(b'ipt><div>tail</div>'))
+
+    def test_missed_prefix(self):
+        scanner = loaders.PageScanner(['window["ytInitialData"] = '])
+        self.assertFalse(scanner.feed(b'<html>window["ytInitialPlayerResponse"] = {}</script></html>'))
+
+
+class TestStreamedLoader(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        loaders.requests = requests
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), BigPageHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/channel/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def check_stats(self, loader):
+        stats = loader.stream_stats()[Tab.HomePage.value]
+        self.assertEqual(1, stats['pages'])
+        self.assertEqual(1, stats['early_stops'])
+        # The most of page isn't read
+        self.assertLess(stats['bytes_read'], 100000)
+        self.assertEqual(len(BigPageHandler.page), stats['bytes_read'] + stats['bytes_saved'])
+
+    def test_load(self):
+        loader = loaders.Loader(base_url=self.url, session=loaders.create_session(), stream_sections={Section.Data})
+        page = loader.load('test_channel')
+        self.assertEqual(BigPageHandler.data_config, page[Section.Data])
+        # Player config isn't streamed
+        self.assertRaises(utils.JsonSerializableError, page.__getitem__, Section.Player)
+        self.check_stats(loader)
+
+        # Whole page is read without sections
+        page = loaders.Loader(base_url=self.url).load('test_channel')
+        self.assertEqual(BigPageHandler.data_config, page[Section.Data])
+
+    def test_load_async(self):
+        loader = loaders.AsyncLoader(base_url=self.url, stream_sections={Section.Data})
+
+        async def load():
+            try:
+                return await loader.load('test_channel')
+            finally:
+                await loader.close()
+
+        self.assertEqual(BigPageHandler.data_config, asyncio.run(load())[Section.Data])
+        self.check_stats(loader)
+
+    def test_wrong_attributes(self):
+        self.assertRaises(AttributeError, loaders.Loader, stream_sections={Section.Data}, chunk_size=0)
@@ -199,3 +199,67 @@ class TestReloaderParser(BaseTestClass):
     def test_is_final_page(self):
         for test in self.tests_is_final_page:
             self.apply_test(test, lambda obj, kwargs: obj.is_final_page(**kwargs))
+
+
+class MockIdJq(MockJq):
+    def transform(self, data_config):
+        return data_config
+
+
+class TestReloaderParserKnown(BaseTestClass):
+    """
+    Incremental mode: parser stops after known items in a row
+    """
+
+    known_ids = {'v2', 'v3', 'v4', 'v5'}
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        parsers.open = MockOpen
+        parsers.jq = MockIdJq
+        self.tests = [
+            self.__create_subtest(pages=[['v0', 'v1']], stop_after_known=2, want=False, test_num=1),
+            self.__create_subtest(pages=[['v0', 'v2', 'v3']], stop_after_known=2, want=True, test_num=2),
+            self.__create_subtest(pages=[['v2', 'v1', 'v3']], stop_after_known=2, want=False, test_num=3),
+            self.__create_subtest(pages=[['v1', 'v2'], ['v3', 'v6']], stop_after_known=2, want=False, test_num=4),
+            self.__create_subtest(pages=[['v1', 'v2'], ['v3', 'v4']], stop_after_known=3, want=True, test_num=5),
+            self.__create_subtest(pages=[[], ['v2']], stop_after_known=1, want=True, test_num=6),
+        ]
+
+    def __create_subtest(self, pages, stop_after_known, want, test_num):
+        calls = []
+
+        def check_exist(ids):
+            calls.append(ids)
+            return {video_id for video_id in ids if video_id in self.known_ids}
+
+        parser = parsers.ReloaderParser(
+            max_page=None,
+            tab=mockTab,
+            jq_load_path='load',
+            jq_reload_path='reload',
+            stop_after_known=stop_after_known,
+            check_exist=check_exist,
+        )
+        for i, page in enumerate(pages):
+            parser.parse(config={
+                'next_page_token': {'itct': 'itct', 'ctoken': 'token'},
+                mockTab.value: [{'id': video_id} for video_id in page],
+            }, is_reload=i > 0)
+        # Every page is checked by one call
+        self.assertEqual(pages, calls)
+        return SubTest(
+            name="Test %d" % test_num,
+            description="pages: %s, stop after known: %d" % (pages, stop_after_known),
+            object=parser,
+            want=want,
+        )
+
+    def test_is_final_page(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: obj.is_final_page(**kwargs))
+
+    def test_wrong_attributes(self):
+        kwargs = {'max_page': None, 'tab': mockTab, 'jq_load_path': 'load', 'jq_reload_path': 'reload'}
+        self.assertRaises(AttributeError, parsers.ReloaderParser, stop_after_known=0, check_exist=set, **kwargs)
+        self.assertRaises(AttributeError, parsers.ReloaderParser, stop_after_known=1, **kwargs)
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+
+import youtube_dl
+
+from crawler import utils
+from crawler.loaders import BaseLoader
+from crawler.rate_limit import AdaptiveRateLimiter, youtube_dl_status_code
+from tests.test_loaders import MockRequests
+from tests.utils import BaseTestClass, SubTest
+import crawler.loaders as loaders
+
+
+class TestYoutubeDlStatusCode(BaseTestClass):
+
+    def setUp(self):
+        errors = [
+            ("too many requests", youtube_dl.utils.DownloadError("ERROR: HTTP Error 429: Too Many Requests"), 429),
+            ("server error", youtube_dl.utils.ExtractorError("Unable to download webpage: HTTP Error 503"), 503),
+            ("video is unavailable", youtube_dl.utils.DownloadError("ERROR: Video unavailable"), None),
+        ]
+        self.tests = [
+            SubTest(
+                name="Test %d" % (i + 1),
+                description=description,
+                object=e,
+                want=want,
+            ) for i, (description, e, want) in enumerate(errors)
+        ]
+
+    def test_youtube_dl_status_code(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: youtube_dl_status_code(obj))
+
+
+class TestAdaptiveRateLimiter(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    def test_aimd(self):
+        limiter = AdaptiveRateLimiter(rate=4., min_rate=1., max_rate=5., increase=0.5, cooldown=0.)
+        limiter.record(200, 0.1)
+        self.assertAlmostEqual(4.5, limiter.rate)
+        limiter.record(429, 0.1)
+        self.assertAlmostEqual(2.25, limiter.rate)
+        # Failed connection is throttling too
+        limiter.record(None)
+        limiter.record(503)
+        self.assertAlmostEqual(1., limiter.rate)
+        self.assertEqual(3, limiter.throttled)
+        # Rate is limited by max_rate
+        for _ in range(10):
+            limiter.record(200)
+        self.assertAlmostEqual(5., limiter.rate)
+        # Not found isn't throttling
+        limiter.record(404)
+        self.assertAlmostEqual(5., limiter.rate)
+
+    def test_cooldown(self):
+        limiter = AdaptiveRateLimiter(rate=4., min_rate=0.5, cooldown=0.1)
+        # Requests in flight fail together, but rate is decreased once
+        for _ in range(3):
+            limiter.record(429)
+        self.assertAlmostEqual(2., limiter.rate)
+        time.sleep(0.15)
+        limiter.record(429)
+        self.assertAlmostEqual(1., limiter.rate)
+        self.assertEqual(2, limiter.throttled)
+
+    def test_latency(self):
+        limiter = AdaptiveRateLimiter(rate=4., increase=1., target_latency=1.)
+        limiter.record(200, 0.5)
+        self.assertAlmostEqual(5., limiter.rate)
+        limiter.record(200, 2.)
+        self.assertAlmostEqual(2.5, limiter.rate)
+        # Unknown latency isn't checked
+        limiter.record(200)
+        self.assertAlmostEqual(3.5, limiter.rate)
+
+    def test_acquire(self):
+        limiter = AdaptiveRateLimiter(rate=20., max_rate=20., burst=1.)
+        start = time.perf_counter()
+        for _ in range(5):
+            limiter.acquire()
+        # The first request is allowed at once, 4 requests wait 0.05 seconds
+        self.assertLessEqual(0.18, time.perf_counter() - start)
+        self.assertLess(0.15, limiter.wait_seconds)
+
+    def test_acquire_async(self):
+        limiter = AdaptiveRateLimiter(rate=20., max_rate=20., burst=1.)
+
+        async def acquire():
+            await asyncio.gather(*[limiter.acquire_async() for _ in range(5)])
+
+        start = time.perf_counter()
+        asyncio.run(acquire())
+        # Concurrent coroutines wait in turn
+        self.assertLessEqual(0.18, time.perf_counter() - start)
+
+    def test_burst(self):
+        limiter = AdaptiveRateLimiter(rate=1., burst=5.)
+        start = time.perf_counter()
+        for _ in range(5):
+            limiter.acquire()
+        self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertEqual(0., limiter.wait_seconds)
+
+    def test_wrong_attributes(self):
+        self.assertRaises(AttributeError, AdaptiveRateLimiter, rate=0.1, min_rate=0.2)
+        self.assertRaises(AttributeError, AdaptiveRateLimiter, rate=100., max_rate=50.)
+        self.assertRaises(AttributeError, AdaptiveRateLimiter, min_rate=0.)
+        self.assertRaises(AttributeError, AdaptiveRateLimiter, burst=0.5)
+        self.assertRaises(AttributeError, AdaptiveRateLimiter, decrease_factor=1.)
+
+
+class TestLoaderRateLimiter(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        self.url = 'https://data.ru'
+        self.answ = '{"Ok": true}'
+        loaders.requests = MockRequests(answ=self.answ, url=self.url, headers={})
+
+    def test_record(self):
+        limiter = AdaptiveRateLimiter(rate=4., increase=1., cooldown=0.)
+        loader = BaseLoader(rate_limiter=limiter)
+        self.assertEqual(self.answ, loader._get_resp_text(url=self.url, headers={}))
+        self.assertAlmostEqual(5., limiter.rate)
+        # Mock answers 404 to unknown url. It isn't throttling, so rate isn't decreased
+        self.assertRaises(Exception, loader._get_resp_text, url='https://unknown.ru', headers={})
+        self.assertAlmostEqual(6., limiter.rate)
+
+    def test_failed_connection(self):
+        class FailingSession:
+            def request(self, method, url, headers, params, timeout=None):
+                raise ConnectionError()
+
+        limiter = AdaptiveRateLimiter(rate=4., cooldown=0.)
+        loader = BaseLoader(session=FailingSession(), rate_limiter=limiter)
+        self.assertRaises(utils.RequestError, loader._get_resp_text, url=self.url)
+        self.assertAlmostEqual(2., limiter.rate)
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import socket
+import time
+
+import youtube_dl
+
+from crawler import utils
+from crawler.retry import Backoff, CircuitBreaker, RetryMetrics, RetryPolicy, is_transient
+from tests.utils import BaseTestClass, SubTest
+
+
+class FailingCall:
+    """
+    Call raises exceptions from list and returns 'ok' after them
+    """
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if len(self.errors) != 0:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+class TestIsTransient(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        errors = [
+            ("connection was failed", utils.RequestError("Connection is failed", ConnectionError()), True),
+            ("too many requests", utils.RequestError("status code", status_code=429), True),
+            ("server error", utils.RequestError("status code", status_code=503), True),
+            ("not found", utils.RequestError("status code", status_code=404), False),
+            ("layout was changed", utils.ParserError("next page token is not available"), False),
+            ("page isn't json", utils.JsonSerializableError("serialize is failed"), False),
+            ("base error with request error", utils.CrawlerError(e=utils.RequestError("", status_code=500)), True),
+            ("base error with parser error", utils.CrawlerError(e=utils.ParserError("")), False),
+            ("error of programming", KeyError('id'), False),
+            ("network error", TimeoutError(), True),
+            ("unknown error", Exception("youtube-dl"), True),
+            ("video is unavailable", youtube_dl.utils.ExtractorError("Video unavailable", expected=True), False),
+            ("wrapped unavailable video", youtube_dl.utils.DownloadError("ERROR: Video unavailable", exc_info=(
+                youtube_dl.utils.ExtractorError, youtube_dl.utils.ExtractorError("", expected=True), None,
+            )), False),
+            ("youtube-dl too many requests", youtube_dl.utils.DownloadError("ERROR: HTTP Error 429: Too Many"), True),
+            ("youtube-dl not found", youtube_dl.utils.ExtractorError("Unable to download: HTTP Error 404"), False),
+            ("youtube-dl network error", youtube_dl.utils.DownloadError("ERROR: timed out", exc_info=(
+                socket.timeout, socket.timeout("timed out"), None,
+            )), True),
+            ("youtube-dl extraction error", youtube_dl.utils.ExtractorError("Unable to extract data"), False),
+        ]
+        self.tests = [
+            SubTest(
+                name="Test %d" % (i + 1),
+                description=description,
+                object=e,
+                want=want,
+            ) for i, (description, e, want) in enumerate(errors)
+        ]
+
+    def test_is_transient(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: is_transient(obj))
+
+
+class TestBackoff(BaseTestClass):
+
+    def test_delay(self):
+        backoff = Backoff(base_delay=1., factor=2., max_delay=5., jitter=False)
+        self.assertEqual([1., 2., 4., 5., 5.], [backoff.delay(attempt) for attempt in range(5)])
+
+    def test_jitter(self):
+        backoff = Backoff(base_delay=1., factor=2., max_delay=5.)
+        for attempt in range(5):
+            delays = [backoff.delay(attempt) for _ in range(100)]
+            self.assertTrue(all(0 <= delay <= min(2 ** attempt, 5.) for delay in delays))
+            # Workers don't retry together
+            self.assertLess(1, len(set(delays)))
+
+    def test_wrong_attributes(self):
+        self.assertRaises(AttributeError, Backoff, base_delay=-1)
+        self.assertRaises(AttributeError, Backoff, factor=0.5)
+
+
+class TestRetryPolicy(BaseTestClass):
+
+    @staticmethod
+    def create_policy(max_attempts=3, **kwargs):
+        return RetryPolicy(max_attempts=max_attempts, backoff=Backoff(base_delay=0.01, jitter=False), **kwargs)
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    def test_transient(self):
+        policy = self.create_policy()
+        call = FailingCall([utils.RequestError("", status_code=429), ConnectionError()])
+        self.assertEqual('ok', policy.call(call))
+        self.assertEqual(3, call.calls)
+        metrics = policy.metrics.as_dict()
+        self.assertEqual(2, metrics['retries'])
+        self.assertAlmostEqual(0.01 + 0.02, metrics['sleep_seconds'])
+
+    def test_permanent(self):
+        policy = self.create_policy()
+        call = FailingCall([utils.ParserError("layout"), ConnectionError()])
+        self.assertRaises(utils.ParserError, policy.call, call)
+        self.assertEqual(1, call.calls)
+        self.assertEqual(1, policy.metrics.permanent_errors)
+        self.assertEqual(0, policy.metrics.retries)
+
+    def test_exhausted(self):
+        policy = self.create_policy()
+        call = FailingCall([ConnectionError()] * 5)
+        self.assertRaises(ConnectionError, policy.call, call)
+        self.assertEqual(3, call.calls)
+        self.assertEqual(1, policy.metrics.exhausted)
+        self.assertRaises(AttributeError, RetryPolicy, max_attempts=0)
+
+    def test_async(self):
+        policy = self.create_policy()
+        call = FailingCall([utils.RequestError("", status_code=503)])
+
+        async def load():
+            return call()
+
+        self.assertEqual('ok', asyncio.run(policy.call_async(load)))
+        self.assertEqual(2, call.calls)
+        self.assertEqual(1, policy.metrics.retries)
+
+
+class TestCircuitBreaker(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    def test_trip(self):
+        breaker = CircuitBreaker(window_seconds=10., min_requests=4, failure_rate=0.5, pause_seconds=0.2)
+        for ok in (True, False, True):
+            breaker.record(ok)
+        self.assertEqual(0., breaker.remaining())
+        breaker.record(False)
+        self.assertLess(0., breaker.remaining())
+        self.assertEqual(1, breaker.metrics.breaker_trips)
+
+        # All callers wait till breaker is closed
+        start = time.perf_counter()
+        breaker.wait()
+        self.assertLessEqual(0.15, time.perf_counter() - start)
+        self.assertEqual(0., breaker.remaining())
+        self.assertLess(0., breaker.metrics.breaker_wait_seconds)
+
+    def test_window(self):
+        breaker = CircuitBreaker(window_seconds=0.05, min_requests=2, failure_rate=0.5, pause_seconds=1.)
+        breaker.record(False)
+        time.sleep(0.1)
+        # Old error is out of window
+        breaker.record(True)
+        breaker.record(True)
+        self.assertEqual(0., breaker.remaining())
+
+    def test_policy(self):
+        metrics = RetryMetrics()
+        breaker = CircuitBreaker(min_requests=2, failure_rate=1., pause_seconds=0.1, metrics=metrics)
+        policy = RetryPolicy(max_attempts=3, backoff=Backoff(base_delay=0.), breaker=breaker)
+        call = FailingCall([utils.RequestError("", status_code=429)] * 2)
+        self.assertEqual('ok', policy.call(call))
+        # Policy shares metrics of breaker
+        self.assertIs(metrics, policy.metrics)
+        self.assertEqual(1, metrics.breaker_trips)
+        self.assertEqual(2, metrics.retries)
+        self.assertLess(0., metrics.breaker_wait_seconds)
+
+    def test_unavailable_videos(self):
+        breaker = CircuitBreaker(min_requests=2, failure_rate=0.5, pause_seconds=10.)
+        policy = RetryPolicy(max_attempts=3, backoff=Backoff(base_delay=0.), breaker=breaker)
+        for _ in range(5):
+            call = FailingCall([youtube_dl.utils.DownloadError("ERROR: Video unavailable", exc_info=(
+                youtube_dl.utils.ExtractorError, youtube_dl.utils.ExtractorError("", expected=True), None,
+            ))])
+            self.assertRaises(youtube_dl.utils.DownloadError, policy.call, call)
+            # Unavailable video isn't retried
+            self.assertEqual(1, call.calls)
+        # Channel with many unavailable videos doesn't pause workers
+        self.assertEqual(0, policy.metrics.breaker_trips)
+        self.assertEqual(5, policy.metrics.permanent_errors)
+
+    def test_wrong_attributes(self):
+        self.assertRaises(AttributeError, CircuitBreaker, min_requests=0)
+        self.assertRaises(AttributeError, CircuitBreaker, failure_rate=0)
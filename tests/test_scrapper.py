@@ -1,7 +1,13 @@
+import asyncio
 import logging
+import threading
+import time
 from collections import Counter
 
-from crawler.scrapper import Scrapper
+from crawler import utils
+from crawler.loaders import Section
+from crawler.retry import Backoff, RetryPolicy
+from crawler.scrapper import AsyncScrapper, Scrapper
 from tests import MockTab
 from tests.utils import BaseTestClass, SubTest
 
@@ -28,7 +34,7 @@ class MockLoader:
         token = None
         if not self.client.is_cur_page_last(tab):
             token = tab
-        return {'Player': True}, {'Token': token}
+        return {Section.Player: {'Player': True}, Section.Data: {'Token': token}}
 
 
 class MockReloader:
@@ -56,6 +62,19 @@ class MockParser:
         return [{'is_reload': is_reload, 'data_config': data_config}], data_config['Token']
 
 
+class KnownMockParser(MockParser):
+    """
+    All items are known, so incremental parser stops after the first page
+    """
+
+    def __init__(self, tab, max_pages):
+        super().__init__(tab, max_pages)
+        self.stop_after_known = 1
+
+    def is_final_page(self):
+        return self.stop_after_known is not None or super().is_final_page()
+
+
 class TestScrapper(BaseTestClass):
     """
     Token stores information about next page. We have loader and reloader
@@ -65,13 +84,16 @@ class TestScrapper(BaseTestClass):
     not.
     """
 
-    @staticmethod
-    def __create_scrapper(available_pages, max_pages):
+    tab_workers = 1
+
+    @classmethod
+    def __create_scrapper(cls, available_pages, max_pages):
         client = MockClientServer(available_pages=available_pages)
         scrapper = Scrapper(
             loader=MockLoader(client),
             reloader=MockReloader(client),
             parsers=[MockParser(tab=tab, max_pages=max_pages[tab]) for tab in max_pages],
+            tab_workers=cls.tab_workers,
         )
         for k in max_pages:
             scrapper.query_params[k] = k
@@ -331,3 +353,470 @@ class TestScrapper(BaseTestClass):
     def test_parse(self):
         for test in self.tests:
             self.apply_test(test, lambda obj, kwargs: obj.parse(**kwargs))
+
+
+class TestScrapperTabWorkers(TestScrapper):
+    """
+    The same tests, but tabs are loaded concurrently
+    """
+    tab_workers = 4
+
+
+class TestScrapperIterParse(BaseTestClass):
+    tab_workers = 1
+
+    def create_scrapper(self, available_pages):
+        client = MockClientServer(available_pages=available_pages)
+        scrapper = Scrapper(
+            loader=MockLoader(client),
+            reloader=MockReloader(client),
+            parsers=[MockParser(tab=tab, max_pages=None) for tab in available_pages],
+            tab_workers=self.tab_workers,
+        )
+        for tab in available_pages:
+            scrapper.query_params[tab] = tab
+        return scrapper, client
+
+    def test_page_numbers(self):
+        scrapper, _ = self.create_scrapper({MockTab.TEST0: 3, MockTab.TEST1: 2})
+        pages = {}
+        for tab, descr, page_no in scrapper.iter_parse('test_channel'):
+            self.assertEqual(1, len(descr))
+            self.assertEqual(page_no > 1, descr[0]['is_reload'])
+            pages.setdefault(tab, []).append(page_no)
+        self.assertEqual({MockTab.TEST0: [1, 2, 3], MockTab.TEST1: [1, 2]}, pages)
+
+    def test_early_close(self):
+        scrapper, client = self.create_scrapper({MockTab.TEST0: 100, MockTab.TEST1: 100})
+        pages = scrapper.iter_parse('test_channel')
+        self.assertEqual(1, next(pages)[2])
+        pages.close()
+        # Loading of tabs is stopped with iteration
+        time.sleep(0.3)
+        self.assertLess(client.tabs[MockTab.TEST0] + client.tabs[MockTab.TEST1], 2 * (100 - 1))
+
+    def test_incremental(self):
+        for incremental, pages in ((True, [1]), (False, [1, 2, 3])):
+            client = MockClientServer(available_pages={MockTab.TEST0: 3})
+            scrapper = Scrapper(
+                loader=MockLoader(client),
+                reloader=MockReloader(client),
+                parsers=[KnownMockParser(tab=MockTab.TEST0, max_pages=None)],
+                tab_workers=self.tab_workers,
+            )
+            scrapper.query_params[MockTab.TEST0] = MockTab.TEST0
+            page_numbers = [page_no for _, _, page_no in scrapper.iter_parse('test_channel', incremental=incremental)]
+            self.assertEqual(pages, page_numbers)
+            # Only copies of parsers are changed
+            self.assertEqual(1, scrapper.parsers[0].stop_after_known)
+
+
+class TestScrapperIterParseTabWorkers(TestScrapperIterParse):
+    tab_workers = 4
+
+
+class FlakyMockReloader(MockReloader):
+    """
+    Reloader fails the first requests of every page. Page from fail_always is never loaded
+    """
+
+    def __init__(self, client, fails, fail_always=None):
+        super().__init__(client)
+        self.fails = fails
+        self.fail_always = fail_always
+        self.requests = 0
+        self.pages = Counter()
+        self.__attempts = Counter()
+
+    def load(self, next_page_token):
+        self.requests += 1
+        page_no = self.pages[next_page_token] + 2
+        self.__attempts[next_page_token, page_no] += 1
+        if page_no == self.fail_always or self.__attempts[next_page_token, page_no] <= self.fails:
+            raise Exception("connection was reset")
+        self.pages[next_page_token] += 1
+        return super().load(next_page_token)
+
+
+class TestScrapperRetries(BaseTestClass):
+    tabs = [MockTab.TEST0, MockTab.TEST1]
+
+    def create_scrapper(self, reloader_kwargs, max_attempts, **kwargs):
+        client = MockClientServer(available_pages={tab: 5 for tab in self.tabs})
+        scrapper = Scrapper(
+            loader=MockLoader(client),
+            reloader=FlakyMockReloader(client, **reloader_kwargs),
+            parsers=[MockParser(tab=tab, max_pages=None) for tab in self.tabs],
+            retry_policy=RetryPolicy(max_attempts=max_attempts, backoff=Backoff(base_delay=0.)),
+            **kwargs
+        )
+        for tab in self.tabs:
+            scrapper.query_params[tab] = tab
+        return scrapper
+
+    def test_retry_request(self):
+        scrapper = self.create_scrapper({'fails': 1}, max_attempts=2)
+        descrs = scrapper.parse('test_channel')
+        self.assertEqual({tab: 5 for tab in self.tabs}, {tab: len(descrs[tab]) for tab in descrs})
+        # Only failed requests are repeated: 4 reloads of every tab and a retry of each of them
+        self.assertEqual(2 * 4 * 2, scrapper.reloader.requests)
+
+    def test_failed_channel(self):
+        scrapper = self.create_scrapper({'fails': 2}, max_attempts=2)
+        self.assertRaises(Exception, scrapper.parse, 'test_channel')
+        self.assertRaises(AttributeError, Scrapper, loader=None, reloader=None, max_attempts=0)
+
+    def test_partial(self):
+        scrapper = self.create_scrapper({'fails': 0, 'fail_always': 4}, max_attempts=3, allow_partial=True)
+        partial_tabs = set()
+        descrs = scrapper.parse('test_channel', partial_tabs=partial_tabs)
+        # Pages before failed one are kept
+        self.assertEqual({tab: 3 for tab in self.tabs}, {tab: len(descrs[tab]) for tab in descrs})
+        self.assertEqual(set(self.tabs), partial_tabs)
+        self.assertEqual(2 * (2 + 3), scrapper.reloader.requests)
+
+        scrapper = self.create_scrapper({'fails': 0, 'fail_always': 4}, max_attempts=3)
+        self.assertRaises(Exception, scrapper.parse, 'test_channel')
+
+
+class TestScrapperRetriesTabWorkers(TestScrapperRetries):
+    """
+    The same tests, but tabs are loaded concurrently
+    """
+
+    def create_scrapper(self, reloader_kwargs, max_attempts, **kwargs):
+        return super().create_scrapper(reloader_kwargs, max_attempts, tab_workers=2, **kwargs)
+
+
+class SlowMockLoader(MockLoader):
+    def __init__(self, client, latency):
+        super().__init__(client)
+        self.latency = latency
+
+    def load(self, channel_id, tab, query_params):
+        time.sleep(self.latency)
+        return super().load(channel_id, tab, query_params)
+
+
+class TestScrapperLatency(BaseTestClass):
+
+    def test_latency(self):
+        # Every tab has the only page, so latency of concurrent loading is latency of one page
+        tabs = [MockTab.TEST0, MockTab.TEST1, MockTab.TEST2]
+        client = MockClientServer(available_pages={tab: 1 for tab in tabs})
+        scrapper = Scrapper(
+            loader=SlowMockLoader(client, latency=0.2),
+            reloader=MockReloader(client),
+            parsers=[MockParser(tab=tab, max_pages=1) for tab in tabs],
+            tab_workers=3,
+        )
+        for tab in tabs:
+            scrapper.query_params[tab] = tab
+        start = time.perf_counter()
+        self.assertEqual(set(tabs), set(scrapper.parse('test_channel')))
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+    def test_slow_consumers(self):
+        # Tabs are endless, so loading of every tab waits for consumer of its pages
+        tabs = [MockTab.TEST0, MockTab.TEST1]
+        client = MockClientServer(available_pages={tab: 10 ** 6 for tab in tabs})
+        scrapper = Scrapper(
+            loader=MockLoader(client),
+            reloader=MockReloader(client),
+            parsers=[MockParser(tab=tab, max_pages=None) for tab in tabs],
+            tab_workers=2,
+            max_queued_pages=1,
+        )
+        for tab in tabs:
+            scrapper.query_params[tab] = tab
+        latencies = []
+
+        def consume(channel_id):
+            start = time.perf_counter()
+            pages = scrapper.iter_parse(channel_id)
+            next(pages)
+            latencies.append(time.perf_counter() - start)
+            # Consumer downloads videos of page
+            time.sleep(0.5)
+            pages.close()
+
+        threads = [threading.Thread(target=consume, args=('channel%d' % i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Channels don't wait for threads of another channels
+        self.assertEqual(4, len(latencies))
+        self.assertLess(max(latencies), 0.3)
+
+    def test_wrong_tab_workers(self):
+        self.assertRaises(AttributeError, Scrapper, loader=None, reloader=None, tab_workers=0)
+
+
+class SlowMockReloader(MockReloader):
+    def __init__(self, client, latency):
+        super().__init__(client)
+        self.latency = latency
+        self.requests = 0
+
+    def load(self, next_page_token):
+        self.requests += 1
+        time.sleep(self.latency)
+        return super().load(next_page_token)
+
+
+class TestScrapperDeadline(BaseTestClass):
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+    @staticmethod
+    def create_scrapper(tabs, **kwargs):
+        client = MockClientServer(available_pages={tab: 100 for tab in tabs})
+        scrapper = Scrapper(
+            loader=MockLoader(client),
+            reloader=SlowMockReloader(client, latency=0.05),
+            parsers=[MockParser(tab=tab, max_pages=None) for tab in tabs],
+            channel_deadline=0.2,
+            **kwargs
+        )
+        for tab in tabs:
+            scrapper.query_params[tab] = tab
+        return scrapper
+
+    def test_partial(self):
+        # First pages are required, so tabs which are loaded one by one can't be cut before the last one
+        for tab_workers, tabs in ((1, [MockTab.TEST0]), (2, [MockTab.TEST0, MockTab.TEST1])):
+            scrapper = self.create_scrapper(tabs, tab_workers=tab_workers, allow_partial=True)
+            partial_tabs = set()
+            start = time.perf_counter()
+            descrs = scrapper.parse('test_channel', partial_tabs=partial_tabs)
+            self.assertLess(time.perf_counter() - start, 0.4)
+            # Deadline is shared by tabs. Loaded pages are kept and tabs are marked as partial
+            self.assertEqual(set(tabs), set(descrs))
+            self.assertGreaterEqual(5 * len(tabs), scrapper.reloader.requests)
+            self.assertEqual(set(tabs), partial_tabs)
+
+    def test_deadline_error(self):
+        scrapper = self.create_scrapper([MockTab.TEST0])
+        start = time.perf_counter()
+        self.assertRaises(utils.DeadlineError, scrapper.parse, 'test_channel')
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+    def test_retries(self):
+        # Deadline isn't retried
+        scrapper = self.create_scrapper(
+            [MockTab.TEST0], retry_policy=RetryPolicy(max_attempts=3, backoff=Backoff(base_delay=0.)),
+        )
+        self.assertRaises(utils.DeadlineError, scrapper.parse, 'test_channel')
+        self.assertEqual(0, scrapper.retry_policy.metrics.retries)
+
+    def test_wrong_deadline(self):
+        self.assertRaises(AttributeError, Scrapper, loader=None, reloader=None, channel_deadline=0)
+
+
+class MockPage(dict):
+    """
+    Page stores sections which were accessed
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accessed = []
+
+    def __getitem__(self, section):
+        self.accessed.append(section)
+        return super().__getitem__(section)
+
+
+class SectionsMockLoader(MockLoader):
+    def __init__(self, client):
+        super().__init__(client)
+        self.pages = []
+
+    def load(self, channel_id, tab, query_params):
+        page = MockPage(super().load(channel_id, tab, query_params))
+        self.pages.append(page)
+        return page
+
+
+class PlayerMockParser(MockParser):
+    sections = (Section.Data, Section.Player)
+
+    def parse(self, config, is_reload=False):
+        descr, _ = super().parse({'Token': None}, is_reload)
+        descr[0]['data_config'] = config
+        return descr, config[Section.Data]['Token']
+
+
+class TestScrapperSections(BaseTestClass):
+
+    def check_sections(self, parser, scrapper_cls=Scrapper):
+        client = MockClientServer(available_pages={MockTab.TEST0: 1})
+        loader = SectionsMockLoader(client)
+        if scrapper_cls is AsyncScrapper:
+            async_load = loader.load
+
+            async def load(*args):
+                return async_load(*args)
+
+            loader.load = load
+        scrapper = scrapper_cls(loader=loader, reloader=MockReloader(client), parsers=[parser])
+        scrapper.query_params[MockTab.TEST0] = MockTab.TEST0
+        descrs = scrapper.parse('test_channel')
+        if scrapper_cls is AsyncScrapper:
+            descrs = asyncio.run(descrs)
+        return loader.pages, descrs[MockTab.TEST0][0]['data_config']
+
+    def test_data(self):
+        for scrapper_cls in (Scrapper, AsyncScrapper):
+            pages, config = self.check_sections(MockParser(tab=MockTab.TEST0, max_pages=1), scrapper_cls)
+            # Player config isn't needed by parser, so it isn't decoded
+            self.assertEqual([Section.Data], pages[0].accessed)
+            self.assertEqual({'Token': None}, config)
+
+    def test_sections(self):
+        pages, config = self.check_sections(PlayerMockParser(tab=MockTab.TEST0, max_pages=1))
+        self.assertEqual([Section.Data, Section.Player], pages[0].accessed)
+        self.assertEqual({Section.Data: {'Token': None}, Section.Player: {'Player': True}}, config)
+
+
+class AsyncMockLoader(MockLoader):
+    def __init__(self, client, latency=0.):
+        super().__init__(client)
+        self.latency = latency
+        self.active = 0
+        self.max_active = 0
+
+    async def load(self, channel_id, tab, query_params):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.latency)
+        self.active -= 1
+        return super().load(channel_id, tab, query_params)
+
+    async def close(self):
+        pass
+
+
+class AsyncMockReloader(MockReloader):
+    async def load(self, next_page_token):
+        return super().load(next_page_token)
+
+    async def close(self):
+        pass
+
+
+class TestAsyncScrapper(BaseTestClass):
+
+    @staticmethod
+    def create_scrapper(available_pages, max_pages, max_requests=100, latency=0.):
+        client = MockClientServer(available_pages=available_pages)
+        scrapper = AsyncScrapper(
+            loader=AsyncMockLoader(client, latency),
+            reloader=AsyncMockReloader(client),
+            parsers=[MockParser(tab=tab, max_pages=max_pages[tab]) for tab in max_pages],
+            max_requests=max_requests,
+        )
+        for k in max_pages:
+            scrapper.query_params[k] = k
+        return scrapper
+
+    def setUp(self):
+        logging.getLogger().setLevel(logging.CRITICAL)
+        self.tests = [
+            SubTest(
+                name="Test 1",
+                description="There aren't any parsers",
+                args={'channel_id': "test_channel"},
+                object=self.create_scrapper(available_pages={}, max_pages={}),
+                want={},
+            ),
+            SubTest(
+                name="Test 2",
+                description="Two parsers with reloading",
+                args={'channel_id': "test_channel"},
+                object=self.create_scrapper(
+                    available_pages={MockTab.TEST0: 3, MockTab.TEST1: 1},
+                    max_pages={MockTab.TEST0: 2, MockTab.TEST1: 1},
+                ),
+                want={
+                    MockTab.TEST0: [
+                        {'is_reload': False, 'data_config': {'Token': MockTab.TEST0}},
+                        {'is_reload': True, 'data_config': {'Token': MockTab.TEST0}},
+                    ],
+                    MockTab.TEST1: [
+                        {'is_reload': False, 'data_config': {'Token': None}},
+                    ],
+                },
+            ),
+        ]
+
+    def test_parse(self):
+        for test in self.tests:
+            self.apply_test(test, lambda obj, kwargs: asyncio.run(obj.parse(**kwargs)))
+
+    def test_max_requests(self):
+        scrapper = self.create_scrapper(
+            available_pages={MockTab.TEST0: 100}, max_pages={MockTab.TEST0: 1}, max_requests=3, latency=0.01,
+        )
+
+        async def parse_many():
+            return await asyncio.gather(*[scrapper.parse('channel%d' % i) for i in range(10)])
+
+        self.assertEqual(10, len(asyncio.run(parse_many())))
+        self.assertEqual(3, scrapper.loader.max_active)
+        self.assertRaises(AttributeError, self.create_scrapper, {}, {}, max_requests=0)
+
+    def test_partial(self):
+        client = MockClientServer(available_pages={MockTab.TEST0: 5})
+        reloader = FlakyMockReloader(client, fails=1, fail_always=3)
+
+        async def load(next_page_token):
+            return reloader.load(next_page_token)
+
+        reloader_mock = AsyncMockReloader(client)
+        reloader_mock.load = load
+        scrapper = AsyncScrapper(
+            loader=AsyncMockLoader(client), reloader=reloader_mock,
+            parsers=[MockParser(tab=MockTab.TEST0, max_pages=None)], allow_partial=True,
+            retry_policy=RetryPolicy(max_attempts=2, backoff=Backoff(base_delay=0.)),
+        )
+        scrapper.query_params[MockTab.TEST0] = MockTab.TEST0
+        partial_tabs = set()
+        descrs = asyncio.run(scrapper.parse('test_channel', partial_tabs=partial_tabs))
+        self.assertEqual(2, len(descrs[MockTab.TEST0]))
+        self.assertEqual({MockTab.TEST0}, partial_tabs)
+        self.assertEqual(2 + 2, reloader.requests)
+
+    def test_latency(self):
+        tabs = {MockTab.TEST0: 1, MockTab.TEST1: 1, MockTab.TEST2: 1}
+        scrapper = self.create_scrapper(available_pages=tabs, max_pages=tabs, latency=0.2)
+        start = time.perf_counter()
+        self.assertEqual(set(tabs), set(asyncio.run(scrapper.parse('test_channel'))))
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(3, scrapper.loader.max_active)
+
+    def test_deadline(self):
+        client = MockClientServer(available_pages={MockTab.TEST0: 5})
+
+        async def load(next_page_token):
+            # Request hangs, so it is cancelled at deadline
+            await asyncio.sleep(10.)
+
+        reloader = AsyncMockReloader(client)
+        reloader.load = load
+        scrapper = AsyncScrapper(
+            loader=AsyncMockLoader(client), reloader=reloader,
+            parsers=[MockParser(tab=MockTab.TEST0, max_pages=None)], channel_deadline=0.2,
+        )
+        scrapper.query_params[MockTab.TEST0] = MockTab.TEST0
+        start = time.perf_counter()
+        self.assertRaises(utils.DeadlineError, asyncio.run, scrapper.parse('test_channel'))
+        self.assertLess(time.perf_counter() - start, 0.4)
+
+        scrapper.allow_partial = True
+        partial_tabs = set()
+        descrs = asyncio.run(scrapper.parse('test_channel', partial_tabs=partial_tabs))
+        self.assertEqual(1, len(descrs[MockTab.TEST0]))
+        self.assertEqual({MockTab.TEST0}, partial_tabs)